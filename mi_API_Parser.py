@@ -27,20 +27,20 @@ import sys
 import os
 
 # Local
-MODULE_DIR = os.path.abspath( "../Modules" )
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
 if MODULE_DIR not in sys.path:
     sys.path.append( MODULE_DIR )
 from mi_Error import *
 from mi_Structured_File_2 import Structured_File
-
-# Diagnostic
-import pdb # debug
+import mi_Cache
 
 # Constants
-API_PATH = os.path.abspath( "Resources/constructor_api_def.mi" )
+API_PATH = os.path.join( os.path.dirname( os.path.abspath(__file__) ),
+        "Resources", "constructor_api_def.mi" )
 CALL_PREFIX = "UI_"
 TYPE_SECTION = "type"
 CONSTRUCTION = "constructor"
+SNAPSHOT = "api_snapshot" # Cache entry name
 
 # Regex
 # <metaclass>[ / <callname>]
@@ -59,6 +59,20 @@ class API_Parser:
     """
     def __init__( self ):
 
+        # A snapshot of the types and constructors saved by an earlier run
+        # spares us reading and parsing the API file.  It is keyed by the
+        # content of the API file, of this code and of the Structured File
+        # code that reads the API file, so a change to any one invalidates it.
+        snapshot_key = mi_Cache.file_hash( API_PATH, os.path.abspath(__file__),
+                os.path.abspath( sys.modules[ Structured_File.__module__ ].__file__ ) )
+        if self.load_snapshot( snapshot_key ):
+            return
+
+        # Parsed again from scratch, ex: in a worker process that inherited
+        # the API from its parent
+        API_Type.clear()
+        API_Constructor_Call.clear()
+
         # Import command and type sections
         self.api_data = Structured_File( API_PATH )
         self.current_api_call = None
@@ -67,6 +81,24 @@ class API_Parser:
         self.build_types()
         self.build_constructors()
 
+        mi_Cache.save( SNAPSHOT, snapshot_key,
+            { 'types':API_Type, 'constructors':API_Constructor_Call }, replace=True )
+
+    def load_snapshot( self, snapshot_key ):
+        """
+        Loads the types and constructors from a snapshot, if there is one, in
+        place of any already loaded.
+
+        """
+        snapshot = mi_Cache.load( SNAPSHOT, snapshot_key )
+        if not snapshot:
+            return False
+        API_Type.clear()
+        API_Constructor_Call.clear()
+        API_Type.update( snapshot['types'] )
+        API_Constructor_Call.update( snapshot['constructors'] )
+        return True
+
     def build_types( self ):
         """
         Parse each line of text formatted like this:
@@ -0,0 +1,365 @@
+#! /usr/bin/env python
+
+"""
+Batch Extraction
+
+Runs Phase 1 on many miUML Text Scripts.  Each script is extracted on its own
+from a clean context, on a pool of worker processes when there is more than one
+script, and the results are returned in the same order as the scripts were
+given so that reporting is deterministic no matter which worker finishes first.
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import os
+import sys
+import io
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Local
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
+if MODULE_DIR not in sys.path:
+    sys.path.append( MODULE_DIR )
+from mi_Error import *
+from mi_API_Parser import API_Parser
+from mi_Parameter import Context_Parameter
+from mi_DB_Population_Script import DB_Population_Script, connect, DEFAULT_BATCH_SIZE
+from mi_Extraction import Extraction
+import mi_Extraction
+from mi_Metamodel_Parser import Identifier_Setting
+from mi_SQL_Emitter import SQL_Emitter
+from mi_Domain_Block import extract_incremental, extract_parallel, mark_loaded
+from mi_Load_Journal import Load_Journal, journal_path
+import mi_Compiled_Model
+import mi_Fragment
+import mi_Lexer
+import mi_Log
+import mi_Phase_Timer
+from mi_Phase_Timer import phase
+import mi_Expression_Stats
+
+log = mi_Log.get_logger( 'batch' )
+
+# Constants
+TEXT_SCRIPT_EXT = ".tm"
+
+
+def find_text_scripts( paths ):
+    """
+    Expands each directory into the text scripts found beneath it, sorted by
+    path.  Files named explicitly are kept in the order given.  Returns the
+    script paths and any paths that don't exist.
+
+    """
+    scripts, missing = [], []
+    for path in paths:
+        if os.path.isdir( path ):
+            found = []
+            for dirpath, dirnames, filenames in os.walk( path ):
+                found += [ os.path.join( dirpath, f ) for f in filenames
+                        if f.endswith( TEXT_SCRIPT_EXT ) ]
+            scripts += sorted( found )
+        elif os.path.isfile( path ):
+            scripts.append( path )
+        else:
+            missing.append( path )
+    return scripts, missing
+
+
+def text_script_hash( path ):
+    """
+    Content hash of a text script and the fragments it includes, or None if
+    it can't be read, in which case the extraction reports the error.
+
+    """
+    try:
+        return mi_Fragment.script_hash( path )
+    except mi_Error:
+        return None
+
+
+def extract( path, sql_out=None, options={} ):
+    """
+    Runs Phase 1 on one text script and returns a result record:
+
+    { 'path':path, 'ok':boolean, 'error':message, 'commands':count, 'seconds':elapsed }
+
+    If an SQL output path or stream is given, the DB Commands are written to it
+    as an SQL script as they are completed rather than kept.
+
+    Options:
+        incremental - reuse the commands of unchanged domains from the last run,
+            the result gets an 'incremental' record (see extract_incremental)
+        skip_loaded - with incremental, leave out domains already loaded into
+            the target
+        target - the DB connection string the commands are to be loaded with
+        records - the result gets the 'records' of the DB Commands for loading
+        domain_jobs - extract the domains of a large script on this many
+            worker processes, or None for one per core (see extract_parallel)
+        timings - the result gets the time spent in each 'phases' of the extraction
+        expr_stats - the result gets the 'expr_stats' counted for each Expression
+        scan - scan the script memory mapped rather than line by line
+            (see Extraction.process_buffer)
+        lexer - classify statements with the linear lexers rather than the
+            patterns (see mi_Lexer)
+        identifiers - create each class's identifiers with a new_ids call,
+            which the DB must provide (see Metamodel_Parser.add_id_command)
+        cache - reuse the DB Commands cached for an unchanged script and cache
+            them otherwise, the result gets 'replayed':'cache' when reused
+        compile - write the DB Commands to this compiled model file
+
+    A compiled model given as the path is replayed rather than extracted and
+    the result gets 'replayed':'compiled'.  See mi_Compiled_Model.
+
+    """
+    start = time.perf_counter()
+    result = { 'path':path, 'ok':False, 'error':None, 'commands':0 }
+    if options.get('timings'):
+        mi_Phase_Timer.Timing['enabled'] = True
+        phases_before = mi_Phase_Timer.snapshot()
+    if options.get('expr_stats'):
+        mi_Expression_Stats.Stats['enabled'] = True
+        stats_before = mi_Expression_Stats.snapshot()
+    if 'scan' in options:
+        mi_Extraction.Scan_Setting['enabled'] = options['scan']
+    if options.get( 'lexer', False ) != mi_Lexer.Lexer_Setting['enabled']:
+        mi_Lexer.use_lexers( options.get( 'lexer', False ) )
+    Identifier_Setting['enabled'] = options.get( 'identifiers', False )
+    log.info( "Extracting %s", path )
+
+    # Nothing carries over from a script processed earlier in this process
+    for focus in Context_Parameter:
+        Context_Parameter[focus] = None
+    sql_emitter = SQL_Emitter( sql_out, path ) if sql_out else None
+    db_pop_script_obj = DB_Population_Script( sql_emitter )
+    try:
+        with phase( 'extraction' ):
+            source_hash = None
+            replay = None
+            if mi_Compiled_Model.is_compiled( path ):
+                replay = mi_Compiled_Model.read( path )
+                result['replayed'] = 'compiled'
+            elif options.get('cache') and not options.get('incremental'):
+                source_hash = text_script_hash( path )
+                replay = source_hash and mi_Compiled_Model.load_cached( source_hash )
+                if replay:
+                    result['replayed'] = 'cache'
+            if replay:
+                for record in replay:
+                    db_pop_script_obj.add_record( record )
+            elif options.get('incremental'):
+                result['incremental'] = extract_incremental(
+                        path, db_pop_script_obj, options.get('skip_loaded'),
+                        options.get('target') )
+            elif 'domain_jobs' in options:
+                result['parallel_domains'] = extract_parallel(
+                        path, db_pop_script_obj, options['domain_jobs'] )
+            else:
+                Extraction( path, db_pop_script_obj )
+            records = None
+            if not sql_emitter: # Otherwise the commands are written out and gone
+                records = [ c.record() for c in db_pop_script_obj.R11_DB_Command ]
+            if source_hash and not replay and records is not None:
+                mi_Compiled_Model.save_cached( source_hash, records, path )
+            if options.get('compile'):
+                if records is None:
+                    raise mi_Error( "A model can't be compiled while it is written as SQL" )
+                mi_Compiled_Model.write( options['compile'], records, path,
+                        source_hash or text_script_hash( path ) )
+    except Exception as e: # One bad script must not stop the batch
+        result['error'] = str(e) if isinstance( e, mi_Error ) else (
+                e.__class__.__name__ + ": " + str(e) )
+        if sql_emitter:
+            sql_emitter.abort( result['error'] )
+    else:
+        result['ok'] = True
+        if sql_emitter:
+            sql_emitter.close()
+        if options.get('records'):
+            result['records'] = records
+    result['commands'] = db_pop_script_obj.command_count()
+    result['seconds'] = time.perf_counter() - start
+    if options.get('timings'):
+        result['phases'] = mi_Phase_Timer.difference( mi_Phase_Timer.snapshot(), phases_before )
+    if options.get('expr_stats'):
+        result['expr_stats'] = mi_Expression_Stats.difference(
+                mi_Expression_Stats.snapshot(), stats_before )
+    return result
+
+
+def extract_captured( path, sql_out=None, options={} ):
+    """
+    Worker side extraction.  Output from concurrent workers would be
+    interleaved at random, so each script's output is captured in the result's
+    'log' for the parent to write out in order.
+
+    """
+    captured = io.StringIO()
+    handle = mi_Log.capture( captured )
+    try:
+        result = extract( path, sql_out, options )
+    finally:
+        mi_Log.release( handle )
+    result['log'] = captured.getvalue()
+    return result
+
+
+def init_worker( log_level ):
+    """
+    Each worker loads the API once and keeps it for all of its scripts.
+
+    """
+    mi_Log.set_level( log_level )
+    API_Parser()
+
+
+def extract_all( paths, jobs=None, sql_outs=None, options={}, compile_outs=None ):
+    """
+    Extracts each text script and returns the results in path order.  A single
+    script is extracted in this process, which must already have loaded the API.
+    Otherwise the scripts are spread over a pool of jobs worker processes,
+    one per available core by default.
+
+    The optional sql_outs gives an SQL output for each path.  Only an in
+    process extraction may write to a stream, workers need file paths.
+    The optional compile_outs likewise gives a compiled model file for each
+    path.  The options apply to every script, see extract().
+
+    """
+    sql_outs = sql_outs or [ None ] * len( paths )
+    path_options = [ dict( options, compile=c ) if c else options
+            for c in ( compile_outs or [ None ] * len( paths ) ) ]
+    if len( paths ) < 2 or jobs == 1:
+        # The jobs go to the domains of the script instead
+        return [ extract( p, s, dict( o, domain_jobs=jobs ) )
+                for p, s, o in zip( paths, sql_outs, path_options ) ]
+
+    jobs = min( jobs or os.cpu_count() or 1, len( paths ) )
+    results = []
+    with ProcessPoolExecutor( max_workers=jobs, initializer=init_worker,
+            initargs=( mi_Log.level(), ) ) as pool:
+        for r in pool.map( extract_captured, paths, sql_outs, path_options ):
+            mi_Log.replay( r.pop('log') )
+            if 'phases' in r:
+                mi_Phase_Timer.accumulate( r['phases'] )
+            if 'expr_stats' in r:
+                mi_Expression_Stats.accumulate( r['expr_stats'] )
+            results.append( r )
+    return results
+
+
+def load_all( results, dsn, batch_size=DEFAULT_BATCH_SIZE, connections=1, resumable=False,
+        bulk=False ):
+    """
+    Phase 2: executes the DB Commands of each successfully extracted script,
+    in order, each in its own transaction.  Processing ends at the first script
+    that fails to load.  Each result gets 'loaded' or a 'load_error'.  With
+    more than one connection, independent parts of a script are executed
+    concurrently, see DB_Population_Script.execute_concurrent().  A resumable
+    load commits each script in checkpoints and picks up where an earlier one
+    failed, see mi_Load_Journal.  A bulk load stages each script with COPY and
+    applies it on the DB, see mi_Bulk_Loader.
+
+    Returns True if every script was loaded.
+
+    """
+    for r in results:
+        db_pop_script_obj = DB_Population_Script()
+        for record in r['records']:
+            db_pop_script_obj.add_record( record )
+        try:
+            if bulk:
+                db_pop_script_obj.execute_bulk( connect( dsn ) )
+            elif resumable:
+                journal = Load_Journal( journal_path( r['path'] ), dsn )
+                db_pop_script_obj.execute( connect( dsn ), batch_size, journal )
+            elif connections > 1:
+                db_pop_script_obj.execute_concurrent(
+                        lambda: connect( dsn ), connections, batch_size )
+            else:
+                db_pop_script_obj.execute( connect( dsn ), batch_size )
+        except mi_Error as e:
+            r['load_error'] = str(e)
+            return False
+        r['loaded'] = True
+        if 'incremental' in r:
+            mark_loaded( r['path'], r['incremental']['blocks'], dsn )
+    return True
+
+
+def roll_back_all( paths, dsn, out=sys.stdout ):
+    """
+    Deletes the domains committed by an unfinished resumable load of each
+    script, one line per script.  Returns the number of failures.
+
+    """
+    failed = 0
+    for path in paths:
+        try:
+            journal = Load_Journal( journal_path( path ), dsn )
+            if not journal.done() and not journal.pending:
+                print( "{}: no partial load".format( path ), file=out )
+                continue
+            domains = journal.roll_back( connect( dsn ) )
+        except mi_Error as e:
+            failed += 1
+            print( "{}: ROLLBACK FAILED: {}".format( path, e ), file=out )
+        else:
+            print( "{}: deleted {}".format( path, ", ".join( domains ) or "nothing" ), file=out )
+    return failed
+
+
+def report( results, out=sys.stdout, quiet=False ):
+    """
+    One line per text script, failures followed by their error, then a summary.
+    Quiet leaves out the scripts that succeeded.  Returns the number of failures.
+
+    """
+    failed = 0
+    for r in results:
+        if quiet and r['ok'] and not r.get('load_error'):
+            continue
+        status = "ok  " if r['ok'] else "FAIL"
+        domains = ""
+        if 'incremental' in r:
+            domains = ", {} domains reused, {} extracted".format(
+                    r['incremental']['reused'], r['incremental']['extracted'] )
+        elif r.get('replayed'):
+            domains = ", from " + r['replayed']
+        print( "{} {} ({} commands{}, {:.3f}s)".format(
+            status, r['path'], r['commands'], domains, r['seconds'] ), file=out )
+        if not r['ok']:
+            failed += 1
+            print( "     " + r['error'].replace( "\n", "\n     " ), file=out )
+        if r.get('loaded'):
+            print( "     loaded", file=out )
+        if r.get('load_error'):
+            failed += 1
+            print( "     LOAD FAILED: " + r['load_error'].replace( "\n", "\n     " ), file=out )
+    print( "{} text scripts: {} ok, {} failed, {} commands, {:.3f}s".format(
+        len(results), len(results) - failed, failed,
+        sum( r['commands'] for r in results ),
+        sum( r['seconds'] for r in results ) ), file=out )
+    return failed
+
+
+if __name__ == '__main__':
+    API_Parser()
+    scripts, missing = find_text_scripts( sys.argv[1:] )
+    for m in missing:
+        print( "Could not open: " + m )
+    sys.exit( 1 if report( extract_all( scripts ) ) or missing else 0 )
@@ -0,0 +1,431 @@
+#! /usr/bin/env python
+
+"""
+Benchmarks
+
+Throughput measurements for the miUML Text Script parser, so that performance
+changes can be judged with numbers rather than impressions.
+
+Usage: mi_Benchmark.py <benchmark> [args]
+
+    dispatch [text_file ...]    ordered pattern search vs section dispatch
+    commands [count]            DB Command build time and memory
+    extract [size ...]          end to end extraction of generated models
+    extract_one text_file       end to end extraction of one file, as JSON
+    scan text_file ...          extraction reading lines vs scanning a mapped file
+    lexer [length ...]          fuzz the statement lexers against the patterns
+    import [runs]               cold import of the library against its budget
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import gc
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+import subprocess
+
+# Local
+from mi_Section import section_RE
+from mi_Expression import Expression, Dispatch, ordered_match
+
+# Constants
+COMMENT_CHAR = '#'
+TARGET_SIZE = 4 * 2**20 # Statement text is replicated up to this many bytes
+CODE_DIR = os.path.dirname( os.path.abspath(__file__) )
+DEFAULT_MODELS = tuple( os.path.join( CODE_DIR, "Resources", m ) for m in ( "meta.tm", "atc.tm" ) )
+IMPORT_BUDGET = 0.1 # Seconds to import mi_Text_Model in a fresh interpreter
+LEXED_SECTIONS = ( 'domain', 'subsystem', 'classes' )
+FUZZ_STATEMENTS = 100000
+FUZZ_EDITS = 8 # At most, per fuzzed statement
+# Inserted, deleted or replaced by the fuzzer, mostly the characters the patterns care about
+FUZZ_TEXT = tuple( "aZ_9 \t/-:.,\\IRc2é٣" ) + ( "//", "->", "::", " / I", " / R1", "modeled" )
+# Repeated to make a long malformed statement, ex: a long name with a stray symbol
+PUMP_UNITS = ( " ", "a ", "a", " .", "a.", ". ", " /", ":", "-", "a,b " )
+PUMP_LENGTHS = ( 1000, 10000, 100000 )
+
+# Generated model sizes, see mi_Model_Generator
+Model_Size = {
+    'small':{ 'domains':1, 'subsystems':2, 'classes':25 },
+    'medium':{ 'domains':2, 'subsystems':5, 'classes':50 },
+    'large':{ 'domains':5, 'subsystems':10, 'classes':100 },
+    'huge':{ 'domains':20, 'subsystems':10, 'classes':100 }
+}
+Class_Content = { 'attributes':5, 'identifiers':2, 'references':2 }
+
+
+def load_statements( path ):
+    """
+    Returns ( section, statement text ) for each statement in a text script that
+    falls within a section with defined Expressions.
+
+    """
+    statements = []
+    section = 'model'
+    with open( path ) as f:
+        for line in f:
+            if line.startswith( COMMENT_CHAR ):
+                continue
+            line = line.split( COMMENT_CHAR )[0].rstrip()
+            if not line:
+                continue
+            r = section_RE.match( line )
+            if r:
+                section = r.group('name')
+            elif section in Expression:
+                statements.append( ( section, line.strip() ) )
+    return statements
+
+
+def replicate( statements, target_size=TARGET_SIZE ):
+    """
+    Repeat the statements until their text reaches the target size.
+
+    """
+    size = sum( len(text) + 1 for _, text in statements )
+    if not size:
+        return []
+    return statements * max( 1, -(-target_size // size) )
+
+
+def dispatch_match( section, text ):
+    return Dispatch[section].match( text )
+
+
+def timed( func, statements, repeat=3 ):
+    """
+    Best of repeat runs, with the garbage collector out of the way.
+
+    """
+    best = None
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range( repeat ):
+            start = time.perf_counter()
+            for section, text in statements:
+                func( section, text )
+            t = time.perf_counter() - start
+            best = t if best is None else min( best, t )
+    finally:
+        gc.enable()
+    return best
+
+
+def bench_dispatch( *paths ):
+    """
+    Classify the statements of each text script, scaled up to a few MB, with
+    the ordered search and with the section dispatcher.  The two must agree on
+    every statement.
+
+    """
+    for path in ( paths or DEFAULT_MODELS ):
+        statements = replicate( load_statements( path ) )
+        if not statements:
+            print( "{}: no statements".format( path ) )
+            continue
+        mb = sum( len(text) + 1 for _, text in statements ) / 2**20
+
+        for section, text in set( statements ):
+            if ordered_match( section, text ) != dispatch_match( section, text ):
+                print( "MISMATCH in {}: {}".format( section, text ) )
+                return
+
+        ordered_time = timed( ordered_match, statements )
+        dispatch_time = timed( dispatch_match, statements )
+
+        print( "{}: {} statements, {:.1f} MB".format(
+            os.path.basename(path), len(statements), mb ) )
+        for label, t in ( ("ordered", ordered_time), ("dispatch", dispatch_time) ):
+            print( "  {:<10}{:>10.0f} lines/s {:>8.2f} MB/s".format(
+                label, len(statements) / t, mb / t ) )
+        print( "  speedup   {:>10.2f}x".format( ordered_time / dispatch_time ) )
+
+
+def bench_commands( count=1000000 ):
+    """
+    Build a script of count new_ind_attr DB Commands, the most common kind, and
+    report the build time and the memory held per command.
+
+    """
+    import tracemalloc
+    from mi_API_Parser import API_Parser
+    from mi_Parameter import Context_Parameter
+    from mi_DB_Population_Script import DB_Population_Script
+
+    count = int( count )
+    API_Parser()
+    Context_Parameter['domain'] = 'Benchmark'
+    Context_Parameter['class'] = 'Benchmark Class'
+    params = [ { 'name':'Attribute ' + str(n), 'type':'name' } for n in range( count ) ]
+
+    def build():
+        script = DB_Population_Script()
+        for n, p in enumerate( params ):
+            script.add_command( 'new_ind_attr', p, n )
+        return script
+
+    gc.collect()
+    start = time.perf_counter()
+    script = build()
+    build_time = time.perf_counter() - start
+    del script
+    gc.collect()
+
+    tracemalloc.start()
+    script = build()
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print( "{} commands: {:.2f} us/command to build, {:.0f} bytes/command held".format(
+        count, build_time / count * 1e6, held / count ) )
+
+
+def bench_extract_one( path ):
+    """
+    Run Phase 1 on one text script in this process and print the line and
+    command counts, the extraction time and the peak RSS as JSON.
+
+    """
+    import resource
+    from mi_API_Parser import API_Parser
+    from mi_DB_Population_Script import DB_Population_Script
+    from mi_Extraction import Extraction
+
+    API_Parser()
+    with open( path ) as f:
+        lines = sum( 1 for _ in f )
+    base_rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    script = DB_Population_Script()
+    start = time.perf_counter()
+    Extraction( path, script )
+    seconds = time.perf_counter() - start
+    print( json.dumps( {
+        'lines':lines,
+        'commands':script.command_count(),
+        'seconds':seconds,
+        'base_rss_kb':base_rss, # Linux reports KB
+        'peak_rss_kb':resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    } ) )
+
+
+def bench_extract( *sizes ):
+    """
+    Generate a model of each size and extract it end to end, each in a fresh
+    process so that the peak RSS of one size doesn't hide that of the next.
+
+    """
+    from mi_Model_Generator import generate
+
+    print( "{:<8}{:>9}{:>10}{:>9}{:>11}{:>12}{:>10}{:>10}".format( "size", "lines",
+        "commands", "seconds", "lines/s", "commands/s", "RSS MB", "+RSS MB" ) )
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in ( sizes or Model_Size ):
+            path = os.path.join( temp_dir, size + ".tm" )
+            with open( path, 'w' ) as f:
+                generate( f, **dict( Model_Size[size], **Class_Content ) )
+            run = subprocess.run( [ sys.executable, os.path.abspath(__file__),
+                'extract_one', path ], cwd=CODE_DIR, stdout=subprocess.PIPE,
+                universal_newlines=True, check=True )
+            r = json.loads( run.stdout.strip().split( "\n" )[-1] )
+            print( "{:<8}{:>9}{:>10}{:>9.3f}{:>11.0f}{:>12.0f}{:>10.1f}{:>10.1f}".format(
+                size, r['lines'], r['commands'], r['seconds'],
+                r['lines'] / r['seconds'], r['commands'] / r['seconds'],
+                r['peak_rss_kb'] / 1024, ( r['peak_rss_kb'] - r['base_rss_kb'] ) / 1024 ) )
+
+
+def bench_scan( *paths ):
+    """
+    Extract each text script reading it line by line and scanning it memory
+    mapped.  Both must produce the same DB Commands or the same error.
+
+    """
+    import mi_Extraction
+    from mi_API_Parser import API_Parser
+    from mi_Parameter import Context_Parameter
+    from mi_DB_Population_Script import DB_Population_Script
+
+    def extract( path ):
+        for focus in Context_Parameter:
+            Context_Parameter[focus] = None
+        script = DB_Population_Script()
+        try:
+            mi_Extraction.Extraction( path, script )
+        except Exception as e:
+            return [ c.record() for c in script.R11_DB_Command if c.cmd ], str(e)
+        return [ c.record() for c in script.R11_DB_Command ], None
+
+    API_Parser()
+    setting = mi_Extraction.Scan_Setting['enabled']
+    for path in ( paths or DEFAULT_MODELS ):
+        times = {}
+        for scan in ( False, True ):
+            mi_Extraction.Scan_Setting['enabled'] = scan
+            times[scan] = timed( lambda section, path: extract( path ), [ ( None, path ) ] )
+        mi_Extraction.Scan_Setting['enabled'] = False
+        by_line = extract( path )
+        mi_Extraction.Scan_Setting['enabled'] = True
+        scanned = extract( path )
+        mi_Extraction.Scan_Setting['enabled'] = setting
+        if scanned != by_line:
+            print( "MISMATCH in " + path )
+            return
+        mb = os.path.getsize( path ) / 2**20
+        print( "{}: {:.1f} MB, {} commands{}".format( os.path.basename(path), mb,
+            len( by_line[0] ), ", " + by_line[1] if by_line[1] else "" ) )
+        for label, t in ( ("lines", times[False]), ("scan", times[True]) ):
+            print( "  {:<10}{:>8.3f}s {:>8.2f} MB/s".format( label, t, mb / t ) )
+
+
+def fuzz( rnd, text ):
+    """
+    The text with a few random insertions, deletions and replacements.
+
+    """
+    chars = list( text )
+    for _ in range( rnd.randint( 1, FUZZ_EDITS ) ):
+        n = rnd.randint( 0, len( chars ) )
+        edit = rnd.random()
+        if edit < 0.4 or not chars:
+            chars.insert( n, rnd.choice( FUZZ_TEXT ) )
+        elif edit < 0.7:
+            del chars[ min( n, len( chars ) - 1 ) ]
+        else:
+            chars[ min( n, len( chars ) - 1 ) ] = rnd.choice( FUZZ_TEXT )
+    return "".join( chars )
+
+
+def pumped( rnd, text, length ):
+    """
+    The text with a run of each pump unit, long enough to bring it to about
+    length characters, inserted at a random place, and with a stray symbol
+    at the end as well.
+
+    """
+    for unit in PUMP_UNITS:
+        n = rnd.randint( 0, len( text ) )
+        long_text = text[:n] + unit * ( length // len( unit ) ) + text[n:]
+        yield long_text
+        yield long_text + "!"
+
+
+def worst( dispatch, statements ):
+    """
+    The longest time, in seconds, taken to classify any one statement.
+
+    """
+    longest = 0
+    for section, text in statements:
+        match = dispatch[section].match
+        start = time.perf_counter()
+        match( text )
+        longest = max( longest, time.perf_counter() - start )
+    return longest
+
+
+def bench_lexer( *lengths ):
+    """
+    Fuzz the statement lexers against the patterns they stand in for.  The
+    statements of the default models are mutated at random, and each section's
+    lexers must classify every mutation as its patterns do, with the same
+    extracted data.  Then each statement is pumped up to each length with long
+    runs of the characters the patterns backtrack over, and the worst time to
+    classify one is reported.  A blowup shows as a worst time that grows much
+    faster than the length.
+
+    """
+    from mi_Expression import Expression_Dispatch
+    from mi_Lexer import Lexers
+
+    lengths = [ int(n) for n in lengths ] or PUMP_LENGTHS
+    patterns = { s:Expression_Dispatch( Expression[s] ) for s in LEXED_SECTIONS }
+    lexers = { s:Expression_Dispatch( Expression[s], Lexers ) for s in LEXED_SECTIONS }
+    seeds = sorted( { ( section, text ) for path in DEFAULT_MODELS
+        for section, text in load_statements( path ) if section in LEXED_SECTIONS } )
+    rnd = random.Random( 0 ) # The same fuzz every run
+
+    for _ in range( FUZZ_STATEMENTS ):
+        text = fuzz( rnd, rnd.choice( seeds )[1] )
+        for section in LEXED_SECTIONS: # Whatever section it came from
+            if patterns[section].match( text ) != lexers[section].match( text ):
+                print( "MISMATCH in {}: {!r}".format( section, text ) )
+                return False
+    print( "{} fuzzed statements from {} seeds: lexers agree with the patterns".format(
+        FUZZ_STATEMENTS, len( seeds ) ) )
+
+    print( "{:>10}{:>12}{:>16}{:>14}".format( "length", "statements", "patterns worst", "lexers worst" ) )
+    times = []
+    for length in lengths:
+        statements = [ ( section, long_text ) for section, text in seeds
+                for long_text in pumped( rnd, text, length ) ]
+        times.append( ( worst( patterns, statements ), worst( lexers, statements ) ) )
+        print( "{:>10}{:>12}{:>14.0f}us{:>12.0f}us".format(
+            length, len( statements ), times[-1][0] * 1e6, times[-1][1] * 1e6 ) )
+    if len( lengths ) > 1:
+        print( "length x{:.0f}: patterns worst x{:.0f}, lexers worst x{:.0f}".format(
+            lengths[-1] / lengths[0], times[-1][0] / times[0][0], times[-1][1] / times[0][1] ) )
+    return True
+
+
+def bench_import( runs=20 ):
+    """
+    Time a fresh interpreter importing the library, less one importing
+    nothing, from a directory other than the code directory.  The import
+    must leave the current directory alone, print nothing and not import pdb.
+
+    """
+    probe = ( "import os, sys; cwd = os.getcwd(); import mi_Text_Model; "
+        "assert os.getcwd() == cwd, 'changed directory'; "
+        "assert 'pdb' not in sys.modules, 'imported pdb'" )
+    env = dict( os.environ, PYTHONPATH=os.pathsep.join(
+        [ CODE_DIR ] + [ p for p in os.environ.get( 'PYTHONPATH', "" ).split( os.pathsep ) if p ] ) )
+
+    def cold( code ):
+        start = time.perf_counter()
+        run = subprocess.run( [ sys.executable, "-c", code ], cwd=tempfile.gettempdir(), env=env,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True )
+        seconds = time.perf_counter() - start
+        if run.returncode or run.stdout:
+            raise SystemExit( "Import is not clean:\n" + run.stdout )
+        return seconds
+
+    cold( probe ) # Compile the modules once
+    bare = sorted( cold( "pass" ) for _ in range( int(runs) ) )
+    full = sorted( cold( probe ) for _ in range( int(runs) ) )
+    median = full[ len(full) // 2 ] - bare[ len(bare) // 2 ]
+    print( "import mi_Text_Model: {:.1f} ms median over {} runs, budget {:.0f} ms: {}".format(
+        median * 1000, runs, IMPORT_BUDGET * 1000, "ok" if median <= IMPORT_BUDGET else "OVER" ) )
+    return median <= IMPORT_BUDGET
+
+
+Benchmarks = {
+    'dispatch':bench_dispatch,
+    'commands':bench_commands,
+    'extract':bench_extract,
+    'extract_one':bench_extract_one,
+    'scan':bench_scan,
+    'lexer':bench_lexer,
+    'import':bench_import
+}
+
+if __name__ == '__main__':
+    if len( sys.argv ) < 2 or sys.argv[1] not in Benchmarks:
+        print( __doc__.strip().split( "\n\n" )[-1] )
+        sys.exit(1)
+    Benchmarks[ sys.argv[1] ]( *sys.argv[2:] )
@@ -0,0 +1,237 @@
+#! /usr/bin/env python
+
+"""
+Class: Bulk Loader
+
+An alternative Phase 2 that sends a DB Population Script to the DB as data
+rather than as one procedure call per DB Command.
+
+The parameter values of the DB Commands for each API call are streamed with
+COPY into a temporary staging table for that call, with a column for each of
+its parameters as specified by the API, plus the command's position in the
+script and its text script line:
+
+    mi_stage_new_class( seq, line_no, shape, "name", "alias", "cnum", ... )
+
+A single DO block then applies the whole script on the server.  It visits the
+staged rows of every table in script order and calls the API for each one,
+passing only the parameters the command supplied so that the API defaults
+still apply.  Each distinct set of supplied parameters for a call is a shape,
+and each shape is one PERFORM in the block.  So the script costs a handful of
+round trips in all, whatever its size, and no API call is parsed or planned
+more than once per shape.
+
+The API calls are the only interface the miUML DB offers for populating the
+metamodel, since its tables enforce the metamodel rules through them.  So the
+apply step still makes one call per row, but from inside the DB.
+
+If a call is rejected, the block raises an error naming the command's seq and
+line, the whole transaction is rolled back and the error is reported against
+the text script line, just like a direct load.  The staging tables are dropped
+at the end of the transaction either way.
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import io
+import re
+import os
+import sys
+
+# Local
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
+if MODULE_DIR not in sys.path:
+    sys.path.append( MODULE_DIR )
+from mi_Error import *
+from mi_API_Parser import API_Type
+from mi_DB_Command import CMD_PREFIX, PARAM_PREFIX, PARAM_ASSIGN
+from mi_Log import get_logger
+
+log = get_logger( 'load' )
+
+# Constants
+STAGE_PREFIX = "mi_stage_"
+APPLY_TAG = "$mitext_apply$" # Dollar quote of the apply block
+SQL_Type = { str:"text", int:"integer", float:"double precision", bool:"boolean" }
+STATEMENT_DELIM = "; "
+COPY_NULL = "\\N"
+COPY_Escape = { "\\":"\\\\", "\t":"\\t", "\n":"\\n", "\r":"\\r" }
+
+# Regex
+copy_escape_RE = re.compile( r'[\\\t\n\r]' )
+# What the apply block raises, see apply_statement()
+apply_error_RE = re.compile( r'mitext seq (?P<seq>\d+) line \S*: (?P<error>.*)', re.S )
+
+
+def quote( name ):
+    """
+    A parameter name as a column name.  Several are SQL keywords, ex: class
+
+    """
+    return '"' + name + '"'
+
+
+def column_type( pspec ):
+    """
+    SQL type of the staging column for a parameter spec of the API.
+
+    """
+    sql_type = SQL_Type[ API_Type[ pspec['type'] ] ]
+    return sql_type + "[]" if pspec['multiple'] else sql_type
+
+
+def array_element( value ):
+    if value is None:
+        return "NULL"
+    if isinstance( value, bool ):
+        return "t" if value else "f"
+    return '"' + str( value ).replace( "\\", "\\\\" ).replace( '"', '\\"' ) + '"'
+
+
+def copy_field( value ):
+    """
+    A value as a field of the COPY text format.
+
+    """
+    if value is None:
+        return COPY_NULL
+    if isinstance( value, bool ): # Before int, since a bool is an int
+        return "t" if value else "f"
+    if isinstance( value, ( list, tuple ) ):
+        value = "{" + ",".join( array_element(v) for v in value ) + "}"
+    return copy_escape_RE.sub( lambda m: COPY_Escape[ m.group() ], str( value ) )
+
+
+class Bulk_Loader:
+    """
+    The staging tables, COPY data and apply block for a list of completed
+    DB Commands.
+
+    """
+    def __init__( self, db_commands ):
+        self.db_commands = db_commands
+        self.shapes = {} # ( call_name, pnames ) : shape number
+        self.calls = {} # call_name : API parameter specs, in order of first use
+        for c in db_commands:
+            if ( c.call_name, c.pnames ) not in self.shapes:
+                self.shapes[ ( c.call_name, c.pnames ) ] = len( self.shapes )
+                self.calls.setdefault( c.call_name, c.api_param_specs )
+
+    def create_statements( self ):
+        """
+        One temporary staging table per API call.
+
+        """
+        return [ "CREATE TEMP TABLE {}( seq integer PRIMARY KEY, line_no integer, "
+            "shape integer, {} ) ON COMMIT DROP".format( STAGE_PREFIX + call_name,
+                ", ".join( quote(p) + " " + column_type( specs[p] ) for p in specs ) )
+            for call_name, specs in self.calls.items() ]
+
+    def copy_statement( self, call_name ):
+        return "COPY {}( seq, line_no, shape, {} ) FROM STDIN".format( STAGE_PREFIX + call_name,
+            ", ".join( quote(p) for p in self.calls[call_name] ) )
+
+    def copy_data( self, call_name ):
+        """
+        The rows of one staging table in the COPY text format, a parameter the
+        command didn't supply is NULL.
+
+        """
+        specs = self.calls[call_name]
+        out = io.StringIO()
+        for seq, c in enumerate( self.db_commands ):
+            if c.call_name != call_name:
+                continue
+            params = dict( zip( c.pnames, c.pvals ) )
+            out.write( "\t".join( [ str(seq), copy_field( c.line_no ),
+                str( self.shapes[ ( call_name, c.pnames ) ] ) ] +
+                [ copy_field( params.get(p) ) for p in specs ] ) + "\n" )
+        out.seek( 0 )
+        return out
+
+    def apply_statement( self ):
+        """
+        The DO block that calls the API for every staged row in script order,
+        one PERFORM per shape, ex:
+
+            ELSIF r.shape = 2 THEN
+                PERFORM UI_new_class( p_name:=s."name", ... ) FROM mi_stage_new_class s
+                    WHERE s.seq = r.seq;
+
+        """
+        rows = " UNION ALL ".join( "SELECT seq, line_no, shape FROM " + STAGE_PREFIX + call_name
+                for call_name in self.calls )
+        branches = []
+        for ( call_name, pnames ), n in self.shapes.items():
+            branches.append( "{} r.shape = {} THEN PERFORM {}( {} ) FROM {} s "
+                "WHERE s.seq = r.seq;".format( "IF" if not branches else "ELSIF", n,
+                    CMD_PREFIX + call_name, ", ".join( PARAM_PREFIX + p + PARAM_ASSIGN +
+                        "s." + quote(p) for p in pnames ), STAGE_PREFIX + call_name ) )
+        # One exception handler for the whole loop, since a handler costs a
+        # subtransaction each time its block is entered
+        return ( "DO " + APPLY_TAG + "\nDECLARE r record; staged record;\nBEGIN\n"
+            "FOR r IN " + rows + " ORDER BY seq LOOP\nstaged := r;\n" +
+            "\n".join( branches ) + "\nEND IF;\nEND LOOP;\n"
+            "EXCEPTION WHEN OTHERS THEN\n"
+            "RAISE EXCEPTION 'mitext seq % line %: %', staged.seq, staged.line_no, SQLERRM;\n"
+            "END " + APPLY_TAG )
+
+    def load( self, db_connection ):
+        """
+        Run the script on an open DB-API connection that supports COPY through
+        copy_expert(), as psycopg2 and the stand-in do, inside a single
+        transaction.  Rolls back if any command fails.  The connection is closed
+        when we are done, success or failure.
+
+        """
+        if not self.db_commands: # Nothing to stage, and no apply block without a row source
+            db_connection.close()
+            log.info( "Loaded 0 DB Commands" )
+            return
+        cursor = db_connection.cursor()
+        try:
+            cursor.execute( STATEMENT_DELIM.join( self.create_statements() ) )
+            for call_name in self.calls:
+                cursor.copy_expert( self.copy_statement( call_name ), self.copy_data( call_name ) )
+            try:
+                cursor.execute( self.apply_statement() )
+            except Exception as e: # Each DB-API driver defines its own Error class
+                r = apply_error_RE.search( str(e) )
+                if not r:
+                    raise mi_Error( "Bulk load failed\n" + str(e).strip() ) from e
+                c = self.db_commands[ int( r.group('seq') ) ]
+                raise mi_Error( "DB Command failed at line {}: {} {}\n{}".format(
+                    c.line_no, c.cmd, c.pvals, r.group('error').strip() ) ) from e
+        except:
+            db_connection.rollback()
+            raise
+        else:
+            db_connection.commit()
+        finally:
+            db_connection.close()
+        log.info( "Loaded %d DB Commands through %d staging tables",
+                len( self.db_commands ), len( self.calls ) )
+
+
+if __name__ == '__main__':
+    from mi_API_Parser import API_Parser
+    from mi_Text_Model import build_population_script
+    API_Parser()
+    for path in sys.argv[1:]:
+        loader = Bulk_Loader( build_population_script( path ).R11_DB_Command )
+        for statement in loader.create_statements():
+            print( statement + ";" )
+        print( loader.apply_statement() + ";" )
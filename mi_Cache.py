@@ -0,0 +1,135 @@
+#! /usr/bin/env python
+
+"""
+Local cache
+
+Results that are expensive to rebuild and depend only on the content of some
+input files are saved on disk under a name and a key.  The key is a content
+hash of everything the result was built from, including any code that built
+it, so a stale entry is never found: a change to any input produces a new key.
+
+The cache is strictly an optimization.  Any failure to read or write it is
+ignored and the caller rebuilds the result from scratch.
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import os
+import glob
+import pickle
+import hashlib
+
+# Constants
+CACHE_DIR_VAR = "MITEXT_CACHE_DIR" # Environment override of the cache location
+DEFAULT_CACHE_DIR = os.path.join( os.path.expanduser("~"), ".cache", "mitext" )
+ENTRY_SUFFIX = ".cache"
+API_FILE = os.path.join( "Resources", "constructor_api_def.mi" ) # Relative to the code
+
+# Global
+Cache_Setting = {
+    'dir':os.environ.get( CACHE_DIR_VAR ) or DEFAULT_CACHE_DIR,
+    'enabled':True
+}
+Code_Version = [] # Computed on first use
+
+
+def content_hash( *chunks ):
+    """
+    Hex digest of the concatenated chunks, each a str or bytes.
+
+    """
+    h = hashlib.sha256()
+    for chunk in chunks:
+        h.update( chunk.encode() if isinstance( chunk, str ) else chunk )
+        h.update( b'\0' ) # So that ( 'ab', 'c' ) and ( 'a', 'bc' ) differ
+    return h.hexdigest()
+
+
+def file_hash( *paths ):
+    """
+    Hex digest of the content of one or more files.
+
+    """
+    chunks = []
+    for path in paths:
+        with open( path, 'rb' ) as f:
+            chunks.append( f.read() )
+    return content_hash( *chunks )
+
+
+def code_version():
+    """
+    Hex digest of the parser source code and the API file.  Anything built by
+    the parser from a text script is only valid for the same code version.
+
+    """
+    if not Code_Version:
+        code_dir = os.path.dirname( os.path.abspath(__file__) )
+        paths = sorted( glob.glob( os.path.join( glob.escape(code_dir), "mi*.py" ) ) )
+        paths.append( os.path.join( code_dir, API_FILE ) )
+        Code_Version.append( file_hash( *paths ) )
+    return Code_Version[0]
+
+
+def entry_path( name, key ):
+    return os.path.join( Cache_Setting['dir'], name + '-' + key + ENTRY_SUFFIX )
+
+
+def load( name, key ):
+    """
+    Returns the object saved under this name and key, or None.
+
+    """
+    if not Cache_Setting['enabled']:
+        return None
+    try:
+        with open( entry_path( name, key ), 'rb' ) as f:
+            return pickle.load( f )
+    except Exception:
+        return None
+
+
+def save( name, key, obj, replace=False ):
+    """
+    Saves the object under this name and key.  With replace, any entries saved
+    under the same name with a different key are removed.  The entry is written
+    to a temporary file first so that a concurrent reader never sees half of it.
+
+    """
+    if not Cache_Setting['enabled']:
+        return
+    path = entry_path( name, key )
+    temp_path = path + '.' + str( os.getpid() )
+    try:
+        os.makedirs( Cache_Setting['dir'], exist_ok=True )
+        with open( temp_path, 'wb' ) as f:
+            pickle.dump( obj, f, pickle.HIGHEST_PROTOCOL )
+        os.replace( temp_path, path )
+        if replace:
+            for stale in glob.glob( entry_path( glob.escape(name), '*' ) ):
+                if stale != path:
+                    os.remove( stale )
+    except Exception:
+        try:
+            os.remove( temp_path )
+        except OSError:
+            pass
+
+
+if __name__ == '__main__':
+    print( "Cache directory: " + Cache_Setting['dir'] )
+    for path in sorted( glob.glob( entry_path( '*', '*' ) ) ):
+        print( "  {:>10}  {}".format( os.path.getsize(path), os.path.basename(path) ) )
@@ -0,0 +1,143 @@
+#! /usr/bin/env python
+
+"""
+Command Graph
+
+Splits the DB Commands of a DB Population Script into components that can be
+executed concurrently, each on its own DB connection.
+
+A DB Command depends on the commands that created the model elements it
+names: an attribute on its class, a class on its subsystem and domain, a
+relationship on its classes, a bridge on its two domains, and so on.  Rows a
+connection has created are invisible to any other connection until they are
+committed, so a command must run on the same connection as every command it
+depends on.  A component is a set of commands closed under dependency, kept
+in script order, and is never split across connections.
+
+Every subsystem and class is created in the context of its domain, so in
+practice a component is one domain, or several domains joined by a bridge.
+A command that names no model element at all is kept with the command before
+it, since nothing tells us what it needs.
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import sys
+
+# Constants
+Creates = { # call name : kind of model element created, named by its name param
+    'new_domain':'domain',
+    'new_subsystem':'subsys',
+    'new_class':'class'
+}
+Element_Param = { # param name : kind of model element it names
+    'domain':'domain',
+    'client':'domain',
+    'service':'domain',
+    'subsys':'subsys',
+    'class':'class',
+    'active_class':'class',
+    'passive_class':'class',
+    'assoc_class':'class',
+    'superclass':'class',
+    'subclasses':'class'
+}
+
+
+def element_keys( call_name, params ):
+    """
+    The model elements a DB Command creates or names, each as a key:
+
+        ( 'domain', name ), ( 'subsys', domain, name ), ( 'class', domain, name )
+
+    """
+    domain = params.get('domain')
+    keys = []
+    kind = Creates.get( call_name )
+    if kind:
+        keys.append( ( kind, params['name'] ) if kind == 'domain' else
+                ( kind, domain, params['name'] ) )
+    for pname, value in params.items():
+        kind = Element_Param.get( pname )
+        if not kind or value is None:
+            continue
+        for name in ( value if isinstance( value, list ) else [ value ] ):
+            keys.append( ( kind, name ) if kind == 'domain' else ( kind, domain, name ) )
+    return keys
+
+
+def components( db_commands ):
+    """
+    Splits a list of completed DB Commands into components, each a list of
+    commands in script order.  The components are ordered by their first
+    command.
+
+    """
+    parent = list( range( len( db_commands ) ) )
+
+    def root( i ):
+        while parent[i] != i:
+            parent[i] = parent[ parent[i] ]
+            i = parent[i]
+        return i
+
+    owner = {} # element key : first command that created or named it
+    for i, c in enumerate( db_commands ):
+        keys = element_keys( c.call_name, c.params() )
+        if not keys and i:
+            parent[ root(i) ] = root( i - 1 )
+        for k in keys:
+            if k in owner:
+                parent[ root(i) ] = root( owner[k] )
+            else:
+                owner[k] = i
+
+    by_root = {}
+    for i, c in enumerate( db_commands ):
+        by_root.setdefault( root(i), [] ).append( c )
+    return list( by_root.values() ) # Dicts keep insertion order, the first command's
+
+
+def assign( comps, connections ):
+    """
+    Deals the components out to at most connections lanes, largest first to
+    the least loaded lane.  Each lane is one list of DB Commands in script
+    order, to be executed on one connection.
+
+    """
+    order = { id(c):n for n, comp in enumerate( comps ) for c in comp }
+    lanes = [ [] for _ in range( min( connections, len( comps ) ) ) ]
+    for comp in sorted( comps, key=len, reverse=True ):
+        min( lanes, key=len ).extend( comp )
+    for lane in lanes:
+        lane.sort( key=lambda c: order[ id(c) ] )
+    return lanes
+
+
+if __name__ == '__main__':
+    from mi_API_Parser import API_Parser
+    from mi_DB_Population_Script import DB_Population_Script
+    from mi_Extraction import Extraction
+
+    API_Parser()
+    for path in sys.argv[1:]:
+        script = DB_Population_Script()
+        Extraction( path, script )
+        comps = components( script.R11_DB_Command )
+        print( "{}: {} commands in {} components".format(
+            path, script.command_count(), len( comps ) ) )
+        for comp in comps:
+            print( "  line {}: {} commands".format( comp[0].line_no, len( comp ) ) )
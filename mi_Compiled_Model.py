@@ -0,0 +1,190 @@
+#! /usr/bin/env python
+
+"""
+Compiled Model
+
+The finished DB Population Script of a text script, saved so that it can be
+loaded again without running Phase 1.  A compiled model file (.tmc) starts
+with a magic line, followed by a zlib compressed JSON document:
+
+    {
+        'source':<text script path>,
+        'source_hash':<hash of the text script>,
+        'api_hash':<hash of the API file>,
+        'shapes':[ [ call_name, [ pname, ... ] ], ... ],
+        'commands':[ [ shape, line_no, [ value, ... ] ], ... ]
+    }
+
+Each distinct call name and parameter name sequence, the shape of a command,
+is listed once and each command refers to its shape by position, giving its
+values as a vector in the shape's parameter order and the line of the text
+script it came from.  A compiled model is only replayed against the same API
+file it was compiled with, since the parameter names may differ in another.
+
+The same form is kept in the local cache under a key made of the text script
+hash, the code version, which covers the API file, and whether identifiers
+are created.  So a text script that
+has been extracted once goes straight to execution the next time it is loaded,
+until it or the parser changes.
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import os
+import sys
+import json
+import zlib
+
+# Local
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
+if MODULE_DIR not in sys.path:
+    sys.path.append( MODULE_DIR )
+from mi_Error import *
+import mi_Cache
+from mi_Metamodel_Parser import Identifier_Setting
+
+# Constants
+MAGIC = b"miUML compiled model 1\n"
+COMPILED_EXT = ".tmc"
+COMPILED = "compiled" # Cache entry name prefix
+
+# Global
+API_Version = [] # Computed on first use
+
+
+def api_hash():
+    """
+    Hex digest of the API file the DB Commands are built against.
+
+    """
+    if not API_Version:
+        code_dir = os.path.dirname( os.path.abspath(__file__) )
+        API_Version.append( mi_Cache.file_hash( os.path.join( code_dir, mi_Cache.API_FILE ) ) )
+    return API_Version[0]
+
+
+def encode( records, source="", source_hash="" ):
+    """
+    The compiled form of a list of DB Command records.
+
+    """
+    shapes = {} # ( call_name, pnames ) : position
+    commands = []
+    for call_name, line_no, params in records:
+        shape = ( call_name, tuple( p for p, _ in params ) )
+        n = shapes.get( shape )
+        if n is None:
+            n = shapes[shape] = len( shapes )
+        commands.append( [ n, line_no, [ v for _, v in params ] ] )
+    doc = { 'source':source, 'source_hash':source_hash, 'api_hash':api_hash(),
+            'shapes':[ [ c, list(p) ] for c, p in shapes ], 'commands':commands }
+    return MAGIC + zlib.compress( json.dumps( doc, separators=(',', ':') ).encode() )
+
+
+def decode( data, fname="" ):
+    """
+    The DB Command records of a compiled model and the document's
+    source path and hash.
+
+    """
+    if not data.startswith( MAGIC ):
+        raise mi_File_Error( "Not a compiled model", fname )
+    try:
+        doc = json.loads( zlib.decompress( data[len(MAGIC):] ).decode() )
+        shapes = [ ( c, p ) for c, p in doc['shapes'] ]
+        records = [ ( shapes[n][0], line_no, tuple( zip( shapes[n][1], values ) ) )
+                for n, line_no, values in doc['commands'] ]
+    except ( ValueError, KeyError, IndexError, TypeError, zlib.error ):
+        raise mi_File_Error( "Damaged compiled model", fname )
+    if doc['api_hash'] != api_hash():
+        raise mi_File_Error( "Compiled against a different API, recompile", fname )
+    return records, doc['source'], doc['source_hash']
+
+
+def is_compiled( path ):
+    """
+    True if the file is a compiled model rather than a text script.
+
+    """
+    try:
+        with open( path, 'rb' ) as f:
+            return f.read( len(MAGIC) ) == MAGIC
+    except OSError:
+        return False
+
+
+def write( path, records, source="", source_hash="" ):
+    """
+    Writes a compiled model file.  It is written to a temporary file first so
+    that a failed write never leaves half of one behind.
+
+    """
+    temp_path = path + '.' + str( os.getpid() )
+    try:
+        with open( temp_path, 'wb' ) as f:
+            f.write( encode( records, source, source_hash ) )
+        os.replace( temp_path, path )
+    except OSError:
+        try:
+            os.remove( temp_path )
+        except OSError:
+            pass
+        raise mi_File_Error( "Cannot write", path )
+
+
+def read( path ):
+    """
+    The DB Command records of a compiled model file.
+
+    """
+    try:
+        with open( path, 'rb' ) as f:
+            data = f.read()
+    except OSError:
+        raise mi_File_Error( "Cannot open", path )
+    return decode( data, path )[0]
+
+
+def cache_key( source_hash ):
+    return mi_Cache.content_hash( source_hash, mi_Cache.code_version(),
+            str( Identifier_Setting['enabled'] ) )
+
+
+def load_cached( source_hash ):
+    """
+    The cached DB Command records of the text script with this hash, or None.
+
+    """
+    data = mi_Cache.load( COMPILED, cache_key( source_hash ) )
+    if not data:
+        return None
+    try:
+        return decode( data )[0]
+    except mi_Error:
+        return None
+
+
+def save_cached( source_hash, records, source="" ):
+    mi_Cache.save( COMPILED, cache_key( source_hash ),
+            encode( records, source, source_hash ) )
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        with open( path, 'rb' ) as f:
+            records, source, source_hash = decode( f.read(), path )
+        print( "{}: {} commands from {} ({})".format(
+            path, len(records), source, source_hash[:12] ) )
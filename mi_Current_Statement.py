@@ -26,19 +26,23 @@ during the processing of an miUML Text Script.
 import re
 import os
 import sys
-
-# Diagnostic
-import pdb # debug
+import time
 
 # Local
-MODULE_DIR = os.path.abspath( "../Modules" )
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
 if MODULE_DIR not in sys.path:
     sys.path.append( MODULE_DIR )
 from mi_Error import *
 from mi_API_Parser import API_Constructor_Call, API_Type
 from mi_Parameter import Context_Parameter
 from mi_DB_Command import DB_Command
-from mi_Expression import Expression
+from mi_Expression import Dispatch
+from mi_Log import get_logger, DEBUG
+from mi_Phase_Timer import Timing, add as add_phase_time
+import mi_Expression_Stats
+from mi_Expression_Stats import Stats
+
+log = get_logger( 'statement' )
 
 class Current_Statement:
     """
@@ -51,12 +55,14 @@ class Current_Statement:
     contained.  In complex cases, further parsing may be required.
 
     """
-    def __init__( self, text, current_section, extraction_obj ):
+    def __init__( self, text, current_section, extraction_obj, match=None ):
         """
         State: Creating
 
         Creates a new Statement by linking to an Expression
-        and extracting the Data Item values
+        and extracting the Data Item values.  The Expression and extracted
+        data may be supplied as the match if they are already known, as they
+        are for a memoized fragment.
 
         """
         self.implicit_section = None
@@ -64,6 +70,7 @@ class Current_Statement:
         self.section = current_section
         self.text = text
         self.metamodel_parser = extraction_obj.Bridge_to_Metamodel__parser
+        self.match = match
         self.parse()
 
 
@@ -77,26 +84,41 @@ class Current_Statement:
 
         """
         # Each section defines one or more expressions
-        # An expression is recognized by one or more patterns
-        for expr in Expression[self.section]:
-            for pattern in expr['patterns']:
-                r = pattern.match( self.text )
-                if r: # The pattern regex has lightly parsed this expr
-                    call_name = expr['call']
-                    expr_name = expr['name']
-                    extracted_params = r.groupdict()
-                    print("----------------------------------")
-                    print(">> Parsing: " + self.text)
-                    print("----------------------------------")
-                    #pdb.set_trace()
-                    if call_name:
-                        # Perform type conversion on any API call params
-                        extracted_params = self.convert_params( call_name, extracted_params )
-                        self.update_context( call_name, extracted_params )
-                    self.metamodel_parser.parse( expr_name, extracted_params )
-                    if call_name:
-                        self.update_DB_Command( call_name, extracted_params )
-                    return
+        # An expression is recognized by one or more patterns, all of which
+        # are tried at once by the section's dispatcher
+        if self.match:
+            expr, extracted_params = self.match
+        elif Stats['enabled']:
+            expr, extracted_params = mi_Expression_Stats.match( self.section, self.text )
+        else:
+            expr, extracted_params = Dispatch[self.section].match( self.text )
+        if expr: # The pattern regex has lightly parsed this expr
+            call_name = expr['call']
+            expr_name = expr['name']
+            if log.isEnabledFor( DEBUG ):
+                log.debug( "%s:%s: %s >> %s", self.R13_Extraction.fname,
+                        self.R13_Extraction.line_no, expr_name, self.text )
+            if call_name:
+                # Perform type conversion on any API call params
+                extracted_params = self.convert_params( call_name, extracted_params )
+                self.update_context( call_name, extracted_params )
+            if not Timing['enabled']:
+                self.metamodel_parser.parse(
+                    expr_name, extracted_params, self.R13_Extraction.line_no )
+                if call_name:
+                    self.update_DB_Command( call_name, extracted_params )
+                return
+
+            # Same as above, timing each step
+            start = time.perf_counter()
+            self.metamodel_parser.parse(
+                    expr_name, extracted_params, self.R13_Extraction.line_no )
+            parsed = time.perf_counter()
+            add_phase_time( 'metamodel_parsing', parsed - start )
+            if call_name:
+                self.update_DB_Command( call_name, extracted_params )
+                add_phase_time( 'command_building', time.perf_counter() - parsed )
+            return
 
         # State: Invalid Statement
         # Fell through without finding a matching expression
@@ -131,7 +153,8 @@ class Current_Statement:
         if last_command:
             last_command.add_supplied_params( extracted_params )
         else:
-            my_db_script.add_command( call_name, extracted_params )
+            my_db_script.add_command(
+                    call_name, extracted_params, self.R13_Extraction.command_line_no() )
 
     def update_context( self, call_name, params ):
         """
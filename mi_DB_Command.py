@@ -25,22 +25,88 @@ import re
 import os
 import sys
 
-# Diagnostic
-import pdb # debug
-
 # Local
-MODULE_DIR = os.path.abspath( "../Modules" )
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
 if MODULE_DIR not in sys.path:
     sys.path.append( MODULE_DIR )
 from mi_Error import *
 from mi_Parameter import Context_Parameter
 from mi_API_Parser import API_Constructor_Call
+from mi_Log import get_logger, DEBUG
+
+log = get_logger( 'command' )
 
 # Symbols
 CMD_PREFIX = "UI_"
 PARAM_PREFIX = "p_"
 PARAM_ASSIGN = ":="
 PARAM_PLACE = "%s"
+PREPARED_PREFIX = "mi_cmd_" # Name of a prepared statement, numbered per shape
+
+
+class Call_Spec:
+    """
+    The API parameter specification of a call, shared by every DB Command for
+    that call rather than looked up and rebuilt per command.  Built once per
+    call name and never changed.
+
+    """
+    __slots__ = ( 'call_name', 'params', 'required' )
+
+    def __init__( self, call_name ):
+        self.call_name = call_name # ex: new_class
+        self.params = API_Constructor_Call[call_name]['parameters']
+        self.required = frozenset( pname for pname in self.params if
+                not self.params[pname]['optional'] )
+
+
+Call_Spec_Cache = {} # call_name : Call_Spec
+
+
+class Command_Shape:
+    """
+    Every command for the same call with the same supplied parameter names has
+    the same command string, and the same prepared statement on the DB.  So
+    they are built once per shape and shared.  The parameters are always in
+    the order the API specifies them, never in the order they were supplied,
+    so that a call has as few shapes as possible.
+
+    ex: UI_new_class( p_name:=%s, p_alias:=%s, p_cnum:=%s )
+
+        PREPARE mi_cmd_3 AS SELECT UI_new_class( p_name:=$1, p_alias:=$2, p_cnum:=$3 )
+        EXECUTE mi_cmd_3( %s, %s, %s )
+
+    The DB works out the type of each prepared statement parameter from the
+    API function it is passed to.
+
+    """
+    __slots__ = ( 'call_name', 'pnames', 'cmd', 'prepare', 'execute' )
+
+    def __init__( self, call_name, pnames, n ):
+        self.call_name = call_name
+        self.pnames = pnames
+        # Construct each param string, ex: p_ + name + := + %s
+        self.cmd = CMD_PREFIX + call_name + "( " + ", ".join(
+                PARAM_PREFIX + p + PARAM_ASSIGN + PARAM_PLACE for p in pnames ) + " )"
+        name = PREPARED_PREFIX + str(n)
+        self.prepare = "PREPARE {} AS SELECT {}( {} )".format( name, CMD_PREFIX + call_name,
+                ", ".join( PARAM_PREFIX + p + PARAM_ASSIGN + "$" + str(i)
+                    for i, p in enumerate( pnames, 1 ) ) )
+        self.execute = "EXECUTE " + name + (
+                "( " + ", ".join( [ PARAM_PLACE ] * len( pnames ) ) + " )" if pnames else "" )
+
+
+Command_Shape_Cache = {} # ( call_name, pnames ) : Command_Shape
+
+def call_spec( call_name ):
+    """
+    The shared Call Spec for this call name.
+
+    """
+    spec = Call_Spec_Cache.get( call_name )
+    if not spec:
+        spec = Call_Spec_Cache[call_name] = Call_Spec( call_name )
+    return spec
 
 
 class DB_Command:
@@ -49,25 +115,54 @@ class DB_Command:
     invoked using the psycopg2 driver.  Requires a commands string with
     placeholders for values in a separate list.
 
+    A script may hold a very large number of these, so each one is kept small.
+    The call's parameter specification and the command's shape are shared with
+    other commands, and once the command is complete its supplied parameters
+    are reduced to its shape and a tuple of values.
+
     """
-    def __init__( self, call_name, extracted_params ):
+    __slots__ = ( 'spec', 'line_no', 'R11_DB_Population_Script',
+            'supplied_params', 'shape', 'pvals' )
+
+    def __init__( self, call_name, extracted_params, line_no=None, db_pop_script=None ):
         """
         Constructs itself from the supplied call name and param-value pairs.
+        The line number of the originating statement is kept so that any
+        error raised by the DB can be traced back to the text script.
 
         """
         # State: Creating
-        self.call_name = call_name # ex: new_class
-        self.api_param_specs = API_Constructor_Call[self.call_name]['parameters']
-        self.required_pnames = { pname for pname in self.api_param_specs if
-                not self.api_param_specs[pname]['optional'] }
+        self.spec = call_spec( call_name )
+        self.line_no = line_no # Text script line that started this command
+        self.R11_DB_Population_Script = db_pop_script # Notified on completion
 
-        self.cmd = None # String will be built after all required params are supplied
-        self.pvals = []
+        self.shape = None # Known once all required params are supplied
+        self.pvals = None # Parameter values in the shape's order
 
         self.supplied_params = {} # The next two methods fill these in
         self.fill_in_context() # Only need to do this once per DB Command
         self.add_supplied_params( extracted_params )
 
+    @property
+    def call_name( self ):
+        return self.spec.call_name
+
+    @property
+    def api_param_specs( self ):
+        return self.spec.params
+
+    @property
+    def required_pnames( self ):
+        return self.spec.required
+
+    @property
+    def cmd( self ):
+        return self.shape.cmd if self.shape else None
+
+    @property
+    def pnames( self ):
+        return self.shape.pnames if self.shape else None
+
     def fill_in_context( self ):
         """
         State: Filling in Context
@@ -81,13 +176,11 @@ class DB_Command:
         named 'domian' with the 'Air Traffic Control' value.
 
         """
-        # All context key-values where value is not None
-        context_settings = { c for c,v in Context_Parameter.items() if v }
-
-        # Take the intersection of the context settings and expected parameters
-        # and set those values
-        for c in ( context_settings & self.api_param_specs.keys() ):
-            self.supplied_params[c] = Context_Parameter[c]
+        # Each expected parameter with a context value, in the API order rather
+        # than that of a set so that every run builds the same command
+        for c in self.spec.params:
+            if Context_Parameter.get( c ):
+                self.supplied_params[c] = Context_Parameter[c]
 
 
     def add_supplied_params( self, extracted_params ):
@@ -106,14 +199,14 @@ class DB_Command:
         # that were processed during parsing and have meaning here.  So it is
         # important to assign only those parameter names defined for this
         # db command
-        for pname in self.api_param_specs: # For each expected parameter
+        for pname in self.spec.params: # For each expected parameter
             if (pname not in self.supplied_params) and (pname in extracted_params):
                 # If not already supplied by context and it has been extracted
                 self.supplied_params[pname] = extracted_params[pname]
 
         # If the required pnames minus the supplied pnames is empty, then
         # we have a value for each 
-        if not ( self.required_pnames - self.supplied_params.keys() ):
+        if not ( self.spec.required - self.supplied_params.keys() ):
             # Event: all params suppled -> self
             self.complete_command()
 
@@ -127,30 +220,65 @@ class DB_Command:
         """
         # State: Completed
 
-        # Start with the api call name and an open parenthesis
-        self.cmd = CMD_PREFIX + self.call_name + "( " # Partial
-
-        # Now create a parameter string and a parameter list, both with the
-        # same ordering.
-        pstrings = []
-        for p, v in self.supplied_params.items():
-            # Construct the string, ex: p_ + name + := + %s
-            pstrings.append( PARAM_PREFIX + p + PARAM_ASSIGN + PARAM_PLACE )
-            self.pvals.append( v ) # Append the value to be assigned
-        self.cmd += ", ".join( pstrings ) + " )" # Add params and closing parenthesis
-
-        print(">> New cmd: ")
-        print(self.cmd)
-        print(self.pvals)
-        print()
-        #pdb.set_trace()
+        # The command string and the parameter value list have the same
+        # ordering, that of the API, whether a value came from the context or
+        # was extracted.  The shape is shared if it has been seen before.
+        pnames = tuple( p for p in self.spec.params if p in self.supplied_params )
+        key = ( self.spec.call_name, pnames )
+        shape = Command_Shape_Cache.get( key )
+        if not shape:
+            shape = Command_Shape_Cache[key] = Command_Shape( *key, len( Command_Shape_Cache ) )
+        self.shape = shape
+        self.pvals = tuple( self.supplied_params[p] for p in pnames )
+        self.supplied_params = None # Fully described by pnames and pvals now
+
+        if log.isEnabledFor( DEBUG ):
+            log.debug( ">> New cmd at line %s: %s %s", self.line_no, self.cmd, self.pvals )
         # State: Completed / ( final state with procedure finished )
+        if self.R11_DB_Population_Script:
+            self.R11_DB_Population_Script.command_completed( self )
+
+    def params( self ):
+        """
+        The supplied parameter name-value pairs, whether or not completed.
+
+        """
+        if self.supplied_params is not None:
+            return dict( self.supplied_params )
+        return dict( zip( self.pnames, self.pvals ) )
+
+    def record( self ):
+        """
+        A compact picklable form of a completed DB Command, from which it can be
+        rebuilt without any parsing or context.
+
+        """
+        return ( self.spec.call_name, self.line_no, tuple( zip( self.pnames, self.pvals ) ) )
+
+    @classmethod
+    def from_record( cls, record, db_pop_script=None, line_offset=0 ):
+        """
+        Rebuilds a completed DB Command from its record, shifting its line
+        number by the line offset.
+
+        """
+        call_name, line_no, supplied_params = record
+        db_command = cls.__new__( cls )
+        db_command.spec = call_spec( call_name )
+        db_command.line_no = None if line_no is None else line_no + line_offset
+        db_command.R11_DB_Population_Script = db_pop_script
+        db_command.shape = None
+        db_command.pvals = None
+        db_command.supplied_params = dict( supplied_params )
+        db_command.complete_command()
+        return db_command
 
 
     def __repr__( self ):
-        return "{}:: {}, {}, {}, {}, {}".format(
+        return "{}:: {}, {}, {}, {}, {}, {}".format(
                 self.__class__.__name__,
                 self.call_name,
+                self.line_no,
                 self.api_param_specs,
                 self.required_pnames,
                 self.cmd,
@@ -160,11 +288,13 @@ class DB_Command:
     def __str__( self ):
         return ("Class: DB Command\n"
         "call_name: {}\n" 
+        "line_no: {}\n" 
         "supplied_params: {}\n" 
         "required_params: {}\n"
         "cmd: {}\npvals: {}\n".format(
                 self.call_name,
-                self.supplied_params,
+                self.line_no,
+                self.params(),
                 self.required_pnames,
                 self.cmd,
                 self.pvals
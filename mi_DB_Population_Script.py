@@ -26,17 +26,41 @@ import re
 import os
 import sys
 
-# Diagnostic
-import pdb # debug
-
 # Local
-MODULE_DIR = os.path.abspath( "../Modules" )
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
 if MODULE_DIR not in sys.path:
     sys.path.append( MODULE_DIR )
 from mi_Error import *
 from mi_DB_Command import DB_Command
+from mi_Command_Graph import components, assign
+from mi_Log import get_logger
+from mi_Phase_Timer import phase
+from mi_Load_Journal import CHECKPOINT_CALLS
+from mi_Bulk_Loader import Bulk_Loader
+
+log = get_logger( 'load' )
+
+# Constants
+DEFAULT_BATCH_SIZE = 100 # DB Commands sent to the DB per round trip
+BATCH_SAVEPOINT = "mi_batch" # Marks the start of the batch in progress
+STATEMENT_DELIM = "; "
 
 
+def connect( dsn ):
+    """
+    Connect to the miUML metamodel DB described by a libpq connection string,
+    ex: "dbname=miuml user=modeler"
+
+    """
+    try:
+        import psycopg2 # Only needed to load the DB
+    except ImportError:
+        raise mi_Error( "Loading the DB requires the psycopg2 package" )
+    try:
+        return psycopg2.connect( dsn )
+    except psycopg2.Error as e:
+        raise mi_Error( "Cannot connect to the DB: " + str(e).strip() ) from e
+
 
 class DB_Population_Script:
     """
@@ -44,8 +68,17 @@ class DB_Population_Script:
     schema.
 
     """
-    def __init__( self ):
+    def __init__( self, sql_emitter=None ):
+        """
+        Normally every DB Command is kept until the script is executed.  With an
+        SQL Emitter, each DB Command is written out as soon as it and all
+        commands before it are complete, and then forgotten, so that only
+        unfinished commands are held in memory.
+
+        """
         self.R11_DB_Command = []
+        self.sql_emitter = sql_emitter
+        self.emitted = 0 # DB Commands written out and no longer held
 
     def last_command( self ):
         """
@@ -62,34 +95,281 @@ class DB_Population_Script:
         return ( last_command if not last_command.cmd else None )
 
 
-    def add_command( self, call_name, extracted_params ):
+    def add_command( self, call_name, extracted_params, line_no=None ):
         """
         Event: Add a new command to the end of this pop script
 
         """
-        self.R11_DB_Command.append( DB_Command( call_name, extracted_params ) )
+        self.R11_DB_Command.append(
+                DB_Command( call_name, extracted_params, line_no, self ) )
+        self.flush()
+
+    def add_record( self, record, line_offset=0 ):
+        """
+        Event: Add a completed command, rebuilt from its record, to the end of
+        this pop script
+
+        """
+        self.R11_DB_Command.append( DB_Command.from_record( record, self, line_offset ) )
+        self.flush()
+
+    def command_completed( self, db_command ):
+        """
+        Event: A DB Command has generated its cmd string
+
+        """
+        self.flush()
+
+    def flush( self ):
+        """
+        In emit mode, writes out and forgets each leading completed DB Command.
+        A completed command waits behind an unfinished one to keep the order.
+
+        """
+        if not self.sql_emitter:
+            return
+        done = 0
+        for c in self.R11_DB_Command:
+            if not c.cmd:
+                break
+            self.sql_emitter.write_command( c )
+            done += 1
+        del self.R11_DB_Command[:done]
+        self.emitted += done
+
+    def command_count( self ):
+        """
+        Number of DB Commands in the script, whether held or already written out.
 
-    def execute( self ):
         """
-        Connect to the database and run the script.  Rolls back if any command
-        fails.
+        return self.emitted + len( self.R11_DB_Command )
 
+    def execute( self, db_connection, batch_size=DEFAULT_BATCH_SIZE, journal=None ):
         """
-        # Connect to DB
-        
-        # Create savepoint
+        Run the script on an open DB-API connection (psycopg2 or a stand-in)
+        inside a single transaction.  Rolls back if any command fails.
 
-        # Loop through commands
-        # Rolling back if problem
+        Commands are pipelined to the DB in batches of batch_size so that a
+        whole batch costs one round trip instead of one per command, and each
+        shape of command is prepared once so that the DB only binds the values
+        of each command.  The connection is closed when we are done, success
+        or failure.
 
-        # Close DB connection
+        With a Load Journal, the script is committed in checkpoints instead
+        and a failure only rolls back the checkpoint in progress.  Commands
+        the journal shows as committed by an earlier load are skipped.
 
+        """
+        self.check_ready( batch_size )
+        with phase( 'execution' ):
+            cursor = db_connection.cursor()
+            try:
+                self.prepare( cursor, self.R11_DB_Command )
+                if journal:
+                    self.execute_checkpoints( db_connection, cursor, batch_size, journal )
+                else:
+                    # Loop through commands, a batch at a time
+                    for b in range( 0, len(self.R11_DB_Command), batch_size ):
+                        self.execute_batch( cursor, self.R11_DB_Command[b:b+batch_size] )
+            except:
+                # Rolling back if problem, the DB returns to its initial state
+                # or, with a journal, to the last checkpoint
+                db_connection.rollback()
+                raise
+            else:
+                db_connection.commit()
+            finally:
+                # Close DB connection
+                db_connection.close()
+        log.info( "Loaded %d DB Commands", len(self.R11_DB_Command) )
+
+    def checkpoints( self ):
+        """
+        The script split into ( start, end ) command index ranges, a new one
+        starting with each domain and subsystem.
 
+        """
+        starts = [ n for n, c in enumerate( self.R11_DB_Command )
+                if n and c.call_name in CHECKPOINT_CALLS ]
+        return list( zip( [ 0 ] + starts, starts + [ len(self.R11_DB_Command) ] ) )
 
+    def execute_checkpoints( self, db_connection, cursor, batch_size, journal ):
+        """
+        Commit each checkpoint in turn and record it in the journal, which is
+        removed once the whole script is loaded.  The checkpoint is on disk
+        before the commit, so that the journal never misses a commit, even one
+        interrupted before it is confirmed.
 
+        """
+        done = journal.resume( self.R11_DB_Command )
+        for start, end in self.checkpoints():
+            start = max( start, done )
+            if start >= end:
+                continue
+            try:
+                for b in range( start, end, batch_size ):
+                    self.execute_batch( cursor, self.R11_DB_Command[b:min( b + batch_size, end )] )
+            except mi_Error as e:
+                raise mi_Error( "{}\n{} of {} DB Commands committed, load again to resume "
+                    "or roll back the partial load".format(
+                        e, journal.done(), len(self.R11_DB_Command) ) ) from e
+            journal.checkpoint( self.R11_DB_Command[start:end] )
+            db_connection.commit()
+            journal.confirm()
+        journal.finish()
+
+    def execute_bulk( self, db_connection ):
+        """
+        Run the script on an open DB-API connection inside a single transaction
+        like execute(), but staged with COPY and applied on the DB in one
+        statement, see mi_Bulk_Loader.
 
+        """
+        self.check_ready( DEFAULT_BATCH_SIZE )
+        with phase( 'execution' ):
+            Bulk_Loader( self.R11_DB_Command ).load( db_connection )
 
+    def check_ready( self, batch_size ):
+        """
+        Every command must be complete before anything is sent.
 
+        """
+        for c in self.R11_DB_Command:
+            if not c.cmd:
+                raise mi_Error( "Unfinished DB Command at line {}: {}".format(
+                    c.line_no, c.call_name ) )
+        if batch_size < 1:
+            raise mi_Error( "Batch size must be at least 1: " + str(batch_size) )
+
+    def execute_concurrent( self, connect, connections, batch_size=DEFAULT_BATCH_SIZE ):
+        """
+        Run the script on up to the given number of DB-API connections at once,
+        each opened by calling connect().  The commands are split into
+        components of commands that depend on one another by the Command
+        Graph, and each connection executes its share of the components, in
+        script order and in batches like execute().  A script with a single
+        component is simply executed on one connection.
+
+        All or nothing still holds with a two-phase commit.  Each connection
+        runs a prepared transaction of the same global transaction.  Only once
+        every connection has executed and prepared its share without error is
+        each prepared transaction committed.  Otherwise every connection is
+        rolled back.  The DB must allow prepared transactions, see the
+        Postgres max_prepared_transactions setting.
+
+        """
+        self.check_ready( batch_size )
+        lanes = assign( components( self.R11_DB_Command ), connections )
+        if len( lanes ) < 2:
+            self.execute( connect(), batch_size )
+            return
+        # Only needed here, so importing the script stays quick
+        import uuid
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+
+        with phase( 'execution' ):
+            conns = []
+            gtrid = "mitext-" + uuid.uuid4().hex
+            failed = threading.Event()
+            errors = [ None ] * len( lanes )
+
+            def run( n ):
+                cursor = conns[n].cursor()
+                lane = lanes[n]
+                try:
+                    self.prepare( cursor, lane )
+                    for b in range( 0, len(lane), batch_size ):
+                        if failed.is_set(): # Another lane failed, don't bother
+                            return
+                        self.execute_batch( cursor, lane[b:b+batch_size] )
+                    conns[n].tpc_prepare()
+                except Exception as e:
+                    errors[n] = e
+                    failed.set()
+
+            try:
+                try:
+                    for n in range( len( lanes ) ):
+                        conns.append( connect() )
+                        conns[n].tpc_begin( conns[n].xid( 0, gtrid, str(n) ) )
+                    with ThreadPoolExecutor( max_workers=len( lanes ) ) as pool:
+                        list( pool.map( run, range( len( lanes ) ) ) )
+                    for e in errors:
+                        if e:
+                            raise e if isinstance( e, mi_Error ) else mi_Error(
+                                "Prepared transaction failed: " + str(e).strip() ) from e
+                except:
+                    # Nothing has been committed yet, the DB returns to its initial state
+                    for conn in conns:
+                        try:
+                            conn.tpc_rollback()
+                        except Exception:
+                            pass
+                    raise
+                # Every share is prepared, so the global transaction commits
+                for n, conn in enumerate( conns ):
+                    try:
+                        conn.tpc_commit()
+                    except Exception as e:
+                        raise mi_Error( "Commit of prepared transactions {} failed after {} "
+                            "of {}, commit the rest with COMMIT PREPARED\n{}".format(
+                                gtrid, n, len( conns ), str(e).strip() ) ) from e
+            finally:
+                for conn in conns:
+                    conn.close()
+        log.info( "Loaded %d DB Commands on %d connections", len(self.R11_DB_Command), len(lanes) )
+
+    def prepare( self, cursor, db_commands ):
+        """
+        Prepare a statement on the DB for each shape of the DB Commands, all in
+        one round trip.  A prepared statement lasts as long as the connection.
+
+        """
+        statements = dict.fromkeys( c.shape.prepare for c in db_commands ) # In order, once each
+        if not statements:
+            return
+        try:
+            cursor.execute( STATEMENT_DELIM.join( statements ) )
+        except Exception as e:
+            raise mi_Error( "Cannot prepare the DB Commands\n" + str(e).strip() ) from e
+
+    def execute_batch( self, cursor, batch ):
+        """
+        Send a batch of prepared DB Commands in one round trip, preceded by a
+        savepoint that is released at the end of the batch.  Otherwise each
+        batch would nest another subtransaction in the load's transaction, and
+        Postgres slows down once a transaction has more than 64 of them open.
+
+        If the batch fails we can't tell which command was rejected, so we roll
+        back to the savepoint and replay the batch one command at a time until
+        the DB rejects the same command again.  Only the failure path pays for
+        the extra round trips.
+
+        """
+        statements = [ "SAVEPOINT " + BATCH_SAVEPOINT ]
+        pvals = []
+        for c in batch:
+            statements.append( c.shape.execute )
+            pvals += c.pvals
+        statements.append( "RELEASE SAVEPOINT " + BATCH_SAVEPOINT )
+        try:
+            cursor.execute( STATEMENT_DELIM.join( statements ), pvals )
+        except Exception: # Each DB-API driver defines its own Error class
+            cursor.execute( "ROLLBACK TO SAVEPOINT " + BATCH_SAVEPOINT )
+        else:
+            return
+
+        # Find the culprit
+        for c in batch:
+            try:
+                cursor.execute( c.shape.execute, c.pvals )
+            except Exception as e:
+                raise mi_Error( "DB Command failed at line {}: {} {}\n{}".format(
+                    c.line_no, c.cmd, c.pvals, str(e).strip() ) ) from e
+
+        # The batch failed as a whole, but no single command did
+        raise mi_Error( "DB Command batch failed at line {}".format( batch[0].line_no ) )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,444 @@
+#! /usr/bin/env python
+
+"""
+Stand-in DB driver
+
+A local DB-API look-alike that understands just enough of the SQL generated by
+a DB Population Script to stand in for the miUML metamodel DB.  Each call to
+execute() is one simulated network round trip and costs the configured latency.
+
+API calls are not interpreted.  They are recorded in the current transaction
+and may be rejected by a caller supplied function to simulate metamodel errors.
+
+Several connections may share one stand-in DB, and each connection supports
+the DB-API two-phase commit extension used to commit their transactions as one.
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import re
+import time
+import threading
+
+# Constants
+PLACEHOLDER = "%s"
+COPY_Unescape = { 't':'\t', 'n':'\n', 'r':'\r' } # Escapes of the COPY text format
+
+# Regex
+call_RE = re.compile( r'^SELECT\s+UI_(?P<call_name>\w+)\(\s*(?P<params>.*?)\s*\)$', re.S )
+pname_RE = re.compile( r'p_(?P<pname>\w+)\s*:=' )
+savepoint_RE = re.compile( r'^SAVEPOINT\s+(?P<name>\w+)$' )
+rollback_to_RE = re.compile( r'^ROLLBACK\s+TO\s+SAVEPOINT\s+(?P<name>\w+)$' )
+release_RE = re.compile( r'^RELEASE\s+SAVEPOINT\s+(?P<name>\w+)$' )
+prepare_RE = re.compile( r'^PREPARE\s+(?P<name>\w+)\s+AS\s+(?P<statement>SELECT\s.*)$', re.S )
+execute_RE = re.compile( r'^EXECUTE\s+(?P<name>\w+)(\s*\(.*\))?$', re.S )
+# The staging tables and apply block of a bulk load, see mi_Bulk_Loader
+create_temp_RE = re.compile(
+        r'^CREATE\s+TEMP\s+TABLE\s+(?P<table>\w+)\(\s*(?P<columns>.*?)\s*\)\s+ON\s+COMMIT\s+DROP$', re.S )
+column_RE = re.compile( r'"?(?P<column>\w+)"?\s+(?P<type>\w+( precision)?(?P<array>\[\])?)' )
+copy_RE = re.compile( r'^COPY\s+(?P<table>\w+)\(\s*(?P<columns>.*?)\s*\)\s+FROM\s+STDIN$' )
+do_RE = re.compile( r'^DO\s+(?P<tag>\$\w*\$)(?P<body>.*)(?P=tag)$', re.S )
+perform_RE = re.compile( r'r\.shape = (?P<shape>\d+) THEN PERFORM UI_(?P<call_name>\w+)\(\s*'
+        r'(?P<params>.*?)\s*\) FROM (?P<table>\w+) s' )
+staged_param_RE = re.compile( r'p_(?P<pname>\w+):=s\."(?P<column>\w+)"' )
+array_element_RE = re.compile( r'"(?P<quoted>(?:[^"\\]|\\.)*)"|(?P<plain>[^,{}]+)' )
+copy_unescape_RE = re.compile( r'\\(.)' )
+
+
+class Stand_In_Error( Exception ):
+    """
+    Raised for anything the real DB would reject.
+
+    """
+    pass
+
+
+def connect( latency=0.0, reject=None, db=None ):
+    """
+    Open a stand-in connection.  Latency is in seconds per round trip.  The
+    reject function is given the call name and a dict of parameter values for
+    each API call and returns an error message to make that call fail.  The
+    connection gets a DB of its own unless one to share is given.
+
+    """
+    return Stand_In_Connection( latency, reject, db or Stand_In_DB() )
+
+
+class Stand_In_DB:
+    """
+    What the connections to one DB share: the committed API calls and the
+    prepared transactions.
+
+    """
+    def __init__( self ):
+        self.committed = [] # ( call_name, params ) of every committed API call
+        self.prepared = {} # xid : API calls of a prepared transaction
+        self.lock = threading.Lock()
+
+    def apply( self, calls ):
+        """
+        Adds the API calls of a committed transaction.  A delete_domain call
+        removes every committed call of that domain instead of being kept.
+        Called with the lock held.
+
+        """
+        for call_name, params in calls:
+            if call_name != 'delete_domain':
+                self.committed.append( ( call_name, params ) )
+                continue
+            name = params.get('name')
+            self.committed = [ ( c, p ) for c, p in self.committed if name not in (
+                p.get('domain'), p.get('client'), p.get('service'),
+                p.get('name') if c == 'new_domain' else None ) ]
+
+
+class Stand_In_Connection:
+    """
+    A connection with a single open transaction, just like psycopg2 which
+    implicitly begins a transaction on the first statement.
+
+    """
+    def __init__( self, latency, reject, db ):
+        self.latency = latency
+        self.reject = reject
+        self.db = db
+        self.round_trips = 0
+        self.pending = [] # API calls in the open transaction
+        self.savepoints = [] # ( name, length of pending when set ), nested, innermost last
+        self.deepest = 0 # Most savepoints ever open at once in a transaction
+        self.aborted = False
+        self.closed = False
+        self.tpc_xid = None # Of a two-phase commit transaction
+        self.tables = {} # Temp table name : { 'types':{ column:type }, 'rows':[ { column:value } ] }
+        self.statements = {} # Prepared statement name : statement, for the session
+
+    @property
+    def committed( self ):
+        return self.db.committed
+
+    def cursor( self ):
+        if self.closed:
+            raise Stand_In_Error( "connection already closed" )
+        return Stand_In_Cursor( self )
+
+    def commit( self ):
+        self.round_trip()
+        if self.aborted:
+            # Postgres turns a commit of an aborted transaction into a rollback
+            self.rollback()
+            return
+        with self.db.lock:
+            self.db.apply( self.pending )
+        self.pending = []
+        self.savepoints = []
+        self.tables = {} # ON COMMIT DROP
+
+    def rollback( self ):
+        self.round_trip()
+        self.pending = []
+        self.savepoints = []
+        self.tables = {}
+        self.aborted = False
+
+    def close( self ):
+        self.closed = True
+
+    def xid( self, format_id, gtrid, bqual ):
+        return ( format_id, gtrid, bqual )
+
+    def tpc_begin( self, xid ):
+        if self.tpc_xid or self.pending:
+            raise Stand_In_Error( "tpc_begin must be called outside a transaction" )
+        self.tpc_xid = xid
+
+    def tpc_prepare( self ):
+        """
+        PREPARE TRANSACTION: the open transaction is kept by the DB, no longer
+        by this connection, until committed or rolled back.
+
+        """
+        self.round_trip()
+        if self.aborted:
+            self.rollback()
+            raise Stand_In_Error( "current transaction is aborted, could not prepare" )
+        with self.db.lock:
+            self.db.prepared[ self.tpc_xid ] = self.pending
+        self.pending = []
+        self.savepoints = []
+        self.tables = {}
+
+    def tpc_commit( self ):
+        self.round_trip()
+        with self.db.lock:
+            self.db.apply( self.db.prepared.pop( self.tpc_xid ) )
+        self.tpc_xid = None
+
+    def tpc_rollback( self ):
+        self.round_trip()
+        with self.db.lock:
+            self.db.prepared.pop( self.tpc_xid, None )
+        self.pending = []
+        self.savepoints = []
+        self.tables = {}
+        self.aborted = False
+        self.tpc_xid = None
+
+    def savepoint( self, name ):
+        """
+        The position of the innermost savepoint of that name, which, as in
+        Postgres, is the one a rollback to or a release of the name refers to.
+
+        """
+        for n in range( len( self.savepoints ) - 1, -1, -1 ):
+            if self.savepoints[n][0] == name:
+                return n
+        raise Stand_In_Error( "savepoint does not exist: " + name )
+
+    def round_trip( self ):
+        self.round_trips += 1
+        if self.latency:
+            time.sleep( self.latency )
+
+
+class Stand_In_Cursor:
+    """
+    Runs one or more ; delimited statements per execute() call.
+
+    """
+    def __init__( self, connection ):
+        self.connection = connection
+
+    def execute( self, operation, parameters=() ):
+        """
+        One round trip.  Statements run in order until one fails, at which
+        point the transaction is aborted and the rest are skipped.
+
+        """
+        conn = self.connection
+        conn.round_trip()
+        r = do_RE.match( operation.strip() )
+        if r: # A block is one statement, whatever it contains
+            self.check_open()
+            self.apply_staged( r.group('body') )
+            return
+        pvals = list( parameters or () )
+        for statement in operation.split( ";" ):
+            statement = statement.strip()
+            if not statement:
+                continue
+            n = statement.count( PLACEHOLDER )
+            svals, pvals = pvals[:n], pvals[n:]
+            self.run( statement, svals )
+
+    def run( self, statement, svals ):
+        conn = self.connection
+
+        r = rollback_to_RE.match( statement )
+        if r:
+            n = conn.savepoint( r.group('name') )
+            del conn.pending[ conn.savepoints[n][1]: ]
+            del conn.savepoints[ n + 1: ] # The savepoint itself stays
+            conn.aborted = False
+            return
+
+        if conn.aborted:
+            raise Stand_In_Error(
+                "current transaction is aborted, commands ignored until end of transaction block" )
+
+        r = savepoint_RE.match( statement )
+        if r:
+            conn.savepoints.append( ( r.group('name'), len( conn.pending ) ) )
+            conn.deepest = max( conn.deepest, len( conn.savepoints ) )
+            return
+
+        r = release_RE.match( statement )
+        if r:
+            del conn.savepoints[ conn.savepoint( r.group('name') ): ]
+            return
+
+        r = create_temp_RE.match( statement )
+        if r:
+            columns = [ column_RE.match( c.strip() ) for c in r.group('columns').split(",") ]
+            conn.tables[ r.group('table') ] = { 'rows':[], 'types':{
+                c.group('column'):c.group('type') for c in columns } }
+            return
+
+        r = prepare_RE.match( statement )
+        if r:
+            conn.statements[ r.group('name') ] = r.group('statement')
+            return
+
+        r = execute_RE.match( statement )
+        if r:
+            prepared = conn.statements.get( r.group('name') )
+            if not prepared:
+                conn.aborted = True
+                raise Stand_In_Error( "prepared statement does not exist: " + r.group('name') )
+            # The values are bound in $1, $2, ... order, which is the parameter order
+            self.run( prepared, svals )
+            return
+
+        r = call_RE.match( statement )
+        if not r:
+            conn.aborted = True
+            raise Stand_In_Error( "syntax error: " + statement )
+        params = dict( zip( pname_RE.findall( r.group('params') ), svals ) )
+        error = conn.reject and conn.reject( r.group('call_name'), params )
+        if error:
+            conn.aborted = True
+            raise Stand_In_Error( error )
+        conn.pending.append( ( r.group('call_name'), params ) )
+
+    def check_open( self ):
+        if self.connection.aborted:
+            raise Stand_In_Error(
+                "current transaction is aborted, commands ignored until end of transaction block" )
+
+    def copy_expert( self, sql, file ):
+        """
+        COPY FROM STDIN into a staging table, the rows in the text format read
+        from the file.  One round trip.
+
+        """
+        conn = self.connection
+        conn.round_trip()
+        self.check_open()
+        r = copy_RE.match( sql.strip() )
+        table = r and conn.tables.get( r.group('table') )
+        if not table:
+            conn.aborted = True
+            raise Stand_In_Error( "syntax error or no such table: " + sql )
+        columns = [ c.strip().strip('"') for c in r.group('columns').split(",") ]
+        for line in file.read().splitlines():
+            fields = line.split( "\t" )
+            if len( fields ) != len( columns ):
+                conn.aborted = True
+                raise Stand_In_Error( "wrong number of columns in COPY row: " + line )
+            table['rows'].append( { c:copy_value( f, table['types'][c] )
+                for c, f in zip( columns, fields ) } )
+
+    def apply_staged( self, body ):
+        """
+        The apply block of a bulk load: each PERFORM of an API call on the
+        staged rows of a shape, in seq order across every staging table.
+
+        """
+        conn = self.connection
+        performs = { int( p.group('shape') ):( p.group('call_name'), p.group('table'),
+            [ ( s.group('pname'), s.group('column') ) for s in
+                staged_param_RE.finditer( p.group('params') ) ] )
+            for p in perform_RE.finditer( body ) }
+        rows = sorted( ( row for t in { table for _, table, _ in performs.values() }
+            for row in conn.tables[t]['rows'] ), key=lambda row: row['seq'] )
+        applied = len( conn.pending )
+        for row in rows:
+            call_name, _, staged = performs[ row['shape'] ]
+            params = { pname:row[column] for pname, column in staged }
+            error = conn.reject and conn.reject( call_name, params )
+            if error:
+                # The block is one statement, none of its calls survive it
+                del conn.pending[applied:]
+                conn.aborted = True
+                raise Stand_In_Error( "mitext seq {} line {}: {}".format(
+                    row['seq'], row['line_no'], error ) )
+            conn.pending.append( ( call_name, params ) )
+
+
+def copy_value( field, sql_type ):
+    """
+    A COPY text format field as a Python value of the column's type.
+
+    """
+    if field == "\\N":
+        return None
+    field = copy_unescape_RE.sub( lambda m: COPY_Unescape.get( m.group(1), m.group(1) ), field )
+    if not sql_type.endswith( "[]" ):
+        return scalar_value( field, sql_type )
+    return [ None if e.group('plain') == "NULL" else scalar_value(
+            e.group('plain') if e.group('quoted') is None else
+                re.sub( r'\\(.)', r'\1', e.group('quoted') ), sql_type[:-2] )
+        for e in array_element_RE.finditer( field[1:-1] ) ]
+
+
+def scalar_value( text, sql_type ):
+    if sql_type == "integer":
+        return int( text )
+    if sql_type == "boolean":
+        return text == "t"
+    if sql_type == "double precision":
+        return float( text )
+    return text
+
+
+if __name__ == '__main__':
+    # Compare one command per round trip against batched round trips
+    from mi_API_Parser import API_Parser
+    from mi_DB_Population_Script import DB_Population_Script
+    from mi_Parameter import Context_Parameter
+
+    API_Parser()
+    Context_Parameter['domain'] = 'ATC'
+    Context_Parameter['subsys'] = 'Main'
+    script = DB_Population_Script()
+    for n in range( 1, 501 ):
+        script.add_command( 'new_class',
+            { 'name':'Class ' + str(n), 'alias':'C' + str(n), 'cnum':n }, n )
+
+    for batch_size in ( 1, 10, 100 ):
+        conn = connect( latency=0.001 )
+        start = time.perf_counter()
+        script.execute( conn, batch_size )
+        print( "batch size {:>4}: {:>4} round trips, {:.3f}s, savepoints nested {} deep".format(
+            batch_size, conn.round_trips, time.perf_counter() - start, conn.deepest ) )
+        # Each batch releases its savepoint, or the DB would nest one per batch
+        assert conn.deepest <= 1, "Batch savepoints were never released"
+    conn = connect( latency=0.001 )
+    start = time.perf_counter()
+    script.execute_bulk( conn )
+    print( "bulk load:       {:>4} round trips, {:.3f}s".format(
+        conn.round_trips, time.perf_counter() - start ) )
+
+    # A rejected command is reported with its line and nothing is committed
+    conn = connect( reject=lambda call_name, params:
+            "duplicate cnum" if params.get('cnum') == 250 else None )
+    try:
+        script.execute( conn )
+    except Exception as e:
+        print( e )
+    print( "committed after failure: {}".format( len(conn.committed) ) )
+
+    # Independent domains on several connections, committed as one
+    script = DB_Population_Script()
+    for d in range( 1, 5 ):
+        Context_Parameter['domain'] = 'Domain ' + str(d)
+        for n in range( 1, 126 ):
+            script.add_command( 'new_class',
+                { 'name':'Class ' + str(n), 'alias':'C' + str(n), 'cnum':n }, n )
+    for connections in ( 1, 4 ):
+        db = Stand_In_DB()
+        start = time.perf_counter()
+        script.execute_concurrent( lambda: connect( latency=0.001, db=db ), connections, 10 )
+        print( "{} connections: {} committed, {:.3f}s".format(
+            connections, len(db.committed), time.perf_counter() - start ) )
+    db = Stand_In_DB()
+    try:
+        script.execute_concurrent( lambda: connect( db=db, reject=lambda call_name, params:
+            "duplicate cnum" if params.get('domain') == 'Domain 3' and
+                params.get('cnum') == 99 else None ), 4 )
+    except Exception as e:
+        print( e )
+    print( "committed after failure: {}, prepared: {}".format(
+        len(db.committed), len(db.prepared) ) )
@@ -0,0 +1,226 @@
+#! /usr/bin/env python
+
+"""
+mitext daemon
+
+Every run of mitext pays for starting Python, importing the parser and
+loading the API before it reads a single model.  The daemon pays once: it is
+started with mitext --serve and then runs any number of mitext command lines
+sent to it over a local Unix socket, with the API and the compiled
+expressions already loaded.
+
+Each request and reply is one line of JSON:
+
+    { 'argv':[ <mitext argument>, ... ], 'cwd':<directory the paths are relative to> }
+    { 'status':<exit status>, 'stdout':<text>, 'stderr':<text> }
+
+A request of { 'stop':true } shuts the daemon down.  Requests are run one at
+a time since the parser keeps its context in module globals.
+
+The daemon runs command lines with its user's rights, so only that user may
+talk to it.  The socket is made in $XDG_RUNTIME_DIR, or else in a directory
+of the user's own in the temp directory that nobody else may enter, and is
+readable and writable by its owner only.  On top of that, the daemon and the
+client each check that the other end is run by the same user, where the
+system tells.
+
+This module is also the client, and imports nothing else so that it starts
+quickly.  Run it just like mitext, ex from an editor's save hook:
+
+    mi_Daemon.py [--socket PATH] [mitext arguments] model.tm
+    mi_Daemon.py [--socket PATH] --stop
+
+If no daemon is listening, the command line is run by mitext itself.
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import io
+import os
+import sys
+import json
+import stat
+import socket
+import struct
+import tempfile
+import contextlib
+
+# Constants
+RUNTIME_DIR = os.environ.get( 'XDG_RUNTIME_DIR' ) or os.path.join(
+        tempfile.gettempdir(), "mitext-{}".format( os.getuid() ) )
+DEFAULT_SOCKET = os.path.join( RUNTIME_DIR, "mitext.sock" )
+
+
+def make_private_dir( path ):
+    """
+    Makes the directory for the socket, unless it exists, and ensures that
+    it is ours and that nobody else may enter it.
+
+    """
+    os.makedirs( path, mode=0o700, exist_ok=True )
+    info = os.lstat( path )
+    if not stat.S_ISDIR( info.st_mode ) or info.st_uid != os.getuid():
+        raise OSError( path + " is not a directory of ours" )
+    if info.st_mode & 0o077:
+        raise OSError( path + " may be entered by other users" )
+
+
+def peer_uid( s ):
+    """
+    The user id of the process at the other end of a connected Unix socket,
+    or None where the system doesn't tell.
+
+    """
+    if not hasattr( socket, 'SO_PEERCRED' ):
+        return None
+    creds = s.getsockopt( socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize( '3i' ) )
+    pid, uid, gid = struct.unpack( '3i', creds )
+    return uid
+
+
+def is_ours( s ):
+    """
+    Whether the other end of a connected socket is run by our own user.
+
+    """
+    uid = peer_uid( s )
+    return uid is None or uid == os.getuid()
+
+
+def serve( socket_path, run ):
+    """
+    Accepts requests on the socket until stopped.  The run function is given
+    the argv, cwd and an output and error stream for each request and returns
+    the exit status.
+
+    """
+    import socketserver # Only the daemon needs it
+
+    class Request_Handler( socketserver.StreamRequestHandler ):
+        def handle( self ):
+            for line in self.rfile:
+                try:
+                    request = json.loads( line )
+                except ValueError:
+                    self.reply( { 'status':2, 'stdout':"", 'stderr':"Bad request\n" } )
+                    continue
+                if request.get('stop'):
+                    self.reply( { 'status':0, 'stdout':"", 'stderr':"" } )
+                    self.server.stopping = True
+                    return
+                self.reply( run_request( request, run ) )
+
+        def reply( self, reply ):
+            self.wfile.write( ( json.dumps( reply ) + "\n" ).encode() )
+            self.wfile.flush()
+
+    class Server( socketserver.UnixStreamServer ):
+        def verify_request( self, request, client_address ):
+            return is_ours( request ) # Other users are hung up on
+
+    if socket_path == DEFAULT_SOCKET:
+        make_private_dir( RUNTIME_DIR )
+    if os.path.lexists( socket_path ):
+        if os.lstat( socket_path ).st_uid != os.getuid():
+            raise OSError( socket_path + " belongs to another user" )
+        if connect( socket_path ):
+            raise OSError( "A daemon is already listening on " + socket_path )
+        os.remove( socket_path ) # Left behind by one that died
+    umask = os.umask( 0o177 ) # No window where others may connect
+    try:
+        server = Server( socket_path, Request_Handler )
+    finally:
+        os.umask( umask )
+    os.chmod( socket_path, 0o600 )
+    server.stopping = False
+    try:
+        while not server.stopping:
+            server.handle_request()
+    finally:
+        server.server_close()
+        os.remove( socket_path )
+
+
+def run_request( request, run ):
+    """
+    Runs one command line and collects everything it writes.
+
+    """
+    out, err = io.StringIO(), io.StringIO()
+    try:
+        with contextlib.redirect_stdout( out ), contextlib.redirect_stderr( err ):
+            status = run( request['argv'], request['cwd'], out, err )
+    except SystemExit as e: # Argument errors
+        status = e.code if isinstance( e.code, int ) else 1
+    except Exception as e: # The daemon stays up
+        err.write( "{}: {}\n".format( e.__class__.__name__, e ) )
+        status = 1
+    return { 'status':status, 'stdout':out.getvalue(), 'stderr':err.getvalue() }
+
+
+def connect( socket_path ):
+    """
+    A connected socket, or None if no daemon of our own user is listening.
+    A socket of another user is never connected to, it could be anyone's
+    daemon collecting our command lines.
+
+    """
+    try:
+        if os.stat( socket_path ).st_uid != os.getuid():
+            return None
+    except OSError:
+        return None
+    s = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+    try:
+        s.connect( socket_path )
+    except OSError:
+        s.close()
+        return None
+    if not is_ours( s ):
+        s.close()
+        return None
+    return s
+
+
+def request( socket_path, message ):
+    """
+    Sends one request and returns the reply, or None if no daemon is listening.
+
+    """
+    s = connect( socket_path )
+    if not s:
+        return None
+    with s, s.makefile( 'rwb' ) as f:
+        f.write( ( json.dumps( message ) + "\n" ).encode() )
+        f.flush()
+        line = f.readline()
+    return json.loads( line ) if line else None
+
+
+if __name__ == '__main__':
+    argv = sys.argv[1:]
+    socket_path = DEFAULT_SOCKET
+    if argv[:1] == [ "--socket" ] and len( argv ) > 1:
+        socket_path, argv = argv[1], argv[2:]
+    if argv == [ "--stop" ]:
+        sys.exit( 0 if request( socket_path, { 'stop':True } ) else 1 )
+    reply = request( socket_path, { 'argv':argv, 'cwd':os.getcwd() } )
+    if reply is None:
+        mitext = os.path.join( os.path.dirname( os.path.realpath(__file__) ), "mitext.py" )
+        os.execv( sys.executable, [ sys.executable, mitext ] + argv )
+    sys.stdout.write( reply['stdout'] )
+    sys.stderr.write( reply['stderr'] )
+    sys.exit( reply['status'] )
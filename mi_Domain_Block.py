@@ -0,0 +1,326 @@
+#! /usr/bin/env python
+
+"""
+Class: Domain Block
+
+A Domain Block is the stretch of an miUML Text Script from one domain section
+header up to the next.  Since the Metamodel Parser clears all of its buffers at
+each new domain, each Domain Block can be extracted on its own.
+
+An incremental extraction fingerprints each Domain Block and keeps the DB
+Commands it yielded.  On the next run, the commands of any unchanged block are
+reused without parsing it again, and only changed blocks are extracted.  The
+saved commands for each model are kept in the local cache in a manifest:
+
+    { fingerprint: { 'commands':[ <DB Command record>, ... ],
+        'loaded':[ <hash of a DB connection string>, ... ] }, ... }
+
+where 'loaded' records each DB the block's commands were successfully executed
+against, so that a later load into the same DB may skip them.  A block that has changed
+since it was loaded must have its earlier version removed from the DB before
+it can be loaded again, or the DB will reject it as a duplicate.
+
+A large script can also be extracted a Domain Block per worker process, with
+the DB Commands merged back in script order.
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import io
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+# Local
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
+if MODULE_DIR not in sys.path:
+    sys.path.append( MODULE_DIR )
+from mi_Error import *
+from mi_API_Parser import API_Parser
+from mi_Section import section_RE
+from mi_Parameter import Context_Parameter
+from mi_DB_Population_Script import DB_Population_Script
+from mi_Extraction import Extraction, COMMENT_CHAR
+from mi_Metamodel_Parser import Identifier_Setting
+from mi_Section_Index import Section_Index
+import mi_Cache
+import mi_Fragment
+import mi_Lexer
+import mi_Log
+import mi_Phase_Timer
+import mi_Expression_Stats
+
+# Constants
+DOMAIN_SECTION = 'domain'
+MANIFEST = "domain_blocks" # Cache entry name prefix
+PARALLEL_MIN_LINES = 20000 # Smaller scripts aren't worth starting workers for
+
+
+class Domain_Block:
+    """
+    A run of text script lines starting with a domain section header, or with
+    the first line of the script for the first block.
+
+    """
+    def __init__( self, first_line_no, lines, path ):
+        self.first_line_no = first_line_no
+        self.lines = lines
+        # Independent of position, so a block that only moved is unchanged,
+        # but not of the fragments it includes or of whether identifiers are
+        # created
+        self.fingerprint = mi_Cache.content_hash( mi_Cache.code_version(),
+                str( Identifier_Setting['enabled'] ), *lines,
+                *[ d for _, d in mi_Fragment.includes( lines, path ) if d is not None ] )
+
+
+def is_domain_header( line ):
+    """
+    True if the line is a domain section header.
+
+    """
+    if DOMAIN_SECTION not in line or line.startswith( COMMENT_CHAR ):
+        return False
+    r = section_RE.match( line.split( COMMENT_CHAR )[0].rstrip() )
+    return bool( r ) and r.group('name') == DOMAIN_SECTION
+
+
+def split_domains( lines, path ):
+    """
+    Splits the lines of the text script at path into Domain Blocks.  Anything
+    before the first domain header belongs to the first block.  A domain
+    header in an included fragment doesn't start a block.
+
+    """
+    blocks = []
+    start = 0
+    in_domain = False
+    for i, line in enumerate( lines ):
+        if is_domain_header( line ):
+            if in_domain:
+                blocks.append( Domain_Block( start + 1, lines[start:i], path ) )
+                start = i
+            in_domain = True
+    blocks.append( Domain_Block( start + 1, lines[start:], path ) )
+    return blocks
+
+
+def read_checked( path ):
+    """
+    The lines of the text script at path, once its section headers have all
+    been checked by a Section Index.  A block is extracted on its own, so
+    only a pass over the whole script can tell whether its first section
+    may follow the last section of the block before it.
+
+    """
+    Section_Index( path )
+    try:
+        with open( path ) as f:
+            return f.readlines()
+    except OSError:
+        raise mi_File_Error( "Cannot open", path )
+
+
+def extract_block( path, block ):
+    """
+    Extracts a single Domain Block from a clean context and returns the
+    records of its DB Commands, with line numbers relative to the block.
+
+    """
+    for focus in Context_Parameter:
+        Context_Parameter[focus] = None
+    block_script = DB_Population_Script()
+    Extraction( path, block_script, block.lines, block.first_line_no )
+    unfinished = block_script.last_command()
+    if unfinished:
+        raise mi_Error( "Unfinished DB Command at line {}: {}".format(
+            unfinished.line_no, unfinished.call_name ) )
+    offset = block.first_line_no
+    return [ ( call_name, line_no if line_no is None else line_no - offset, params )
+            for call_name, line_no, params in
+                ( c.record() for c in block_script.R11_DB_Command ) ]
+
+
+def check_domains( path, blocks, block_records ):
+    """
+    Each block's extraction only sees its own domain, so the domain names and
+    aliases are checked against each other here, as a single pass would.
+
+    """
+    index = { 'name':{}, 'alias':{} } # domain name or alias : line_no
+    for block, records in zip( blocks, block_records ):
+        for call_name, line_no, params in records:
+            if call_name != 'new_domain':
+                continue
+            line_no = None if line_no is None else line_no + block.first_line_no
+            for pname, value in params:
+                seen = index.get( pname )
+                if seen is None:
+                    continue
+                if value in seen:
+                    raise mi_Parse_Error( "Duplicate domain {}, first at line {}".format(
+                        pname, seen[value] ), path, line_no, value )
+                seen[value] = line_no
+
+
+def manifest_key( path ):
+    return mi_Cache.content_hash( os.path.abspath( path ) )
+
+
+def extract_incremental( path, db_pop_script_obj, skip_loaded=False, target=None ):
+    """
+    Extracts the text script at path into the DB Population Script, reusing
+    the saved commands of each unchanged Domain Block.  With skip_loaded, the
+    commands of a block that has already been loaded into the target DB, given
+    by its connection string, are left out entirely.
+
+    Returns the fingerprints of the blocks whose commands were added and counts
+    of the blocks reused and extracted.
+
+    """
+    lines = read_checked( path )
+
+    manifest = mi_Cache.load( MANIFEST, manifest_key( path ) ) or {}
+    new_manifest = {}
+    added = []
+    reused = extracted = 0
+    loaded_into = target and mi_Cache.content_hash( target )
+    blocks = split_domains( lines, path )
+    for block in blocks:
+        entry = manifest.get( block.fingerprint )
+        if entry:
+            reused += 1
+        else:
+            entry = { 'commands':extract_block( path, block ), 'loaded':[] }
+            extracted += 1
+        new_manifest[ block.fingerprint ] = entry
+    check_domains( path, blocks, [ new_manifest[b.fingerprint]['commands'] for b in blocks ] )
+    for block in blocks:
+        entry = new_manifest[ block.fingerprint ]
+        if skip_loaded and loaded_into in entry['loaded']:
+            continue
+        added.append( block.fingerprint )
+        for record in entry['commands']:
+            db_pop_script_obj.add_record( record, block.first_line_no )
+
+    # Blocks that are no longer in the script are forgotten
+    mi_Cache.save( MANIFEST, manifest_key( path ), new_manifest )
+    return { 'blocks':added, 'reused':reused, 'extracted':extracted }
+
+
+def mark_loaded( path, fingerprints, target ):
+    """
+    Records that the commands of these Domain Blocks have been loaded into the
+    target DB, given by its connection string.  Only its hash is kept.
+
+    """
+    manifest = mi_Cache.load( MANIFEST, manifest_key( path ) )
+    if not manifest:
+        return
+    loaded_into = mi_Cache.content_hash( target )
+    for f in fingerprints:
+        if f in manifest and loaded_into not in manifest[f]['loaded']:
+            manifest[f]['loaded'].append( loaded_into )
+    mi_Cache.save( MANIFEST, manifest_key( path ), manifest )
+
+
+def init_worker( log_level, timing, expr_stats, lexer, identifiers ):
+    mi_Log.set_level( log_level )
+    mi_Phase_Timer.Timing['enabled'] = timing
+    mi_Expression_Stats.Stats['enabled'] = expr_stats
+    Identifier_Setting['enabled'] = identifiers
+    if lexer:
+        mi_Lexer.use_lexers()
+    API_Parser()
+
+
+def extract_block_lines( path, first_line_no, lines ):
+    """
+    Worker side extraction of a Domain Block.  Returns its DB Command records
+    with line numbers relative to the block, or None if it can't be extracted
+    on its own, its captured log output, the time spent in each phase and the
+    counts made for each Expression.
+
+    """
+    block = Domain_Block.__new__( Domain_Block ) # No fingerprint needed
+    block.first_line_no, block.lines = first_line_no, lines
+    phases_before = mi_Phase_Timer.snapshot()
+    stats_before = mi_Expression_Stats.snapshot()
+    captured = io.StringIO()
+    handle = mi_Log.capture( captured )
+    try:
+        records = extract_block( path, block )
+    except Exception:
+        records = None
+    finally:
+        mi_Log.release( handle )
+    return ( records, captured.getvalue(),
+            mi_Phase_Timer.difference( mi_Phase_Timer.snapshot(), phases_before ),
+            mi_Expression_Stats.difference( mi_Expression_Stats.snapshot(), stats_before ) )
+
+
+def extract_parallel( path, db_pop_script_obj, jobs=None, min_lines=PARALLEL_MIN_LINES ):
+    """
+    Extracts the text script at path into the DB Population Script with each
+    Domain Block on a pool of jobs worker processes, one per core by default.
+    The DB Commands of each block are added in script order.  A script that
+    has only one block is extracted in this process, as is one of fewer than
+    min_lines unless the number of jobs is given.
+
+    Each block is extracted from a clean context, where the script as a whole
+    would carry the context of one domain into the next.  That makes no
+    difference to a script where each domain sets its own subsystems.  So that
+    the result is always the same as that of an extraction in one pass, the
+    script is extracted again in one pass if any block fails or leaves a DB
+    Command unfinished, which is where a difference would show.
+
+    Returns the number of Domain Blocks extracted in parallel, 0 if none.
+
+    """
+    lines = read_checked( path )
+    blocks = split_domains( lines, path )
+    if len( blocks ) < 2 or jobs == 1 or ( not jobs and len( lines ) < min_lines ):
+        Extraction( path, db_pop_script_obj, lines )
+        return 0
+
+    jobs = min( jobs or os.cpu_count() or 1, len( blocks ) )
+    results = []
+    with ProcessPoolExecutor( max_workers=jobs, initializer=init_worker,
+            initargs=( mi_Log.level(), mi_Phase_Timer.Timing['enabled'],
+                mi_Expression_Stats.Stats['enabled'], mi_Lexer.Lexer_Setting['enabled'],
+                Identifier_Setting['enabled'] ) ) as pool:
+        for records, log_text, phases, stats in pool.map( extract_block_lines, [ path ] * len( blocks ),
+                [ b.first_line_no for b in blocks ], [ b.lines for b in blocks ] ):
+            mi_Log.replay( log_text )
+            mi_Phase_Timer.accumulate( phases )
+            mi_Expression_Stats.accumulate( stats )
+            results.append( records )
+
+    if None in results: # Any error is reported as in a single pass
+        Extraction( path, db_pop_script_obj, lines )
+        return 0
+    check_domains( path, blocks, results )
+    for block, records in zip( blocks, results ):
+        for record in records:
+            db_pop_script_obj.add_record( record, block.first_line_no )
+    return len( blocks )
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        with open( path ) as f:
+            for block in split_domains( f.readlines(), path ):
+                print( "{}: line {}, {} lines, {}".format( path,
+                    block.first_line_no, len(block.lines), block.fingerprint[:12] ) )
@@ -25,9 +25,6 @@ of some Metamodel component.  Here we define the grammar of all Expressions.
 # System
 import re
 
-# Diagnostic
-import pdb # debug
-
 # Local
 
 # API
@@ -39,13 +36,14 @@ LIST_DELIM = '/' # List delimiter
 REF_SYMBOL = '->' # Reference symbol
 TYPE_SYMBOL = ':' # Data type designator
 SUBSYS_REF = '::' # Subsystem reference
+CLASS_TERM = '//' # Class terminator
 
 # Regex pattern building blocks
 SPACE = r'\s*' # Stretch of whitespace
 NAME = r'\w([\w\s]*\w)?' # Spaces must be rtrimmed on extraction
 TO_NAME = r'\w[\w\s:.,]*' # Target of attribute reference
 LIST = SPACE + LIST_DELIM + SPACE
-TERM = SPACE + '//$' # Class terminator (might also be used in other ways)
+TERM = SPACE + CLASS_TERM + '$' # Class terminator (might also be used in other ways)
 REF = SPACE + REF_SYMBOL + SPACE
 TYPE = SPACE + TYPE_SYMBOL + SPACE
 SUPER = r'<'
@@ -90,8 +88,10 @@ rnum_opt_c_RS = LIST + r'R(?P<rnum>\d+)(?P<constrained>c)?' # R<num>
 from_attr_to_attrs_opt_id_rnum_opt_c_RS = from_attr_RS + to_attrs_RS + opt_id_RS + rnum_opt_c_RS
 
 # { section:<expressions>, ... }
-# expressions -> ( ( name:expr_name, <patterns>, call:api_call_name ), ... )
+# expressions -> ( ( name:expr_name, <patterns>, [symbol:<symbol>], call:api_call_name ), ... )
 # patterns -> ( <re>, ... )
+# symbol -> a literal that every pattern of the expression requires, used to
+#   skip patterns that can't match (see Dispatch below)
 
 # A section defines one or more legal statemeents
 # each of which is defined by a regex
@@ -121,12 +121,14 @@ Expression = { # Expression modeled class implemented as dict
         {
             'name':'new_class',
             'patterns':( re.compile( name_alias_opt_cnum_term_RS ), ),
+            'symbol':CLASS_TERM, # Can't match without it
             'call':'new_class'
         },
         {
             'name':'new_ref_attr',
             'patterns':(
                 re.compile( from_attr_to_attrs_opt_id_rnum_opt_c_RS ), ),
+            'symbol':REF_SYMBOL,
             'call': None, # No API call, data saved for later command
         },
         {
@@ -166,6 +168,86 @@ Expression = { # Expression modeled class implemented as dict
 }
 
 
+# Dispatch
+#
+# The ordered search below tries every pattern of every expression in turn,
+# so a line that matches the last expression of a section has already run
+# each preceding pattern.  A dispatcher narrows the search down with a symbol
+# index so that a typical line is classified with a single match.
+#
+# Some patterns can only match text containing a particular symbol, for example
+# a referential attribute must contain '->'.  A quick substring test for each
+# of these symbols rules out the patterns that can't match.  The remaining
+# candidates are tried in their original order, so the dispatcher picks the
+# same expression that the ordered search would.
+
+class Expression_Dispatch:
+    """
+    Classifies a statement against a section's expressions using the
+    candidate patterns indexed by the symbols present in the statement.
+
+    """
+    def __init__( self, expressions, replacements=None ):
+        """
+        The replacements, if any, map an expression name to the matchers
+        used in place of its patterns, see mi_Lexer.
+
+        """
+        replacements = replacements or {}
+        # Each pattern, in search order, with the symbol it requires, if any
+        candidates = [ ( pattern, expr, expr.get('symbol') ) for expr in expressions
+                for pattern in replacements.get( expr['name'], expr['patterns'] ) ]
+        symbols = sorted( { sym for _, _, sym in candidates if sym } )
+        self.symbols = tuple( ( sym, 1 << i ) for i, sym in enumerate(symbols) )
+
+        # Candidate patterns for each combination of symbols present
+        self.candidates = []
+        for mask in range( 2**len(symbols) ):
+            present = { sym for sym, bit in self.symbols if mask & bit }
+            self.candidates.append( tuple(
+                ( pattern, expr ) for pattern, expr, sym in candidates
+                    if not sym or sym in present ) )
+
+    def candidates_for( self, text ):
+        """
+        The ( pattern, expression ) pairs that could match the text, in order.
+
+        """
+        mask = 0
+        for sym, bit in self.symbols:
+            if sym in text:
+                mask |= bit
+        return self.candidates[mask]
+
+    def match( self, text ):
+        """
+        Returns the matching expression and its extracted data, or
+        ( None, None ) if no expression matches.
+
+        """
+        for pattern, expr in self.candidates_for( text ):
+            r = pattern.match( text )
+            if r:
+                return expr, r.groupdict()
+        return None, None
+
+
+Dispatch = { section: Expression_Dispatch( exprs ) for section, exprs in Expression.items() }
+
+def ordered_match( section, text ):
+    """
+    The original search, trying each pattern in turn.  Kept as the reference
+    that the dispatcher must agree with.
+
+    """
+    for expr in Expression[section]:
+        for pattern in expr['patterns']:
+            r = pattern.match( text )
+            if r:
+                return expr, r.groupdict()
+    return None, None
+
+
 if __name__ == '__main__':
     from pprint import pprint
     print()
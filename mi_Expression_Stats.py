@@ -0,0 +1,145 @@
+#! /usr/bin/env python
+
+"""
+Expression Statistics
+
+Counts, for each section and Expression, how often its patterns are tried on a
+statement, how often they match or miss, and how long the matching and the
+Metamodel Parser's handling of the Expression take.  Used to find the
+patterns worth optimizing.
+
+A statement is classified by trying the candidate patterns of its section in
+turn, so a statement matching a later Expression is counted as a miss for
+each Expression tried before it.
+
+Counting is off until enabled.  When off, statements are classified by the
+section's dispatcher directly, with no counting at all.
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import json
+from time import perf_counter
+
+# Local
+from mi_Expression import Expression, Dispatch
+
+# Constants
+NO_MATCH = "(no match)" # Counts the statements that matched nothing as misses
+COUNTS = ( 'attempts', 'matches', 'misses', 'match_seconds', 'handled', 'handler_seconds' )
+
+# Global
+Stats = { 'enabled':False }
+Expression_Stat = {} # ( section, expression name ) : { count : value }
+Expression_Section = { # expression name : section
+        expr['name']:section for section, exprs in Expression.items() for expr in exprs }
+
+
+def stat( section, name ):
+    s = Expression_Stat.get( ( section, name ) )
+    if not s:
+        s = Expression_Stat[ ( section, name ) ] = dict.fromkeys( COUNTS, 0 )
+    return s
+
+
+def match( section, text ):
+    """
+    Same as Dispatch[section].match( text ), counting and timing each pattern
+    tried.
+
+    """
+    for pattern, expr in Dispatch[section].candidates_for( text ):
+        start = perf_counter()
+        r = pattern.match( text )
+        seconds = perf_counter() - start
+        s = stat( section, expr['name'] )
+        s['attempts'] += 1
+        s['match_seconds'] += seconds
+        if r:
+            s['matches'] += 1
+            return expr, r.groupdict()
+        s['misses'] += 1
+    s = stat( section, NO_MATCH )
+    s['attempts'] += 1
+    s['misses'] += 1
+    return None, None
+
+
+def handled( name, seconds ):
+    """
+    The Metamodel Parser handled an Expression.
+
+    """
+    s = stat( Expression_Section.get( name ), name )
+    s['handled'] += 1
+    s['handler_seconds'] += seconds
+
+
+def snapshot():
+    return { key:dict( s ) for key, s in Expression_Stat.items() }
+
+
+def difference( later, earlier ):
+    """
+    The counts between two snapshots.
+
+    """
+    empty = dict.fromkeys( COUNTS, 0 )
+    return { key:{ c:s[c] - earlier.get( key, empty )[c] for c in COUNTS }
+            for key, s in later.items() }
+
+
+def accumulate( stats ):
+    """
+    Adds counts made in another process.
+
+    """
+    for ( section, name ), s in stats.items():
+        total = stat( section, name )
+        for c in COUNTS:
+            total[c] += s[c]
+
+
+def report( stats, as_json=False ):
+    """
+    The counts as a readable table, by section and in Expression order, or as
+    a JSON document.
+
+    """
+    order = { ( section, expr['name'] ):n for n, ( section, expr ) in enumerate(
+        ( section, expr ) for section, exprs in Expression.items() for expr in exprs ) }
+    keys = sorted( stats, key=lambda k: ( order.get( k, len(order) ), str(k) ) )
+    if as_json:
+        return json.dumps( [ dict( stats[k], section=k[0], expression=k[1] ) for k in keys ],
+            indent=2 )
+    lines = [ "Expression statistics:",
+        "  {:<12}{:<16}{:>10}{:>10}{:>10}{:>7}{:>11}{:>10}{:>11}".format( "section",
+            "expression", "attempts", "matches", "misses", "miss%",
+            "match s", "handled", "handler s" ) ]
+    for k in keys:
+        s = stats[k]
+        lines.append( "  {:<12}{:<16}{:>10}{:>10}{:>10}{:>7.1f}{:>11.4f}{:>10}{:>11.4f}".format(
+            str( k[0] ), k[1], s['attempts'], s['matches'], s['misses'],
+            100.0 * s['misses'] / s['attempts'] if s['attempts'] else 0.0,
+            s['match_seconds'], s['handled'], s['handler_seconds'] ) )
+    return "\n".join( lines )
+
+
+if __name__ == '__main__':
+    Stats['enabled'] = True
+    for text in ( "Aircraft / AIR //", "Name / I", "Class -> Class.Name / R20" ):
+        match( 'classes', text )
+    print( report( snapshot() ) )
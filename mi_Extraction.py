@@ -24,32 +24,57 @@ Extracts data from an miUML Text Script and creates a DB Population Script
 import re
 import os
 import sys
-
-# Diagnostic
-import pdb # debug
+import mmap
+import locale
 
 # Local
-MODULE_DIR = os.path.abspath( "../Modules" )
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
 if MODULE_DIR not in sys.path:
     sys.path.append( MODULE_DIR )
 from mi_Error import *
 from mi_Section import *
 from mi_Current_Statement import Current_Statement
+from mi_Expression import Expression
 from mi_Metamodel_Parser import Metamodel_Parser
+from mi_Section_Index import Section_Index
+import mi_Fragment
+from mi_Fragment import INCLUDE_KEYWORD, include_RE
 
 # Global
+Scan_Setting = { 'enabled':False } # Scan memory mapped text scripts, see process_buffer()
 
 # Constants
 COMMENT_CHAR = '#'
 
+# Regex
+
+# Whole buffer scanning, see process_buffer().  Each match is the next line
+# with content, preceded by any blank or comment lines, which are skipped over
+# in one go.  The content runs from the first character other than a space or
+# tab to the end of the line.  Since every line is consumed by a match, the scan
+# never has to search for the start of the next one.
+content_RB = re.compile( rb'^((?:[ \t]*(?:#[^\n]*)?\n)*)[ \t]*([^ \t\n#][^\n]*)\n?',
+        re.MULTILINE )
+header_RB = re.compile( rb'\w+' ) # The whole of a section header, as in section_RE
+
+# Line breaks other than newline, and ASCII whitespace other than space and tab
+# that the str methods used by process_lines() strip, but the scan doesn't.
+# A file containing any of these is read line by line.
+UNSCANNABLE = ( b'\r', b'\x0b', b'\x0c', b'\x1c', b'\x1d', b'\x1e', b'\x1f' )
+
 class Extraction:
     """
     A DB Population Script is extracted from an miUML Text Script during
     an Extraction.  So this is an association class on a 1:1 association.
 
     """
-    def __init__( self, text_file_path, db_pop_script_obj ):
+    def __init__( self, text_file_path, db_pop_script_obj, lines=None, first_line_no=1 ):
         """
+        Extracts the text script at text_file_path.  Alternatively, some or all
+        of its lines may be supplied, in which case the file is not read and the
+        first of them is numbered first_line_no so that any error is reported
+        at its true line in the file.
+
         """
         # miUML Text Script file path
         self.fname = text_file_path
@@ -59,20 +84,36 @@ class Extraction:
         self.R9_DB_Population_Script = db_pop_script_obj
 
         # Bridge to the parser in the Metamodel domain
-        self.Bridge_to_Metamodel__parser = Metamodel_Parser( db_pop_script_obj )
+        self.Bridge_to_Metamodel__parser = Metamodel_Parser( db_pop_script_obj, self.fname )
 
         # Initial position in miUML Text Script
         self.current_section = 'model'
         self.line_no = 0
+        self.first_line_no = first_line_no
         self.context = {}
+        # While in a fragment, its file and line are reported for any error
+        # and the DB Commands are given the script line that included it
+        self.include_line_no = None
+        self.including = [ os.path.abspath( text_file_path ) ] # Each file being processed
 
         # Metamodel specific
         #self.ref_attrs = {}
         #self.identifiers = {}
 
         # Process each line of the text script
+        if lines is not None:
+            self.ts_file = lines
+            self.process_lines()
+            return
+        if self.scan_text_script():
+            return
+        # Every section header is checked before any statement is parsed
+        Section_Index( self.fname )
         self.open_text_script()
-        self.process_lines()
+        try:
+            self.process_lines()
+        finally:
+            self.ts_file.close()
 
     
     def open_text_script( self ):
@@ -87,6 +128,80 @@ class Extraction:
             raise mi_File_Error( "Cannot open", self.fname )
 
 
+    def scan_text_script( self ):
+        """
+        Processes the text script by scanning it as a whole in memory mapped
+        form, if it can be.  Returns False if it must be read line by line.
+
+        """
+        if not Scan_Setting['enabled']:
+            return False
+        try:
+            f = open( self.fname, 'rb' )
+        except OSError:
+            return False # Let the line by line reading report it
+        with f:
+            if not os.fstat( f.fileno() ).st_size:
+                return False # Can't map an empty file
+            with mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ ) as buffer:
+                if any( buffer.find( b ) >= 0 for b in UNSCANNABLE ):
+                    return False
+                # Every section header is checked before any statement is parsed
+                Section_Index( self.fname, buffer )
+                self.process_buffer( buffer )
+        return True
+
+    def process_buffer( self, buffer ):
+        """
+        State: Processing Line
+
+        Same as process_lines(), scanning the text script buffer for the lines
+        with content instead of reading and stripping every line.  Lines of
+        ASCII text, which is all of them in practice, are examined as bytes
+        and a statement becomes a string only once it is found in a section
+        with Expressions.  Any other line is decoded and stripped just as it
+        would be when read, so either way the result is the same.
+
+        Unlike reading, the scan never decodes blank or comment lines, so an
+        encoding error in a comment goes unnoticed.
+
+        """
+        encoding = locale.getpreferredencoding( False ) # Same as open()
+        n = self.first_line_no - 1
+        for m in content_RB.finditer( buffer ):
+            start, skipped_end = m.span(1)
+            if skipped_end > start: # Skipped some lines
+                n += buffer[ start:skipped_end ].count( b'\n' )
+            n += 1
+            content = m.group(2)
+            if content.isascii():
+                if b'#' in content:
+                    content = content[ :content.index( b'#' ) ]
+                content = content.rstrip()
+                self.line_no = n
+                if content.startswith( b'include' ) and self.include_line( content.decode() ):
+                    continue
+                if b' ' not in content and b'\t' not in content and header_RB.fullmatch( content ):
+                    self.update_section( content.decode() )
+                elif self.current_section in Expression:
+                    Current_Statement( content.decode(), self.current_section, self )
+                continue
+
+            # Exactly as in process_lines()
+            line = content.decode( encoding ).split( COMMENT_CHAR )[0].rstrip()
+            if line:
+                self.line_no = n
+                if INCLUDE_KEYWORD in line and self.include_line( line ):
+                    continue
+                section_match = section_RE.match( line )
+                if section_match:
+                    self.update_section( section_match.groupdict()['name'] )
+                elif self.current_section in Expression:
+                    Current_Statement( line.strip(), self.current_section, self )
+
+        # Commands held back for the last class, then the domain's references
+        self.Bridge_to_Metamodel__parser.end_domain()
+
     def process_lines( self ):
         """
         State: Processing Line
@@ -99,43 +214,102 @@ class Extraction:
         Statement which parses itself according to the pattern.
 
         """
-        for n, line in enumerate( self.ts_file, 1 ):
+        for n, line in enumerate( self.ts_file, self.first_line_no ):
             line = self.strip_comment( line )
             # left indent whitespace is preserved
             if line:
                 self.line_no = n
+                if INCLUDE_KEYWORD in line and self.include_line( line ):
+                    continue
                 section_match = section_RE.match( line )
                 if section_match:
                     # If the section name is valid, set it as the current section
                     self.update_section( section_match.groupdict()['name'] )
-                else:
+                elif self.current_section in Expression:
                     # Create a Statement which will parse the content
                     # any whitespace indent is removed
                     Current_Statement( line.strip(), self.current_section, self )
+                # Otherwise no Expressions are defined for this section yet
+                # so its content is skipped
+
+        # Commands held back for the last class, then the domain's references
+        self.Bridge_to_Metamodel__parser.end_domain()
+
+    def include_line( self, line ):
+        """
+        Includes the fragment named by the line if it is an include line, and
+        returns True, otherwise False.
+
+        """
+        r = include_RE.match( line )
+        if not r:
+            return False
+        self.include( r.group('path') )
+        return True
+
+    def include( self, path ):
+        """
+        State: Including Fragment
+
+        Processes the classified lines of a fragment as if they were in place
+        of the include line, see mi_Fragment.
+
+        """
+        fragment, lines = mi_Fragment.open_fragment(
+                self.fname, self.line_no, path, self.current_section, self.including )
+
+        parser = self.Bridge_to_Metamodel__parser
+        outer = ( self.fname, self.line_no, self.include_line_no )
+        self.fname = parser.fname = fragment
+        if self.include_line_no is None: # The script's own line, not a fragment's
+            self.include_line_no = parser.include_line_no = self.line_no
+        self.including.append( os.path.abspath( fragment ) )
+        try:
+            for line in lines:
+                self.line_no = line[0]
+                if line[1] == mi_Fragment.INCLUDE:
+                    self.include( line[2] )
+                elif line[1] == mi_Fragment.SECTION:
+                    self.update_section( line[2] )
+                else:
+                    _, _, section, text, expr, extracted = line
+                    Current_Statement( text, section, self, ( None, None ) if expr is None else
+                            ( Expression[section][expr], dict( extracted ) ) )
+        finally:
+            self.including.pop()
+            self.fname, self.line_no, self.include_line_no = outer
+            parser.fname, parser.include_line_no = self.fname, self.include_line_no
+
+    def command_line_no( self ):
+        """
+        The script line given to a DB Command for the current line.
+
+        """
+        return self.line_no if self.include_line_no is None else self.include_line_no
 
     def update_section( self, section_name ):
         """
         State: Updating Current Section
 
         Verifies that the new section fits in the current context.
-        If so, it becomes the new current context.
+        If so, it becomes the new current context.  A text script read from
+        its file has already been checked by the Section Index, but a part of
+        one supplied as lines has not.
 
         """
         # This expression constructs a metamodel element
         if section_name not in Section:
             raise mi_Parse_Error( "Unrecognized section",
                     self.fname, self.line_no, section_name  )
-            if section_name not in section_order[self.current_section]:
-                # State: Bad Section
-                raise mi_Parse_Error( "Section in wrong context",
-                        self.fname, self.line_no, section_name )
-
+        if not legal_next( self.current_section, section_name ):
+            # State: Bad Section
+            raise mi_Parse_Error( "Section in wrong context",
+                    self.fname, self.line_no, section_name )
+
+        if self.current_section == 'classes':
+            # Commands held back for the last class in the section
+            self.Bridge_to_Metamodel__parser.add_id_command()
         self.current_section = section_name
-        # DIAGNOSTIC
-        if self.current_section == 'relationships':
-            print()
-            print(" *** END OF TEST *** ")
-            pdb.set_trace()
 
     def strip_comment( self, line ):
         """
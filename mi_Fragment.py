@@ -0,0 +1,215 @@
+#! /usr/bin/env python
+
+"""
+Fragment
+
+A text script may include another text script, a fragment, with a line of
+its own:
+
+    include <path>
+
+The path is relative to the directory of the including file.  The fragment's
+lines are processed as if they appeared in place of the include line, so a
+fragment can hold anything from a few statements to whole sections, such as a
+shared types section or a standard subsystem, and may include other fragments
+in turn.  A fragment may not include itself, directly or otherwise.
+
+Finding the section header or Expression each line matches is the bulk of the
+work of extraction, and it depends only on the text of the fragment and the
+section it starts in.  So the classified lines of a fragment are kept by
+content hash, for the rest of the run and in the local cache, and a shared
+fragment is classified once however many models include it.  What each line
+then means depends on the domain and class it appears in, so its Statements
+are parsed every time it is included.
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import io
+import re
+import os
+import sys
+import locale
+
+# Local
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
+if MODULE_DIR not in sys.path:
+    sys.path.append( MODULE_DIR )
+from mi_Error import *
+from mi_Section import section_RE
+from mi_Expression import Expression, Dispatch
+import mi_Cache
+
+# Constants
+INCLUDE_KEYWORD = "include"
+COMMENT_CHAR = '#'
+FRAGMENT = "fragment" # Cache entry name prefix
+# Kinds of classified line
+INCLUDE = 'include'
+SECTION = 'section'
+STATEMENT = 'statement'
+
+# Regex
+include_RE = re.compile( r'^\s*include\s+(?P<path>\S(.*\S)?)\s*$' )
+
+# Global
+Fragment_Cache = {} # key : classified lines, for this run
+
+
+def fragment_path( including_fname, path ):
+    """
+    The path of a fragment included by the file including_fname.
+
+    """
+    return os.path.join( os.path.dirname( including_fname ), path )
+
+
+def read_fragment( path ):
+    try:
+        with open( path, 'rb' ) as f:
+            return f.read()
+    except OSError:
+        raise mi_File_Error( "Cannot open", path )
+
+
+def text_lines( data ):
+    """
+    The lines of a file's content, as open() would read them.
+
+    """
+    return io.StringIO( data.decode( locale.getpreferredencoding( False ) ),
+            newline=None ).readlines()
+
+
+def strip_comment( line ):
+    """
+    The line without any comment or trailing whitespace, as Extraction strips it.
+
+    """
+    return line.split( COMMENT_CHAR )[0].rstrip()
+
+
+def classify( path, section ):
+    """
+    The classified lines of the fragment at path when it is included in the
+    given section, each one of:
+
+        ( line_no, INCLUDE, path )
+        ( line_no, SECTION, section_name )
+        ( line_no, STATEMENT, section, text, expression number or None, extracted data )
+
+    where the expression number is the position of the matching Expression in
+    its section.  Lines in a section without Expressions are left out.
+
+    """
+    data = read_fragment( path )
+    key = mi_Cache.content_hash( data, section, mi_Cache.code_version() )
+    lines = Fragment_Cache.get( key )
+    if lines is None:
+        lines = mi_Cache.load( FRAGMENT, key )
+        if lines is None:
+            lines = classify_lines( text_lines( data ), section )
+            mi_Cache.save( FRAGMENT, key, lines )
+        Fragment_Cache[key] = lines
+    return lines
+
+
+def open_fragment( including_fname, line_no, path, section, including ):
+    """
+    The path and classified lines of the fragment named by an include line at
+    line_no of the file including_fname, given the absolute paths of the files
+    being processed.  An error is reported against the include line.
+
+    """
+    fragment = fragment_path( including_fname, path )
+    if os.path.abspath( fragment ) in including:
+        raise mi_Parse_Error( "Include cycle", including_fname, line_no, path )
+    try:
+        return fragment, classify( fragment, section )
+    except mi_File_Error:
+        raise mi_Parse_Error( "Cannot open included file", including_fname, line_no, path )
+
+
+def classify_lines( lines, section ):
+    classified = []
+    for n, line in enumerate( lines, 1 ):
+        line = strip_comment( line )
+        if not line:
+            continue
+        r = INCLUDE_KEYWORD in line and include_RE.match( line )
+        if r:
+            classified.append( ( n, INCLUDE, r.group('path') ) )
+            continue
+        r = section_RE.match( line )
+        if r:
+            section = r.group('name')
+            classified.append( ( n, SECTION, section ) )
+        elif section in Expression:
+            text = line.strip()
+            expr, extracted = Dispatch[section].match( text )
+            classified.append( ( n, STATEMENT, section, text,
+                None if expr is None else Expression[section].index( expr ), extracted ) )
+    return classified
+
+
+def includes( lines, including_fname, seen=None ):
+    """
+    Each fragment the lines include, directly or otherwise, in order, as
+    ( path, content ).  The content is None if the fragment can't be read,
+    the extraction reports it.  Anything built from a text script depends on
+    these as much as on the script itself.
+
+    """
+    seen = set() if seen is None else seen
+    for line in lines:
+        r = INCLUDE_KEYWORD in line and include_RE.match( strip_comment( line ) )
+        if not r:
+            continue
+        path = fragment_path( including_fname, r.group('path') )
+        if os.path.abspath( path ) in seen:
+            continue
+        seen.add( os.path.abspath( path ) )
+        try:
+            data = read_fragment( path )
+        except mi_Error:
+            yield path, None
+            continue
+        yield path, data
+        yield from includes( text_lines( data ), path, seen )
+
+
+def included_paths( path ):
+    """
+    The path of every fragment the text script at path includes.
+
+    """
+    return [ p for p, _ in includes( text_lines( read_fragment( path ) ), path ) ]
+
+
+def script_hash( path ):
+    """
+    Content hash of a text script together with the fragments it includes.
+    For a script without includes, this is the hash of its content alone.
+
+    """
+    data = read_fragment( path )
+    return mi_Cache.content_hash( data, *[ d for _, d in includes( text_lines( data ), path )
+        if d is not None ] )
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        print( "{}: includes {}".format( path, ", ".join( included_paths( path ) ) or "nothing" ) )
@@ -0,0 +1,340 @@
+#! /usr/bin/env python
+
+"""
+Statement Lexer
+
+Hand-written lexers for the Expressions of the domain, subsystem and classes
+sections, an alternative to their regular expression patterns that takes time
+linear in the length of the statement, whatever the statement.
+
+The patterns are built from nested quantifiers, such as the NAME building
+block, a word character followed by any run of word characters and spaces
+that must itself end with a word character.  They leave a backtracking
+matcher free to retry each way of splitting a long or malformed line before
+giving up.  A lexer instead reads the statement once,
+left to right.  Each token is a run of one character class, ex: the letters,
+digits and spaces of a name, and a run is never read again once it ends.
+Where a pattern's name must end with a word character, the lexer takes the
+whole run and trims its trailing space, which is where the pattern would end
+up after backtracking.  So each lexer matches exactly the statements its
+pattern does and extracts the same groupdict(), with None for each optional
+item not given, and can stand in for the pattern in a section's dispatcher.
+
+Lexing is off until enabled, see use_lexers().
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import re
+import os
+import sys
+
+# Local
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
+if MODULE_DIR not in sys.path:
+    sys.path.append( MODULE_DIR )
+from mi_Expression import ( Expression, Dispatch, Expression_Dispatch,
+        LIST_DELIM, REF_SYMBOL, TYPE_SYMBOL, CLASS_TERM )
+
+# Global
+Lexer_Setting = { 'enabled':False }
+
+# Constants
+DOMAIN_TYPES = ( 'modeled', 'realized' )
+ID_TAG = 'I' # Identifier tag, ex: I, I2
+RNUM_TAG = 'R' # Relationship number, ex: R12
+CONSTRAINED = 'c'
+DERIVED = '\\'
+
+# Regex
+# Each token is a run of a single character class.  Nothing follows the run
+# within the pattern, so it is read in one pass with no backtracking.
+word_RE = re.compile( r'\w' ) # The first character of a name
+name_run_RE = re.compile( r'[\w\s]*' )
+target_run_RE = re.compile( r'[\w.:,\s]*' ) # Target of attribute reference
+space_RE = re.compile( r'\s*' )
+digits_RE = re.compile( r'\d*' )
+id_digits_RE = re.compile( r'[2-9]*' )
+
+
+class Lexed:
+    """
+    A statement matched by a lexer, standing in for a regex match object.
+
+    """
+    __slots__ = ( 'groups', )
+
+    def __init__( self, groups ):
+        self.groups = groups
+
+    def groupdict( self ):
+        return self.groups
+
+
+class Statement_Lexer:
+    """
+    The lexing of a single statement.  Each method reads one token at the
+    position given and returns its value and the position after it, or a
+    value of None if the token isn't there.
+
+    """
+    __slots__ = ( 'text', )
+
+    def __init__( self, text ):
+        self.text = text
+
+    def space( self, pos ):
+        return space_RE.match( self.text, pos ).end()
+
+    def symbol( self, pos, symbol ):
+        """
+        The symbol at pos, after any space, ex: the / of a list.
+
+        """
+        pos = self.space( pos )
+        if self.text.startswith( symbol, pos ):
+            return symbol, self.space( pos + len( symbol ) )
+        return None, pos
+
+    def name( self, pos ):
+        """
+        A name: a word character, then word characters and spaces, less the
+        trailing space.  The position after it is past the trailing space.
+
+        """
+        if not word_RE.match( self.text, pos ):
+            return None, pos
+        end = name_run_RE.match( self.text, pos ).end()
+        return self.text[pos:end].rstrip(), end
+
+    def target( self, pos ):
+        """
+        The target of a reference, at least two characters starting and
+        ending with a word character.  Anything else before the next / means
+        there's no target.
+
+        """
+        if not word_RE.match( self.text, pos ):
+            return None, pos
+        end = target_run_RE.match( self.text, pos ).end()
+        value = self.text[pos:end].rstrip()
+        if len( value ) < 2 or not word_RE.match( value, len( value ) - 1 ):
+            return None, pos
+        return value, end
+
+    def digits( self, pos, run_RE=digits_RE ):
+        end = run_RE.match( self.text, pos ).end()
+        return ( self.text[pos:end] or None ), end
+
+    def tagged( self, pos, tag, run_RE ):
+        """
+        A tag and its number, ex: R12, or I2 where the number is optional.
+
+        """
+        if not self.text.startswith( tag, pos ):
+            return None, pos
+        digits, end = self.digits( pos + len( tag ), run_RE )
+        return tag + ( digits or "" ), end
+
+    def term( self, pos ):
+        """
+        True if the class terminator, after any space, ends the text or is
+        just followed by a final newline, as $ allows.
+
+        """
+        pos = self.space( pos )
+        if not self.text.startswith( CLASS_TERM, pos ):
+            return False
+        pos += len( CLASS_TERM )
+        return pos == len( self.text ) or self.text[pos:] == '\n'
+
+    def name_alias( self, pos=0 ):
+        """
+        name / alias, the start of every domain, subsystem and class.
+
+        """
+        name, pos = self.name( pos )
+        if name is None:
+            return None, None, pos
+        delim, pos = self.symbol( pos, LIST_DELIM )
+        if not delim:
+            return None, None, pos
+        alias, pos = self.name( pos )
+        return name, alias, pos
+
+
+def lex_domain( text ):
+    """
+    name / alias / [modeled|realized]
+
+    """
+    s = Statement_Lexer( text )
+    name, alias, pos = s.name_alias()
+    if alias is None:
+        return None
+    delim, pos = s.symbol( pos, LIST_DELIM )
+    if not delim:
+        return None
+    domain_type = None
+    for t in DOMAIN_TYPES:
+        if text.startswith( t, pos ):
+            domain_type = t
+    return { 'name':name, 'alias':alias, 'type':domain_type }
+
+
+def lex_subsystem( text ):
+    """
+    name / alias / floor-ceiling
+
+    """
+    s = Statement_Lexer( text )
+    name, alias, pos = s.name_alias()
+    if alias is None:
+        return None
+    delim, pos = s.symbol( pos, LIST_DELIM )
+    if not delim:
+        return None
+    floor, pos = s.digits( pos )
+    if floor is None or not text.startswith( '-', pos ):
+        return None
+    ceiling, pos = s.digits( pos + 1 )
+    if ceiling is None:
+        return None
+    return { 'name':name, 'alias':alias, 'floor':floor, 'ceiling':ceiling }
+
+
+def lex_class( text ):
+    """
+    name / alias [/ cnum] //
+
+    """
+    s = Statement_Lexer( text )
+    name, alias, pos = s.name_alias()
+    if alias is None:
+        return None
+    delim, after = s.symbol( pos, LIST_DELIM )
+    cnum = None
+    if delim: # Or the start of the terminator
+        cnum, after = s.digits( after )
+        if cnum is not None:
+            pos = after
+    if not s.term( pos ):
+        return None
+    return { 'name':name, 'alias':alias, 'cnum':cnum }
+
+
+def lex_ref_attr( text ):
+    """
+    from_attr -> to_attrs [/ I<n>] / R<n>[c]
+
+    """
+    s = Statement_Lexer( text )
+    from_attr, pos = s.name( 0 )
+    if from_attr is None:
+        return None
+    ref, pos = s.symbol( pos, REF_SYMBOL )
+    if not ref:
+        return None
+    to_attrs, pos = s.target( pos )
+    if to_attrs is None:
+        return None
+    delim, pos = s.symbol( pos, LIST_DELIM )
+    if not delim:
+        return None
+    id_tag, after = s.tagged( pos, ID_TAG, id_digits_RE )
+    if id_tag is not None:
+        delim, pos = s.symbol( after, LIST_DELIM )
+        if not delim:
+            return None
+    rnum, pos = s.tagged( pos, RNUM_TAG, digits_RE )
+    if rnum is None or rnum == RNUM_TAG:
+        return None
+    return { 'from_attr':from_attr, 'to_attrs':to_attrs, 'id':id_tag,
+            'rnum':rnum[ len( RNUM_TAG ): ],
+            'constrained':CONSTRAINED if text.startswith( CONSTRAINED, pos ) else None }
+
+
+def lex_ind_attr( text ):
+    """
+    [\\] name [: type] [/ I<n>]
+
+    """
+    s = Statement_Lexer( text )
+    derived = None
+    pos = 0
+    if text.startswith( DERIVED ):
+        derived, pos = DERIVED, s.space( len( DERIVED ) )
+    name, pos = s.name( pos )
+    if name is None:
+        return None
+    attr_type = None
+    delim, after = s.symbol( pos, TYPE_SYMBOL )
+    if delim:
+        attr_type, after = s.name( after )
+        if attr_type is not None:
+            pos = after
+    id_tag = None
+    delim, after = s.symbol( pos, LIST_DELIM )
+    if delim:
+        id_tag, after = s.tagged( after, ID_TAG, id_digits_RE )
+    return { 'derived':derived, 'name':name, 'type':attr_type, 'id':id_tag }
+
+
+class Lexer:
+    """
+    A lexer in place of an Expression's patterns, matching as they do.
+
+    """
+    __slots__ = ( 'lex', )
+
+    def __init__( self, lex ):
+        self.lex = lex
+
+    def match( self, text ):
+        groups = self.lex( text )
+        return None if groups is None else Lexed( groups )
+
+
+# { expression name:( lexer, ) }, the patterns each replaces
+Lexers = {
+    'new_domain':( Lexer( lex_domain ), ),
+    'new_subsystem':( Lexer( lex_subsystem ), ),
+    'new_class':( Lexer( lex_class ), ),
+    'new_ref_attr':( Lexer( lex_ref_attr ), ),
+    'new_ind_attr':( Lexer( lex_ind_attr ), )
+}
+
+
+def use_lexers( enabled=True ):
+    """
+    Classify statements with the lexers, or with the patterns again.  Every
+    section's dispatcher is rebuilt in place, so the change is seen wherever
+    Dispatch was imported.
+
+    """
+    Lexer_Setting['enabled'] = enabled
+    for section, exprs in Expression.items():
+        Dispatch[section] = Expression_Dispatch( exprs, Lexers if enabled else None )
+
+
+if __name__ == '__main__':
+    use_lexers()
+    for section, text in ( ( 'domain', "Air Traffic Control / ATC / modeled" ),
+            ( 'subsystem', "Main / MAIN / 1-100" ), ( 'classes', "Aircraft / AIR / 3 //" ),
+            ( 'classes', "Tail number -> Aircraft.Tail number / I / R1c" ),
+            ( 'classes', "\\ Altitude : Posint / I2" ) ):
+        expr, extracted = Dispatch[section].match( text )
+        print( "{}: {} {}".format( text, expr and expr['name'], extracted ) )
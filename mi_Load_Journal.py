@@ -0,0 +1,287 @@
+#! /usr/bin/env python
+
+"""
+Class: Load Journal
+
+A local record of how far a resumable load of a DB Population Script has got.
+
+A resumable load commits the script in checkpoints, one for each domain and
+subsystem, rather than in a single transaction.  Each checkpoint is written
+to the journal before it is committed and confirmed after, so that a load
+that fails or is interrupted can be resumed after the last checkpoint once
+the cause is fixed, or the domains it committed deleted again.  The journal
+is a JSON document per line:
+
+    { 'target':<hash of the DB connection string> }
+    { 'done':<commands committed>, 'hash':<hash of those commands>,
+        'domains':[ <domain created in this checkpoint>, ... ] }
+    { 'committed':<commands committed> }
+    ...
+
+A checkpoint that was never confirmed is pending: the load stopped while it
+was being committed, so it may or may not be in the DB.  Such a load can't be
+resumed, only rolled back, which deletes the pending checkpoint's domains as
+well wherever they exist.
+
+The hash of the committed commands lets a resumed load check that the part of
+the script already in the DB hasn't changed since.  Anything after the last
+checkpoint may have changed, which is usually the fix.  The journal is removed
+once the load completes or is rolled back.
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import os
+import sys
+import json
+import hashlib
+
+# Local
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
+if MODULE_DIR not in sys.path:
+    sys.path.append( MODULE_DIR )
+from mi_Error import *
+import mi_Cache
+from mi_Log import get_logger
+
+log = get_logger( 'load' )
+
+# Constants
+JOURNAL_EXT = ".journal"
+CHECKPOINT_CALLS = ( 'new_domain', 'new_subsystem' ) # Each starts a checkpoint
+DELETE_DOMAIN = "SELECT UI_delete_domain( p_name:=%s )"
+PENDING_SAVEPOINT = "mi_pending" # Around deleting a domain that may not exist
+
+
+def journal_path( path ):
+    """
+    The journal of a text script or compiled model is kept beside it.
+
+    """
+    return path + JOURNAL_EXT
+
+
+def read_checkpoints( lines ):
+    """
+    The confirmed checkpoints of a journal's lines after the target, and the
+    pending one if any.  Raises ValueError if they don't add up.
+
+    """
+    checkpoints, pending = [], None
+    for line in lines:
+        if 'committed' not in line:
+            if pending:
+                raise ValueError( "Checkpoint written over a pending one" )
+            pending = line
+            continue
+        if not pending or pending['done'] != line['committed']:
+            raise ValueError( "Confirmation of no pending checkpoint" )
+        checkpoints.append( pending )
+        pending = None
+    return checkpoints, pending
+
+
+def command_digest( h, db_command ):
+    h.update( db_command.cmd.encode() )
+    h.update( b'\0' )
+    h.update( json.dumps( db_command.pvals ).encode() )
+    h.update( b'\0' )
+
+
+class Load_Journal:
+    """
+    The journal of one text script loaded into one DB.
+
+    """
+    def __init__( self, path, target ):
+        """
+        Reads the journal at path, if any.  The target is the DB connection
+        string, only its hash is kept.
+
+        """
+        self.path = path
+        self.target = mi_Cache.content_hash( target )
+        self.checkpoints = [] # Each { 'done', 'hash', 'domains' }
+        self.pending = None # Checkpoint being committed, or left unconfirmed
+        try:
+            with open( path ) as f:
+                lines = [ json.loads( line ) for line in f if line.strip() ]
+            checkpoints, pending = read_checkpoints( lines[1:] )
+        except FileNotFoundError:
+            return
+        except ( OSError, ValueError ):
+            raise mi_File_Error( "Damaged load journal, remove it to load from scratch", path )
+        if lines and lines[0].get('target') != self.target:
+            raise mi_File_Error( "Load journal is for another DB, roll it back there "
+                    "or remove it", path )
+        self.checkpoints, self.pending = checkpoints, pending
+
+    def done( self ):
+        """
+        Number of DB Commands already committed.
+
+        """
+        return self.checkpoints[-1]['done'] if self.checkpoints else 0
+
+    def domains( self ):
+        """
+        The domains created by the committed DB Commands.
+
+        """
+        return [ d for c in self.checkpoints for d in c['domains'] ]
+
+    def resume( self, db_commands ):
+        """
+        Event: Load started
+
+        Returns the number of leading DB Commands to skip, those committed by an
+        earlier load.  Raises an error if any of them has changed since, or if
+        the earlier load stopped in the middle of a commit.
+
+        """
+        if self.pending:
+            raise mi_File_Error( "Load stopped while committing DB Commands {} to {}, "
+                    "which may or may not be in the DB, roll back the partial load".format(
+                        self.done() + 1, self.pending['done'] ), self.path )
+        self.digest = hashlib.sha256()
+        done = self.done()
+        if not done:
+            return 0
+        if done > len( db_commands ):
+            raise mi_File_Error( "Script is shorter than its committed part, "
+                    "roll back the partial load", self.path )
+        for c in db_commands[:done]:
+            command_digest( self.digest, c )
+        if self.digest.hexdigest() != self.checkpoints[-1]['hash']:
+            raise mi_File_Error( "Script has changed in the part already loaded, up to "
+                    "line {}, roll back the partial load".format( db_commands[done-1].line_no ),
+                    self.path )
+        log.info( "Resuming after %d committed DB Commands", done )
+        return done
+
+    def checkpoint( self, db_commands ):
+        """
+        Event: Committing DB Commands
+
+        Records the next DB Commands after those already done as pending,
+        before they are committed.  Whatever happens to the commit, the
+        journal then knows of their domains.
+
+        """
+        for c in db_commands:
+            command_digest( self.digest, c )
+        entry = { 'done':self.done() + len( db_commands ), 'hash':self.digest.hexdigest(),
+                'domains':[ c.pvals[ c.pnames.index('name') ] for c in db_commands
+                    if c.call_name == 'new_domain' ] }
+        lines = [ entry ] if self.checkpoints else [ { 'target':self.target }, entry ]
+        self.write( lines )
+        self.pending = entry
+
+    def confirm( self ):
+        """
+        Event: DB Commands committed
+
+        Records that the pending DB Commands are in the DB.
+
+        """
+        self.write( [ { 'committed':self.pending['done'] } ] )
+        self.checkpoints.append( self.pending )
+        self.pending = None
+
+    def write( self, lines ):
+        """
+        Appends the lines, flushed to disk before the load carries on.
+
+        """
+        try:
+            with open( self.path, 'a' ) as f:
+                for line in lines:
+                    f.write( json.dumps( line ) + "\n" )
+                f.flush()
+                os.fsync( f.fileno() )
+        except OSError:
+            raise mi_File_Error( "Cannot write load journal", self.path )
+
+    def finish( self ):
+        """
+        Event: Load completed or rolled back
+
+        """
+        try:
+            os.remove( self.path )
+        except FileNotFoundError:
+            pass
+        except OSError:
+            raise mi_File_Error( "Cannot remove load journal", self.path )
+        self.checkpoints = []
+        self.pending = None
+
+    def roll_back( self, db_connection ):
+        """
+        Deletes every domain committed by the partial load, in one transaction
+        on an open DB-API connection, and removes the journal.  The domains of
+        a pending checkpoint are deleted too if the DB has them.  The
+        connection is closed when we are done.  Returns the deleted domain
+        names.
+
+        """
+        domains = []
+        cursor = db_connection.cursor()
+        try:
+            # Latest first, so that a domain goes before any it depends on
+            for name in reversed( self.pending['domains'] if self.pending else [] ):
+                # Its commit may never have happened
+                cursor.execute( "SAVEPOINT " + PENDING_SAVEPOINT )
+                try:
+                    cursor.execute( DELETE_DOMAIN, ( name, ) )
+                except Exception:
+                    cursor.execute( "ROLLBACK TO SAVEPOINT " + PENDING_SAVEPOINT )
+                else:
+                    domains.append( name )
+                cursor.execute( "RELEASE SAVEPOINT " + PENDING_SAVEPOINT )
+            for name in reversed( self.domains() ):
+                try:
+                    cursor.execute( DELETE_DOMAIN, ( name, ) )
+                except Exception as e:
+                    raise mi_Error( "Cannot delete domain {}\n{}".format(
+                        name, str(e).strip() ) ) from e
+                domains.append( name )
+        except:
+            db_connection.rollback()
+            raise
+        else:
+            db_connection.commit()
+        finally:
+            db_connection.close()
+        self.finish()
+        log.info( "Deleted %d partially loaded domains", len( domains ) )
+        return domains
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        try:
+            with open( journal_path( path ) ) as f:
+                checkpoints, pending = read_checkpoints( [ json.loads( line ) for line in f ][1:] )
+        except FileNotFoundError:
+            print( "{}: no partial load".format( path ) )
+            continue
+        print( "{}: {} DB Commands committed in {} checkpoints, domains: {}".format(
+            path, checkpoints[-1]['done'] if checkpoints else 0, len( checkpoints ),
+            ", ".join( d for c in checkpoints for d in c['domains'] ) ) )
+        if pending:
+            print( "{}: stopped while committing up to DB Command {}, domains: {}".format(
+                path, pending['done'], ", ".join( pending['domains'] ) or "none" ) )
@@ -0,0 +1,129 @@
+#! /usr/bin/env python
+
+"""
+Logging
+
+Diagnostic output goes through the standard logging package, under the
+'mitext' logger, rather than print().  Tracing of each statement and DB Command
+is logged at DEBUG level.  On those hot paths the trace is guarded by a level
+check so that, when tracing is off, no message is built and nothing is written.
+
+Verbosity levels:
+
+    quiet   - warnings and errors only
+    normal  - plus progress information
+    verbose - plus a trace of every statement and DB Command
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import sys
+import logging
+from logging import DEBUG, INFO, WARNING
+
+# Constants
+LOGGER = "mitext"
+FORMAT = "%(message)s"
+QUIET, NORMAL, VERBOSE = -1, 0, 1
+
+Verbosity_Level = { QUIET:WARNING, NORMAL:INFO, VERBOSE:DEBUG }
+
+# Nothing is output until configured, the default is warnings and up
+logging.getLogger( LOGGER ).setLevel( WARNING )
+
+
+def get_logger( name ):
+    """
+    The logger for one part of the parser, ex: get_logger( 'statement' )
+
+    """
+    return logging.getLogger( LOGGER + "." + name )
+
+
+def configure( verbosity=NORMAL, stream=None ):
+    """
+    Set the verbosity and send all output to the stream, stderr by default.
+
+    """
+    logger = logging.getLogger( LOGGER )
+    logger.setLevel( Verbosity_Level[ max( QUIET, min( VERBOSE, verbosity ) ) ] )
+    for h in list( logger.handlers ):
+        logger.removeHandler( h )
+    handler = logging.StreamHandler( stream or sys.stderr )
+    handler.setFormatter( logging.Formatter( FORMAT ) )
+    logger.addHandler( handler )
+    logger.propagate = False
+
+
+def capture( stream ):
+    """
+    Redirect all output to the stream until release() is called with the
+    returned handle.  Used to collect the output for one text script.
+
+    """
+    logger = logging.getLogger( LOGGER )
+    saved = list( logger.handlers )
+    for h in saved:
+        logger.removeHandler( h )
+    handler = logging.StreamHandler( stream )
+    handler.setFormatter( logging.Formatter( FORMAT ) )
+    logger.addHandler( handler )
+    logger.propagate = False
+    return ( handler, saved )
+
+
+def release( handle ):
+    handler, saved = handle
+    logger = logging.getLogger( LOGGER )
+    logger.removeHandler( handler )
+    for h in saved:
+        logger.addHandler( h )
+
+
+def level():
+    return logging.getLogger( LOGGER ).level
+
+
+def set_level( log_level ):
+    """
+    Used to give a worker process the same level as its parent.
+
+    """
+    logging.getLogger( LOGGER ).setLevel( log_level )
+
+
+def replay( text ):
+    """
+    Writes output captured elsewhere, a worker process for example, to the
+    configured stream as is.
+
+    """
+    if not text:
+        return
+    for h in logging.getLogger( LOGGER ).handlers:
+        if isinstance( h, logging.StreamHandler ):
+            h.acquire()
+            try:
+                h.stream.write( text )
+                h.flush()
+            finally:
+                h.release()
+            return
+
+
+if __name__ == '__main__':
+    configure( VERBOSE )
+    get_logger( 'demo' ).debug( "Tracing at level %s", level() )
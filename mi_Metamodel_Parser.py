@@ -23,25 +23,29 @@ parsing and intermediate structures before an API Call can be constructed.
 import re
 import sys
 import os
+import bisect
+from time import perf_counter
 
 # Local
-MODULE_DIR = os.path.abspath( "../Modules" )
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
 if MODULE_DIR not in sys.path:
     sys.path.append( MODULE_DIR )
 from mi_Error import *
 from mi_Parameter import Context_Parameter
 from mi_Expression import SUBSYS_REF
 from mi_API_Parser import API_Type
+from mi_Log import get_logger, DEBUG
+import mi_Expression_Stats
+from mi_Expression_Stats import Stats
 
-
-# Diagnostic
-import pdb # debug
+# Global
+# Create each class's identifiers with the new_ids API call, which the miUML
+# DB must provide, see add_id_command()
+Identifier_Setting = { 'enabled':False }
 
 # Constants
 
-# This name should stand out in case it does not get deleted
-# after the entire DB Pop script has completed, as it should
-INITIAL_DUMMY_ID_ATTR_NAME = '__POP_Dummy_ID'
+log = get_logger( 'metamodel' )
 
 
 # { rnum:[{ from_class, from_attr, to_class, to_attr, const }, ...] }
@@ -53,33 +57,45 @@ class Metamodel_Parser:
     be corectly created.
 
     """
-    def __init__( self, db_pop_script ):
+    def __init__( self, db_pop_script, fname=None ):
         """
         Parsing is done on a domain by domain basis at this point.  So each
         time a new domain is encountered, we clear all the buffers.
 
         """
         self.db_pop_script = db_pop_script # Bridge to script domain
+        self.fname = fname # Of the text script or fragment, for error reports
+        self.line_no = None # Of the statement being parsed
+        self.include_line_no = None # Of the script line including the fragment being parsed
+        self.id_class = None # Class whose identifiers have yet to be created
+        self.references = {}
+        self.classes = {}
+        # Unique across the script, name or alias : ( file, line )
+        self.domain_names = {}
+        self.domain_aliases = {}
         self.new_domain()
 
-    def parse( self, method_name, parsed_expr ):
+    def parse( self, method_name, parsed_expr, line_no=None ):
         """
         Given a lightly parsed expression, invoke a corresponding method
         to parse that data a bit deeper and buffer any forward
-        references or dependencies.
+        references or dependencies.  The line number of the statement is
+        kept for any command created later on its behalf.
 
         """
+        self.line_no = line_no
         # Verify that the member function is defined on this class
         if method_name not in self.__class__.__dict__.keys():
-            print(">> Parse: bad method_name")
-            pdb.set_trace()
             raise mi_Error( "No parse function for expression: " + method_name )
 
         # Invoke it, passing along the parsed expression data
+        if Stats['enabled']:
+            start = perf_counter()
+            eval( 'self.' + method_name )( parsed_expr )
+            mi_Expression_Stats.handled( method_name, perf_counter() - start )
+            return
         eval( 'self.' + method_name )( parsed_expr )
         # These expression functions are defined below
-        print(">> Expr:" + method_name + " meta-parsed")
-        #pdb.set_trace()
 
 
 
@@ -87,14 +103,30 @@ class Metamodel_Parser:
 
     def new_domain( self, domain_data=None ):
         """
-        Clears all buffers for a new domain.
+        Clears all buffers for a new domain.  Its name and alias must not be
+        those of an earlier domain.
 
         """
+        self.end_domain() # The previous one
+        if domain_data:
+            self.check_unique( self.domain_names, "domain name", domain_data['name'] )
+            self.check_unique( self.domain_aliases, "domain alias", domain_data['alias'] )
+
         # These are buffered up in the context of the current domain
         self.subsystems = set() # All subsystems in current domain that have been parsed
         self.subsys_dependencies = {} # Classes in these have been processed
         self.identifiers = {}
         self.references = {}
+        self.classes = {} # Symbol index, class name : ( subsystem name, { attribute name:( file, line ) } )
+        # Unique within the domain, name, alias or number : ( file, line )
+        self.subsys_names = {}
+        self.subsys_aliases = {}
+        self.class_names = {}
+        self.class_aliases = {}
+        self.cnums = {}
+        # Subsystem number ranges, sorted by floor
+        self.floors = []
+        self.ranges = [] # ( ceiling, subsystem name, ( file, line ) ) for each floor
 
     def new_bridge( self, bridge_data ):
         """
@@ -103,17 +135,47 @@ class Metamodel_Parser:
 
     def new_subsystem( self, subsys_data ):
         """
-        Adds name to list of processed subsystems
+        Adds name to list of processed subsystems.  The name, alias and number
+        range must each be unique within the domain: no two ranges may overlap.
 
         """
-        self.subsystems.add( subsys_data['name'] )
+        name = subsys_data['name']
+        self.check_unique( self.subsys_names, "subsystem name", name )
+        self.check_unique( self.subsys_aliases, "subsystem alias", subsys_data['alias'] )
+        floor, ceiling = int( subsys_data['floor'] ), int( subsys_data['ceiling'] )
+        if floor > ceiling:
+            raise mi_Parse_Error( "Empty subsystem number range", self.fname, self.line_no,
+                    "{}-{}".format( floor, ceiling ) )
+        # Only the ranges on either side of this one in floor order can overlap it
+        i = bisect.bisect_left( self.floors, floor )
+        for n in ( i - 1, i ):
+            if not 0 <= n < len( self.floors ):
+                continue
+            other_ceiling, other_name, other_place = self.ranges[n]
+            if self.floors[n] <= ceiling and floor <= other_ceiling:
+                raise mi_Parse_Error( "Subsystem number range overlaps {} {}-{} at {}".format(
+                    other_name, self.floors[n], other_ceiling, self.describe( other_place ) ),
+                    self.fname, self.line_no, "{}-{}".format( floor, ceiling ) )
+        self.floors.insert( i, floor )
+        self.ranges.insert( i, ( ceiling, name, self.place() ) )
+        self.subsystems.add( name )
 
     def new_class( self, class_data ):
         """
-        A new class has been created.  Start a new id record for it.
+        A new class has been created.  Start a new id record for it.  The
+        previous class is complete, so its identifiers can be created.  The
+        class name, alias and any number must be unique within the domain.
 
         """
+        self.add_id_command()
+        self.check_unique( self.class_names, "class name", Context_Parameter['class'] )
+        self.check_unique( self.class_aliases, "class alias", class_data['alias'] )
+        if class_data.get('cnum') is not None:
+            self.check_unique( self.cnums, "class number", int( class_data['cnum'] ) )
         ids = self.identifiers[ Context_Parameter['class'] ] = []
+        self.classes[ Context_Parameter['class'] ] = ( Context_Parameter['subsys'], {} )
+        self.id_class = ( Context_Parameter['class'], Context_Parameter['domain'],
+                self.line_no if self.include_line_no is None else self.include_line_no )
 
     def new_ind_attr( self, attr_data ):
         """
@@ -121,6 +183,9 @@ class Metamodel_Parser:
         the correct API variable name and reject if type is unknown.
 
         """
+        self.check_unique( self.classes[ Context_Parameter['class'] ][1],
+                "attribute name in " + Context_Parameter['class'], attr_data['name'] )
+
         # Create any required identifier attributes
         if attr_data['id']:
             self.parse_id( attr_data )
@@ -180,6 +245,9 @@ class Metamodel_Parser:
         this_subsys = Context_Parameter['subsys']
         this_domain = Context_Parameter['domain']
 
+        self.check_unique( self.classes[ from_class ][1],
+                "attribute name in " + from_class, from_attr )
+
         # Create a new attr_data set for this relationship
         if rnum not in self.references:
             self.references[rnum] = []
@@ -191,10 +259,16 @@ class Metamodel_Parser:
                     'from_attr':from_attr,
                     'subsystem':this_subsys,
                     'from_class':from_class,
-                    'constrained':constrained
+                    'constrained':constrained,
+                    'to_subsys':None,
+                    'target':to_attr, # As written, for error reports
+                    'rnum':rnum,
+                    'fname':self.fname,
+                    'line_no':self.line_no
                 }
             if SUBSYS_REF in to_attr:
                 to_subsys, to_attr = to_attr.split( SUBSYS_REF )
+                ref_rec['to_subsys'] = to_subsys
                 if this_subsys not in self.subsys_dependencies:
                     self.subsys_dependencies[this_subsys] = set( )
                 self.subsys_dependencies[this_subsys].add( to_subsys )
@@ -211,14 +285,44 @@ class Metamodel_Parser:
 
     # <<< End of parse expression functions
 
+    def check_unique( self, index, kind, value ):
+        """
+        Adds the value to a hash index of the places where values were given,
+        raising a parse error if it is already there.
+
+        """
+        if value in index:
+            raise mi_Parse_Error( "Duplicate {}, first at {}".format(
+                kind, self.describe( index[value] ) ), self.fname, self.line_no, value )
+        index[value] = self.place()
+
+    def place( self ):
+        """
+        The file and line of the statement being parsed, which may be in a
+        fragment rather than the text script itself.
+
+        """
+        return ( self.fname, self.line_no )
+
+    def describe( self, place ):
+        """
+        An earlier place for an error report on the current statement, ex:
+        line 12, or types.tm line 3 if it is in another file.
+
+        """
+        fname, line_no = place
+        if fname == self.fname:
+            return "line {}".format( line_no )
+        return "{} line {}".format( fname, line_no )
+
     def parse_id( self, attr_data ):
         """
         For each attribute that participates in one or more identifier attributes, save
         its info so we can add it to each of its id's in the add id commands phase.
 
         """
-        print(">> Parsing ID for: " + attr_data['id'] )
-        #pdb.set_trace()
+        if log.isEnabledFor( DEBUG ):
+            log.debug( ">> Parsing ID %s for: %s", attr_data['id'], attr_data['name'] )
         ids = self.identifiers[ Context_Parameter['class'] ]
         max_id_num = len(ids) # The current max id number
 
@@ -232,9 +336,9 @@ class Metamodel_Parser:
         assert highest_id_num > 0, "Highest id number is less than 1"
 
         if highest_id_num > max_id_num:
-            # We need to create an empty set for each new higher id number
+            # We need to create an empty list for each new higher id number
             missing_ids = highest_id_num - max_id_num
-            ids += [ set() for _ in range(missing_ids) ]
+            ids += [ [] for _ in range(missing_ids) ]
             # Now we can safely index with ids[id_num-1] for each newly requested id number
         # Otherwise, there is an adequate number of lists in ids
         # If ids is empty, it will always pick up at least one new empty list since the
@@ -242,31 +346,85 @@ class Metamodel_Parser:
 
         attr_name = attr_data['name']
         for i in id_numbers:
-            ids[i-1].add( attr_name ) # its a set, so no duplicates
+            if attr_name not in ids[i-1]: # No duplicates, in order of appearance
+                ids[i-1].append( attr_name )
+
+    def end_domain( self ):
+        """
+        The domain is complete: create the identifiers of its last class and
+        check its references.  Called at the next domain and at the end of
+        the script.
 
-        print(">> ID Created")
-        #pdb.set_trace()
+        """
+        self.add_id_command()
+        self.resolve_references()
+
+    def resolve_references( self ):
+        """
+        Every reference must be to an attribute of a class defined in the
+        domain, and in the subsystem given, if any, ex:
+        Subsystem::Class.Attribute.  A class may be referred to before it is
+        defined, so this waits until the domain is complete.  Raises a parse
+        error at the first unresolved reference, so that a dangling reference
+        is reported before anything is sent to the DB.
 
-    def add_id_commands( self ):
         """
-        Adds a list of id edit commands to the DB Population Script so that
-        each attribute in a class can be added to each identifier in which
-        it will participate.  For each class, at the end of 'add to id' list
-        of commands, there will be one 'remove from id' command to get rid of
-        the dummy initial id which must be created for a new class.
+        unresolved = []
+        for refs in self.references.values():
+            for ref in refs:
+                target = self.classes.get( ref['to_class'] )
+                if not target:
+                    problem = "Reference to an undefined class"
+                elif ref['to_subsys'] and target[0] != ref['to_subsys']:
+                    problem = "Reference to a class not in subsystem " + ref['to_subsys']
+                elif ref['to_attr'] not in target[1]:
+                    problem = "Reference to an undefined attribute"
+                else:
+                    continue
+                unresolved.append( ( ref['line_no'] or 0, problem, ref ) )
+        if not unresolved:
+            return
+        line_no, problem, ref = min( unresolved, key=lambda u: u[0] )
+        if len( unresolved ) > 1:
+            problem += " ({} unresolved references)".format( len( unresolved ) )
+        raise mi_Parse_Error( problem + " in R" + ref['rnum'], ref['fname'], line_no, ref['target'] )
+
+    def add_id_command( self ):
+        """
+        Adds a single command to the DB Population Script that creates all of
+        the identifiers of the class last parsed, replacing the initial one
+        created along with the class.  Each attribute is paired with the number
+        of an identifier in which it participates, ex: for a class with
+        identifiers I and I2:
+
+            id_nums: [ 1, 1, 2 ], attrs: [ 'Name', 'Domain', 'Number' ]
+
+        Called once the class is complete, at the next class, domain or
+        section and at the end of the script.  Nothing is added unless
+        identifiers are enabled, since a stock miUML DB has no UI_new_ids.
 
         """
-        for class_name, class_ids in self.identifiers.items():
-            params = {}
-            Context_Parameter['class'] = class_name
-            for i, this_id in enumerate( class_ids ):
-                params['id_num'] = i+1
-                for this_attr in this_id:
-                    params['attr'] = this_attr
-                    self.db_pop_script.add_command( 'add_attr_to_id', params )
-            params['id_num'] = 1
-            params['attr'] = INITIAL_DUMMY_ID_ATTR_NAME
-            self.db_pop_script.add_command( 'remove_attr_from_id', params )
+        if not self.id_class:
+            return
+        class_name, domain, line_no = self.id_class
+        self.id_class = None
+        if not Identifier_Setting['enabled']:
+            return
+        id_nums, attrs = [], []
+        for i, this_id in enumerate( self.identifiers[class_name] ):
+            id_nums += [ i+1 ] * len( this_id )
+            attrs += this_id
+        if not attrs:
+            return # The class keeps its initial identifier
+
+        # The command belongs to the class parsed earlier, not the current context
+        saved_context = ( Context_Parameter['class'], Context_Parameter['domain'] )
+        Context_Parameter['class'], Context_Parameter['domain'] = class_name, domain
+        try:
+            self.db_pop_script.add_command( 'new_ids',
+                    { 'id_nums':id_nums, 'attrs':attrs }, line_no )
+        finally:
+            Context_Parameter['class'], Context_Parameter['domain'] = saved_context
 
 
 if __name__ == '__main__':
@@ -295,7 +453,7 @@ if __name__ == '__main__':
 #    parser.new_ind_attr( { 'name':'VIN', 'id':"I2" } )
 #    parser.new_ind_attr( { 'name':'License Number', 'id':"I3" } )
 #    parser.new_ind_attr( { 'name':'Manufacturer', 'id':"I2" } )
-#    parser.add_id_commands()
+#    parser.add_id_command()
 
 
 
@@ -0,0 +1,143 @@
+#! /usr/bin/env python
+
+"""
+Model Generator
+
+Writes synthetic miUML Text Scripts of any size for measuring the parser.  The
+sample models are far too small to show how the parser scales, so a model is
+generated from a handful of counts instead:
+
+    domains      - domains in the model
+    subsystems   - subsystems per domain
+    classes      - classes per subsystem
+    attributes   - independent attributes per class
+    identifiers  - identifiers per class, formed by the first attributes
+    references   - referential attributes per class
+
+Each referential attribute refers to the first attribute of an earlier class
+in the same domain, formalizing its own relationship.  Every other reference
+is made to a class in an earlier subsystem, where there is one, using the
+subsystem reference symbol, ex: Subsystem 1::Class 1 3.Attribute 1
+
+The same counts and seed always produce the same model.  No relationships are
+generated since the parser doesn't process them yet.
+
+Usage: mi_Model_Generator.py [--domains N] [--subsystems N] ... > model.tm
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import sys
+import random
+import argparse
+
+# Local
+from mi_Expression import LIST_DELIM, REF_SYMBOL, TYPE_SYMBOL, SUBSYS_REF, CLASS_TERM
+
+# Constants
+INDENT = "    "
+LIST = " " + LIST_DELIM + " "
+ATTR_TYPES = ( "Nominal", "Name", "Posint", "Description", "Short name", "Boolean" )
+
+Default_Size = {
+    'domains':1,
+    'subsystems':2,
+    'classes':10,
+    'attributes':4,
+    'identifiers':1,
+    'references':1,
+    'seed':0
+}
+
+
+def attr_name( n ):
+    return "Attribute " + str( n )
+
+
+def id_tag( n, identifiers ):
+    """
+    Identifier tag for the nth attribute, the first attributes each form one
+    identifier: I, I2, I3, ...  The rest are in none.
+
+    """
+    if n > identifiers:
+        return ""
+    return LIST + ( "I" if n == 1 else "I" + str( n ) )
+
+
+def generate( out=sys.stdout, **size ):
+    """
+    Writes a model of the given size to the open text stream.  Any count not
+    given is taken from the Default Size.  Returns the number of lines written.
+
+    """
+    size = dict( Default_Size, **size )
+    if size['identifiers'] > size['attributes'] or size['identifiers'] > 9:
+        raise ValueError( "Identifiers must be 9 or fewer and no more than the attributes" )
+    choose = random.Random( size['seed'] )
+    lines = [ "# Synthetic model: " + ", ".join(
+        "{} {}".format( size[k], k ) for k in sorted( Default_Size ) if k != 'seed' ) ]
+
+    for d in range( 1, size['domains'] + 1 ):
+        lines += [ "", "domain", INDENT + LIST.join(
+            ( "Domain " + str(d), "D" + str(d), "modeled" ) ), "" ]
+        earlier = [] # ( subsystem name, class name ) of the classes generated so far
+        rnum = 0
+        cnum = 0
+        for s in range( 1, size['subsystems'] + 1 ):
+            subsys = "Subsystem " + str( s )
+            floor = ( s - 1 ) * size['classes'] + 1
+            lines += [ "subsystem", INDENT + LIST.join(
+                ( subsys, "D{}S{}".format( d, s ),
+                    "{}-{}".format( floor, floor + size['classes'] - 1 ) ) ),
+                "", "classes" ]
+            first_in_subsys = len( earlier )
+            for c in range( 1, size['classes'] + 1 ):
+                cnum += 1
+                cname = "Class {} {}".format( s, c )
+                lines.append( INDENT + LIST.join( ( cname, "D{}S{}C{}".format( d, s, c ),
+                    str( cnum ) ) ) + " " + CLASS_TERM )
+                for a in range( 1, size['attributes'] + 1 ):
+                    lines.append( INDENT * 2 + attr_name( a ) + " " + TYPE_SYMBOL + " " +
+                        choose.choice( ATTR_TYPES ) + id_tag( a, size['identifiers'] ) )
+                for r in range( 1, size['references'] + 1 ):
+                    if not earlier:
+                        break
+                    rnum += 1
+                    in_subsys = len( earlier ) > first_in_subsys
+                    if first_in_subsys and ( r % 2 == 0 or not in_subsys ):
+                        # In an earlier subsystem
+                        to_subsys, to_class = earlier[ choose.randrange( first_in_subsys ) ]
+                        to_class = to_subsys + SUBSYS_REF + to_class
+                    else:
+                        to_subsys, to_class = earlier[
+                                choose.randrange( first_in_subsys, len(earlier) ) ]
+                    lines.append( INDENT * 2 + "Reference {} {} {}.{}{}R{}".format(
+                        r, REF_SYMBOL, to_class, attr_name( 1 ), LIST, rnum ) )
+                lines.append( "" )
+                earlier.append( ( subsys, cname ) )
+
+    out.write( "\n".join( lines ) + "\n" )
+    return len( lines )
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser( prog="mi_Model_Generator",
+            description="Write a synthetic miUML text model to stdout." )
+    for count, default in sorted( Default_Size.items() ):
+        arg_parser.add_argument( "--" + count, type=int, default=default,
+            help="(default: %(default)s)" )
+    generate( **vars( arg_parser.parse_args() ) )
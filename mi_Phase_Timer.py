@@ -0,0 +1,123 @@
+#! /usr/bin/env python
+
+"""
+Phase Timer
+
+Accumulates the time spent in each phase of a run so that it can be reported
+at the end, readable or as JSON.  Timing is off until enabled and the phases
+nested inside the statement loop check that before reading the clock.
+
+Phases:
+
+    api_load            - loading the metamodel API
+    extraction          - Phase 1, of which:
+      metamodel_parsing - deeper parsing by the Metamodel Parser
+      command_building  - filling in and completing DB Commands
+    execution           - Phase 2
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import json
+import time
+import contextlib
+
+# Constants
+PHASES = ( # ( name, nesting depth ) in report order
+    ( 'api_load', 0 ),
+    ( 'extraction', 0 ),
+    ( 'metamodel_parsing', 1 ),
+    ( 'command_building', 1 ),
+    ( 'execution', 0 )
+)
+
+# Global
+Timing = { 'enabled':False }
+Phase_Time = { name:[ 0.0, 0 ] for name, _ in PHASES } # phase : [ seconds, count ]
+
+
+def add( name, seconds ):
+    """
+    Accumulate one timed run of a phase.
+
+    """
+    t = Phase_Time[name]
+    t[0] += seconds
+    t[1] += 1
+
+
+@contextlib.contextmanager
+def phase( name ):
+    """
+    Times the enclosed block as one run of the named phase.  For the outer
+    phases only; inside the statement loop, check Timing and call add().
+
+    """
+    if not Timing['enabled']:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add( name, time.perf_counter() - start )
+
+
+def snapshot():
+    return { name:list( t ) for name, t in Phase_Time.items() }
+
+
+def difference( later, earlier ):
+    """
+    The time spent in each phase between two snapshots.
+
+    """
+    return { name:[ later[name][0] - earlier[name][0], later[name][1] - earlier[name][1] ]
+            for name in later }
+
+
+def accumulate( times ):
+    """
+    Adds phase times measured in another process.
+
+    """
+    for name, ( seconds, count ) in times.items():
+        Phase_Time[name][0] += seconds
+        Phase_Time[name][1] += count
+
+
+def report( times, as_json=False ):
+    """
+    The phase times as a readable table or a JSON document.
+
+    """
+    if as_json:
+        return json.dumps( { name:{ 'seconds':round( times[name][0], 6 ),
+            'count':times[name][1] } for name, _ in PHASES }, indent=2 )
+    lines = [ "Phase timings:" ]
+    for name, depth in PHASES:
+        seconds, count = times[name]
+        lines.append( "  {:<22}{:>10.3f}s {:>10}".format(
+            "  " * depth + name.replace( "_", " " ), seconds, count ) )
+    return "\n".join( lines )
+
+
+if __name__ == '__main__':
+    Timing['enabled'] = True
+    with phase( 'api_load' ):
+        time.sleep( 0.01 )
+    print( report( snapshot() ) )
+    print( report( snapshot(), as_json=True ) )
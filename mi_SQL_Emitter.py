@@ -0,0 +1,130 @@
+#! /usr/bin/env python
+
+"""
+Class: SQL Emitter
+
+Writes DB Commands as a plain SQL script instead of executing them, one
+statement per DB Command with the parameter values filled in as SQL literals.
+The script is meant to be loaded in a single transaction with:
+
+    psql -1 -f <script>
+
+so that, as with a direct load, either the whole model is created or nothing.
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import os
+import math
+
+# Local
+from mi_DB_Command import PARAM_PLACE
+
+# Constants
+HEADER = """\
+-- miUML DB Population Script generated by mitext from {source}
+-- Load with: psql -1 -f <this file>
+\\set ON_ERROR_STOP on
+SET standard_conforming_strings = on;
+"""
+# Floats that have no numeric literal, spelled as Postgres reads them
+NON_FINITE = { 'inf':"'Infinity'", '-inf':"'-Infinity'", 'nan':"'NaN'" }
+ABORT = "DO $mitext$ BEGIN RAISE EXCEPTION '%', {message}; END $mitext$;\n"
+
+
+def sql_literal( value ):
+    """
+    Python value as an SQL literal.
+
+    """
+    if value is None:
+        return "NULL"
+    if isinstance( value, bool ): # Before int, since a bool is an int
+        return "TRUE" if value else "FALSE"
+    if isinstance( value, float ) and not math.isfinite( value ):
+        return NON_FINITE[ repr( value ) ] + "::double precision"
+    if isinstance( value, ( int, float ) ):
+        return repr( value )
+    if isinstance( value, ( list, tuple ) ):
+        if not value:
+            return "'{}'"
+        return "ARRAY[" + ", ".join( sql_literal(v) for v in value ) + "]"
+    # Standard conforming strings, so only quotes need escaping
+    return "'" + str( value ).replace( "'", "''" ) + "'"
+
+
+class SQL_Emitter:
+    """
+    Writes DB Commands to an open text stream, or to a file which only appears
+    once the script is complete, so that a failed extraction never leaves
+    behind a partial script that would load successfully.
+
+    """
+    def __init__( self, out, source="" ):
+        """
+        Out is an open text stream or the path of the file to write.
+
+        """
+        self.path = None
+        if isinstance( out, str ):
+            self.path = out
+            self.temp_path = out + '.' + str( os.getpid() ) + '.part'
+            out = open( self.temp_path, 'w' )
+        self.out = out
+        self.out.write( HEADER.format( source=source ) )
+
+    def write_command( self, db_command ):
+        """
+        Writes a completed DB Command as an SQL statement, ex:
+
+        SELECT UI_new_class( p_name:='Aircraft', p_alias:='AIR' ); -- line 12
+
+        """
+        parts = db_command.cmd.split( PARAM_PLACE )
+        statement = [ parts[0] ]
+        for value, part in zip( db_command.pvals, parts[1:] ):
+            statement += [ sql_literal( value ), part ]
+        self.out.write( "SELECT {};{}\n".format( "".join( statement ),
+            "" if db_command.line_no is None else " -- line " + str(db_command.line_no) ) )
+
+    def close( self ):
+        """
+        The script is complete.
+
+        """
+        if self.path:
+            self.out.close()
+            os.replace( self.temp_path, self.path )
+        else:
+            self.out.flush()
+
+    def abort( self, message ):
+        """
+        The script is incomplete and must never load.  A file is discarded.
+        A stream already sent on its way gets a statement that fails the load.
+
+        """
+        if self.path:
+            self.out.close()
+            os.remove( self.temp_path )
+        else:
+            self.out.write( ABORT.format( message=sql_literal( message ) ) )
+            self.out.flush()
+
+
+if __name__ == '__main__':
+    for v in ( None, True, 42, "Air Traffic Controller", "O'Hare", [ "A", "B" ] ):
+        print( "{!r:>30} -> {}".format( v, sql_literal( v ) ) )
@@ -38,9 +38,6 @@ The Legal Sequence association class / relationship captures this information.
 # System
 import re
 
-# Diagnostic
-import pdb # debug
-
 # Local
 
 # Global
@@ -75,7 +72,7 @@ Section = {
 # Grammar for section headers:
 #
 # model -> { domain }, [<bridges>]
-# domain -> [<types>], { subsystem }, [<cloops>], [<lineages>]
+# domain -> [<types>], { subsystem }, [<loops>], [<lineages>]
 # subsystem -> [classes], [<relationships>], [<lifecycles>]
 #
 # Key: -> = 'is composed of', {} = 'one or more', [] = 'optional', <> = 'atomic'
@@ -88,29 +85,51 @@ Section_Order = { # Explicit ordering only
     'types':{ 'subsystem' },
     'subsystem':{ 'classes', 'domain', 'bridges' },
     'classes':{
-        'relationships', 'lifecycles', 'cloops', 'lineages',
+        'relationships', 'lifecycles', 'loops', 'lineages',
         'subsystem', 'domain', 'bridges'
     },
     'relationships':{
-        'lifecycles', 'cloops', 'lineages', 'subsystem', 'domain', 'bridges'
+        'lifecycles', 'loops', 'lineages', 'subsystem', 'domain', 'bridges'
     },
     'lifecycles':{
-        'cloops', 'lineages', 'subsystem', 'domain', 'bridges'
+        'loops', 'lineages', 'subsystem', 'domain', 'bridges'
     },
     'bridges':{ 'domain' },
-    'cloops':{ 'lineages', 'subsystem', 'domain', 'bridges' },
+    'loops':{ 'lineages', 'subsystem', 'domain', 'bridges' },
     'lineages':{ 'subsystem', 'domain', 'bridges' }
 }
 
+# Section Order compiled into a transition table.  Each section is numbered
+# and the sections that may follow it are a bit mask, so checking a header is
+# a dict lookup and a bit test.
+Section_Number = { name: n for n, name in enumerate( Section ) }
+Section_Transition = [
+    sum( 1 << Section_Number[s] for s in Section_Order.get( name, () ) ) for name in Section ]
+
 # Constants
 
 # Regex
 section_RE = re.compile( r'^\s*(?P<name>\w+)\s*$' )
 
+
+def legal_next( current_section, section_name ):
+    """
+    True if the section may follow the current section.  Both must be in
+    Section.
+
+    """
+    return bool( Section_Transition[ Section_Number[current_section] ] >>
+            Section_Number[section_name] & 1 )
+
+
 if __name__ == '__main__':
     from pprint import pprint
     print( "Section Names:\n" )
     pprint( Section )
     print( "\nSection Order:\n" )
     pprint( Section_Order )
+    print( "\nSection Transition:\n" )
+    for name in Section:
+        print( "{:<14}{}".format( name, " ".join( "1" if legal_next( name, s ) else "."
+            for s in Section ) ) )
     print()
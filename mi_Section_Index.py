@@ -0,0 +1,271 @@
+#! /usr/bin/env python
+
+"""
+Class: Section Index
+
+Where each section of a text script starts, found by a first pass over the
+script that reads only its section headers.
+
+The headers are found in the raw bytes of the script, memory mapped,
+without decoding or stripping the statement lines in between, and checked
+against the Section Order transition table as they are found.  So a section
+out of order is reported before any statement is parsed, rather than after
+everything that comes before it has been.  Fragments are followed through their include
+lines, so that their headers are checked in place.
+
+Each header is indexed with its line and byte offset.  A domain or subsystem
+is also indexed by its name, taken from the statement that follows its
+header, so a caller can read a given domain or subsystem straight from its
+offset without parsing what comes before it, see read().  The index keeps
+only the headers, never the script itself.  A domain or subsystem is only
+indexed by name if its header is in the script itself rather than in a
+fragment.
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import re
+import os
+import sys
+import mmap
+import locale
+
+# Local
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
+if MODULE_DIR not in sys.path:
+    sys.path.append( MODULE_DIR )
+from mi_Error import *
+from mi_Section import Section, section_RE, legal_next
+from mi_Expression import Dispatch
+import mi_Fragment
+from mi_Fragment import INCLUDE_KEYWORD, include_RE, strip_comment
+
+# Constants
+COUNT_CHUNK = 2**20 # Bytes of a mapped script copied at once to count its lines
+NAMED_SECTIONS = ( 'domain', 'subsystem' ) # Indexed by the name of what they define
+# The headers that end each named section, along with everything in it
+Ended_By = {
+    'domain':{ 'domain', 'bridges' },
+    'subsystem':{ 'subsystem', 'domain', 'loops', 'lineages', 'bridges' }
+}
+
+# Regex
+# A line that could be a section header or an include line: a single word,
+# or the include keyword and more, with any comment.  Each one found is then
+# checked just as the extraction would.
+candidate_RB = re.compile( rb'^[^\S\n]*(?:[^\s#]+[^\S\n]*(?:#[^\n]*)?|'
+        + INCLUDE_KEYWORD.encode() + rb'[^\S\n][^\n]*)$', re.M )
+# The next statement, the first line with content that isn't a comment
+statement_RB = re.compile( rb'^[^\S\n]*([^\s#][^\n]*)$', re.M )
+
+
+def count_lines( buffer, start, end ):
+    """
+    Newlines in buffer[start:end], copying at most COUNT_CHUNK bytes at a
+    time, since an mmap can't count them in place.
+
+    """
+    return sum( buffer[ n:min( n + COUNT_CHUNK, end ) ].count( b'\n' )
+            for n in range( start, end, COUNT_CHUNK ) )
+
+
+class Section_Header:
+    """
+    A section header of the text script.  The name is that of the domain or
+    subsystem it defines, if it is a named section, and the domain is that of
+    the domain it is in, if any.
+
+    """
+    __slots__ = ( 'section', 'line_no', 'offset', 'name', 'domain' )
+
+    def __init__( self, section, line_no, offset, name=None, domain=None ):
+        self.section = section
+        self.line_no = line_no
+        self.offset = offset
+        self.name = name
+        self.domain = domain
+
+    def __repr__( self ):
+        return "{} {} at line {}".format( self.section, self.name or "", self.line_no )
+
+
+class Section_Index:
+    """
+    The section headers of the text script at path, in script order, checked
+    against the Section Order.  Raises a parse error for the first header
+    that is unrecognized or out of order.
+
+    The script is scanned in the buffer given, ex: the memory mapped script
+    that is about to be extracted, or else mapped just for the scan.
+
+    """
+    def __init__( self, path, buffer=None ):
+        self.path = path
+        self.encoding = locale.getpreferredencoding( False ) # As the script is read
+        self.size = 0
+        self.headers = []
+        self.domains = {} # domain name : Section_Header
+        self.subsystems = {} # ( domain name, subsystem name ) : Section_Header
+        self.section = 'model' # Current section of the pass
+        if buffer is not None:
+            self.scan( buffer )
+            return
+        try:
+            f = open( path, 'rb' )
+        except OSError:
+            raise mi_File_Error( "Cannot open", path )
+        with f:
+            if not os.fstat( f.fileno() ).st_size:
+                self.scan( b'' ) # Can't map an empty file
+                return
+            with mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ ) as buffer:
+                self.scan( buffer )
+
+    def scan( self, buffer ):
+        """
+        State: Scanning Headers
+
+        """
+        self.size = len( buffer )
+        line_no = 1
+        last = 0 # Offset line_no was counted up to
+        domain = None
+        including = [ os.path.abspath( self.path ) ]
+        for r in candidate_RB.finditer( buffer ):
+            line_no += count_lines( buffer, last, r.start() )
+            last = r.start()
+            line = strip_comment( r.group().decode( self.encoding ) )
+            if INCLUDE_KEYWORD in line:
+                i = include_RE.match( line )
+                if i:
+                    self.include( self.path, line_no, i.group('path'), including )
+                    continue
+            s = section_RE.match( line )
+            if not s:
+                continue
+            section = s.group('name')
+            self.check( section, self.path, line_no )
+            header = Section_Header( section, line_no, r.start(), domain=domain )
+            if section in NAMED_SECTIONS:
+                header.name = self.statement_name( buffer, section, r.end() )
+            if section == 'domain':
+                header.domain = domain = header.name
+                self.domains.setdefault( header.name, header )
+            elif section == 'subsystem':
+                self.subsystems.setdefault( ( domain, header.name ), header )
+            self.headers.append( header )
+
+    def check( self, section, fname, line_no ):
+        """
+        The section must be known and may follow the current section.
+
+        """
+        if section not in Section:
+            raise mi_Parse_Error( "Unrecognized section", fname, line_no, section )
+        if not legal_next( self.section, section ):
+            raise mi_Parse_Error( "Section in wrong context", fname, line_no, section )
+        self.section = section
+
+    def include( self, fname, line_no, path, including ):
+        """
+        Checks the headers of an included fragment in place, from its
+        classified lines, which the extraction then finds already classified.
+
+        """
+        fragment, lines = mi_Fragment.open_fragment( fname, line_no, path, self.section, including )
+        including.append( os.path.abspath( fragment ) )
+        for line in lines:
+            if line[1] == mi_Fragment.INCLUDE:
+                self.include( fragment, line[0], line[2], including )
+            elif line[1] == mi_Fragment.SECTION:
+                self.check( line[2], fragment, line[0] )
+        including.pop()
+
+    def statement_name( self, buffer, section, offset ):
+        """
+        The name given by the statement after the header at offset, or None
+        if there is none or it doesn't match.
+
+        """
+        r = statement_RB.search( buffer, offset )
+        if not r:
+            return None
+        text = strip_comment( r.group(1).decode( self.encoding ) ).strip()
+        if not text or section_RE.match( text ):
+            return None
+        expr, extracted = Dispatch[section].match( text )
+        return extracted['name'] if expr else None
+
+    def find( self, domain, subsystem=None ):
+        """
+        The header of the named domain, or of the named subsystem within it,
+        or None if there is no such section in the script.
+
+        """
+        if subsystem is None:
+            return self.domains.get( domain )
+        return self.subsystems.get( ( domain, subsystem ) )
+
+    def end( self, header ):
+        """
+        The offset of the end of the section starting at header: the next
+        header, or for a domain or subsystem the next header that ends it.
+
+        """
+        n = self.headers.index( header ) + 1
+        ended_by = Ended_By.get( header.section )
+        for h in self.headers[n:]:
+            if not ended_by or h.section in ended_by:
+                return h.offset
+        return self.size
+
+    def read( self, header ):
+        """
+        The lines of the section starting at header, as the script's lines
+        would be read, beginning with the header line at header.line_no.
+        Only the section is read from the script.
+
+        """
+        try:
+            with open( self.path, 'rb' ) as f:
+                f.seek( header.offset )
+                return mi_Fragment.text_lines( f.read( self.end( header ) - header.offset ) )
+        except OSError:
+            raise mi_File_Error( "Cannot open", self.path )
+
+
+def extract_domain( path, name, db_pop_script_obj ):
+    """
+    Extracts a single domain of the text script at path into the DB Population
+    Script, straight from its offset.  Its lines are numbered as in the script.
+
+    """
+    # Only needed here, so that the Extraction can pre-scan with this module
+    from mi_Extraction import Extraction
+
+    index = Section_Index( path )
+    header = index.find( name )
+    if not header:
+        raise mi_Error( "No domain {} in {}".format( name, path ) )
+    Extraction( path, db_pop_script_obj, index.read( header ), header.line_no )
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        index = Section_Index( path )
+        for header in index.headers:
+            print( "{}: line {:>6} offset {:>9} {}{}".format( path, header.line_no, header.offset,
+                header.section, " " + header.name if header.name else "" ) )
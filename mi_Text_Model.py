@@ -0,0 +1,84 @@
+#! /usr/bin/env python
+
+"""
+Text Model
+
+The library entry point: turns an miUML Text Script, given as text or as a
+file path, into a DB Population Script in the calling process, ex:
+
+    from mi_Text_Model import build_population_script
+    script = build_population_script( "models/atc.tm" )
+    script.execute( connection )
+
+Importing it changes nothing in the calling process beyond the module search
+path needed to find mi_Error.  The current directory is left alone, nothing
+is printed, and the API is loaded on the first call rather than at import.
+
+"""
+# --
+# Copyright 2012, Model Integration, LLC
+# Developer: Leon Starr / leon_starr@modelint.com
+
+# This file is part of the miUML metamodel library.
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.  The license text should be viewable at
+# http://www.gnu.org/licenses/
+# --
+# vim: tabstop=8 expandtab shiftwidth=4 softtabstop=4
+
+# System
+import os
+import sys
+
+# Local
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
+if MODULE_DIR not in sys.path:
+    sys.path.append( MODULE_DIR )
+from mi_Error import *
+from mi_API_Parser import API_Parser, API_Constructor_Call
+from mi_Parameter import Context_Parameter
+from mi_DB_Population_Script import DB_Population_Script
+from mi_Extraction import Extraction
+
+# Constants
+TEXT_NAME = "<text>" # Reported as the file name of a script given as text
+
+
+def build_population_script( source, name=None ):
+    """
+    Runs Phase 1 on a text script and returns its DB Population Script.  The
+    source is a file path, str or path-like, or the text of the script
+    itself, told apart by the text having at least one line break.
+    Any error is raised as an mi_Error with the line it was found on, reported
+    in the file named by name, the path by default.
+
+    """
+    if not API_Constructor_Call:
+        API_Parser()
+    # Nothing carries over from a script processed earlier in this process
+    for focus in Context_Parameter:
+        Context_Parameter[focus] = None
+    db_pop_script_obj = DB_Population_Script()
+    if isinstance( source, str ) and "\n" in source:
+        Extraction( name or TEXT_NAME, db_pop_script_obj, source.splitlines( True ) )
+    else:
+        Extraction( name or os.fspath( source ), db_pop_script_obj,
+            None if name is None else read_lines( source ) )
+    return db_pop_script_obj
+
+
+def read_lines( path ):
+    try:
+        with open( path ) as f:
+            return f.readlines()
+    except OSError:
+        raise mi_File_Error( "Cannot open", os.fspath( path ) )
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        script = build_population_script( path )
+        print( "{}: {} DB Commands".format( path, script.command_count() ) )
@@ -3,11 +3,23 @@
 """
 mitext command
 
-Takes a text miUML model file from the command line, reads it and populates the
-local miUML metamodel database.  The entire file is first scanned for syntax errors.
-If any are found, the database will not be touched.  Assuming success, each model
-element will be created until a metamodel error is encountered, at which point
-processing ends and no further elements are created.
+Takes one or more text miUML model files, or directories containing them, from
+the command line, reads each one and populates the local miUML metamodel
+database.  The entire file is first scanned for syntax errors.  If any are found,
+the database will not be touched.  Assuming success, each model element will be
+created until a metamodel error is encountered, at which point processing ends
+and no further elements are created.
+
+When several files are given, the syntax scan runs on a pool of processes and
+the result for each file is reported in the order the files were given,
+followed by a summary.
+
+With --watch, the files are scanned again each time one of them is saved.
+With --serve, mitext stays up as a daemon running the command lines sent to
+it by mi_Daemon.py, see mi_Daemon.
+
+mitext may also be imported, main() runs a command line.  To build a DB
+Population Script in process, see mi_Text_Model.
 
 """
 # --
@@ -26,57 +38,276 @@ processing ends and no further elements are created.
 
 # System
 import os
-from sys import argv, stdin
+import sys
+import time
+import argparse
+import functools
 
-# Go to real code file directory, in case invoked by symbolic link
-# so we can find required relative parent/sibling directories
-# We must do this before importing anything local that uses relative paths
+# Local
+MODULE_DIR = os.path.join( os.path.dirname( os.path.abspath(__file__) ), os.pardir, "Modules" )
+if MODULE_DIR not in sys.path:
+    sys.path.append( MODULE_DIR )
+from mi_Error import *
+from mi_API_Parser import API_Parser, API_Constructor_Call
+from mi_DB_Population_Script import DEFAULT_BATCH_SIZE
+from mi_Batch import find_text_scripts, extract_all, load_all, roll_back_all, report
+from mi_Compiled_Model import COMPILED_EXT
+import mi_Fragment
+import mi_Log
+import mi_Phase_Timer
+import mi_Expression_Stats
+import mi_Daemon
 
-# The directory where the editor is launched is not necessarily the same
-# as the source code directory, particularly if a symbolic link is used.
-# We'll need it to get the correct path names of any command files specified
-# as arguments.
-launch_dir = os.getcwd()
+# Constants
+SQL_EXT = ".sql"
+WATCH_INTERVAL = 0.05 # Seconds between checks for saved files
 
-# Local modules and resource directories are easiest to find if we ensure
-# that the current directory is the source code directory.
-# So we go there immediately.  Realpath is used in case we are launched with
-# a symbolic link.
-os.chdir( os.path.dirname( os.path.realpath(__file__) ) )
+arg_parser = argparse.ArgumentParser( prog="mitext",
+        description="Validate miUML text model files and populate the miUML DB." )
+arg_parser.add_argument( "paths", nargs="*", metavar="miuml_text_file",
+        help="text model file, or a directory searched for .tm files" )
+arg_parser.add_argument( "-j", "--jobs", type=int, default=None,
+        help="worker processes for the syntax scan, one file at a time per worker "
+            "or, for a single large file, one domain at a time (default: one per core)" )
+arg_parser.add_argument( "--emit-sql", metavar="DEST",
+        help="don't touch the DB, write each model as an SQL script for psql -1 -f "
+            "instead: to a file, to a directory (one <model>.sql per model) "
+            "or to stdout with -" )
+arg_parser.add_argument( "--db", metavar="DSN",
+        help="populate the DB with this libpq connection string, ex: dbname=miuml" )
+arg_parser.add_argument( "--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+        help="API calls sent to the DB per round trip (default: %(default)s)" )
+arg_parser.add_argument( "--connections", type=int, default=1,
+        help="DB connections used at once to load independent domains of a model, "
+            "committed together with a two-phase commit (default: %(default)s)" )
+arg_parser.add_argument( "--bulk", action="store_true",
+        help="with --db, COPY the API calls of each model into staging tables and "
+            "apply them on the DB in one statement, for very large models" )
+arg_parser.add_argument( "--resumable", action="store_true",
+        help="with --db, commit each domain and subsystem as it is loaded and keep "
+            "a <model>.journal, so that a failed load resumes where it stopped" )
+arg_parser.add_argument( "--rollback-load", action="store_true",
+        help="with --db, delete the domains committed by a failed resumable load "
+            "of each model instead of loading it" )
+arg_parser.add_argument( "--incremental", action="store_true",
+        help="reuse the results of each domain unchanged since the last run" )
+arg_parser.add_argument( "--skip-loaded", action="store_true",
+        help="with --incremental, don't load domains already loaded unchanged "
+            "into the same DB" )
+arg_parser.add_argument( "-v", "--verbose", action="count", default=0,
+        help="trace every statement and DB Command" )
+arg_parser.add_argument( "-q", "--quiet", action="store_true",
+        help="report only failures and the summary" )
+arg_parser.add_argument( "--timings", action="store_true",
+        help="report the time spent in each phase" )
+arg_parser.add_argument( "--timings-format", choices=( "text", "json" ), default="text",
+        help="report the timings readable or as JSON (default: %(default)s)" )
+arg_parser.add_argument( "--expr-stats", action="store_true",
+        help="report the attempts, matches, misses and time for each expression" )
+arg_parser.add_argument( "--expr-stats-format", choices=( "text", "json" ), default="text",
+        help="report the expression statistics readable or as JSON (default: %(default)s)" )
+arg_parser.add_argument( "--compile", metavar="DEST",
+        help="also write each model's API calls as a compiled model, which mitext "
+            "loads without parsing: to a file or to a directory (one <model>.tmc "
+            "per model)" )
+arg_parser.add_argument( "--no-cache", action="store_true",
+        help="don't reuse or save the API calls of models in the local cache" )
+arg_parser.add_argument( "--mmap", action="store_true",
+        help="scan each text file memory mapped instead of line by line" )
+arg_parser.add_argument( "--lexer", action="store_true",
+        help="classify statements with hand-written lexers, linear in the length of "
+            "any line, instead of the regular expressions" )
+arg_parser.add_argument( "--identifiers", action="store_true",
+        help="also create each class's identifiers, with one new_ids API call per "
+            "class: the miUML DB must provide UI_new_ids" )
+arg_parser.add_argument( "--watch", action="store_true",
+        help="keep running and scan each file again whenever it is saved" )
+arg_parser.add_argument( "--serve", nargs="?", const=mi_Daemon.DEFAULT_SOCKET, metavar="SOCKET",
+        help="run as a daemon for mi_Daemon.py on this Unix socket "
+            "(default: %(const)s)" )
 
-# Local
-from mi_DB_Population_Script import DB_Population_Script
-from mi_API_Parser import API_Parser
-from mi_Extraction import Extraction
 
-# Diagnostic
-import pdb
+def output_paths( dest, ext, tfile_paths, launch_dir, out ):
+    """
+    One output path for each model: the destination itself for a single
+    model, unless it is a directory, otherwise <model><ext> in the directory.
+    None if models would share one.
+
+    """
+    dest = os.path.join( launch_dir, dest )
+    if len( tfile_paths ) == 1 and not os.path.isdir( dest ):
+        return [ dest ]
+    os.makedirs( dest, exist_ok=True )
+    outs = [ os.path.join( dest,
+        os.path.splitext( os.path.basename(p) )[0] + ext ) for p in tfile_paths ]
+    if len( set( outs ) ) < len( outs ):
+        print( "Models with the same file name can't share an output directory", file=out )
+        return None
+    return outs
+
+
+def main( argv, launch_dir=None, out=sys.stdout, err=sys.stderr, served=False ):
+    """
+    Runs one mitext command line, with any relative paths relative to the
+    launch directory, the current directory by default, and returns the exit
+    status.  A command line served by the daemon may not keep it busy for good.
+
+    """
+    launch_dir = launch_dir or os.getcwd()
+    args = arg_parser.parse_args( argv )
+    if served and ( args.serve or args.watch ):
+        print( "--serve and --watch never return, the daemon can't run them", file=out )
+        return 1
+    if args.serve:
+        # The daemon runs each command line it is sent through here
+        if not API_Constructor_Call:
+            API_Parser()
+        mi_Daemon.serve( args.serve, functools.partial( main, served=True ) )
+        return 0
+    if not args.paths:
+        arg_parser.error( "at least one miuml_text_file is required" )
+    if args.db and args.emit_sql:
+        print( "--db and --emit-sql are mutually exclusive", file=out )
+        return 1
+    if args.compile and args.emit_sql:
+        print( "--compile and --emit-sql are mutually exclusive", file=out )
+        return 1
+    if ( args.resumable or args.rollback_load or args.bulk ) and not args.db:
+        print( "--bulk, --resumable and --rollback-load need --db", file=out )
+        return 1
+    if args.bulk and ( args.resumable or args.connections > 1 ):
+        print( "--bulk loads each model in one statement, it can't be used with "
+                "--resumable or --connections", file=out )
+        return 1
+    if args.resumable and args.connections > 1:
+        print( "--resumable loads on a single connection, it can't be used with "
+                "--connections", file=out )
+        return 1
+    if args.watch and ( args.db or args.emit_sql == '-' ):
+        print( "--watch only scans, it can't be used with --db or --emit-sql -", file=out )
+        return 1
+
+    # Verify that the files exist before connecting to the db
+    # Relative paths are relative to where we were launched
+    tfile_paths, missing = find_text_scripts(
+            [ os.path.join( launch_dir, p ) for p in args.paths ] )
+    for m in missing:
+        print( "Could not open: " + m, file=out )
+    if missing or not tfile_paths:
+        # We'll test again for an open error when we start processing it
+        return 1
+
+    # Decide where any SQL scripts go
+    sql_outs = None
+    report_out = out
+    if args.emit_sql == '-':
+        if len( tfile_paths ) > 1:
+            print( "Only one model may be written to stdout", file=out )
+            return 1
+        sql_outs = [ out ]
+        report_out = err # Keep the SQL clean
+    elif args.emit_sql:
+        sql_outs = output_paths( args.emit_sql, SQL_EXT, tfile_paths, launch_dir, out )
+        if not sql_outs:
+            return 1
+    compile_outs = None
+    if args.compile:
+        compile_outs = output_paths( args.compile, COMPILED_EXT, tfile_paths, launch_dir, out )
+        if not compile_outs:
+            return 1
+
+    mi_Log.configure( mi_Log.QUIET if args.quiet else args.verbose, report_out )
+    if args.rollback_load:
+        # Nothing to extract, the journals name the domains
+        return 1 if roll_back_all( tfile_paths, args.db, report_out ) else 0
+    mi_Phase_Timer.Timing['enabled'] = bool( args.timings )
+    mi_Expression_Stats.Stats['enabled'] = bool( args.expr_stats )
+    phases_before = mi_Phase_Timer.snapshot()
+    stats_before = mi_Expression_Stats.snapshot()
+
+    # Load the metamodel constructor API, already loaded in a daemon
+    with mi_Phase_Timer.phase( 'api_load' ):
+        if not API_Constructor_Call:
+            API_Parser()
+
+    # Begin the extraction
+    # Any diagnostic output goes wherever the report goes
+    options = { 'incremental':args.incremental or args.skip_loaded,
+            'skip_loaded':args.skip_loaded, 'target':args.db, 'records':bool( args.db ),
+            'timings':bool( args.timings ), 'expr_stats':bool( args.expr_stats ),
+            'scan':args.mmap, 'lexer':args.lexer, 'identifiers':args.identifiers,
+            'cache':not args.no_cache }
+    results = extract_all( tfile_paths, args.jobs, sql_outs, options, compile_outs )
+    # The DB is only touched if every script is free of syntax errors
+    if args.db and all( r['ok'] for r in results ):
+        load_all( results, args.db, args.batch_size, args.connections, args.resumable,
+                args.bulk )
+    failed = report( results, report_out, args.quiet )
+    if args.timings:
+        print( mi_Phase_Timer.report( mi_Phase_Timer.difference(
+            mi_Phase_Timer.snapshot(), phases_before ), args.timings_format == "json" ),
+            file=report_out )
+    if args.expr_stats:
+        print( mi_Expression_Stats.report( mi_Expression_Stats.difference(
+            mi_Expression_Stats.snapshot(), stats_before ), args.expr_stats_format == "json" ),
+            file=report_out )
+    if args.watch:
+        watch( args, launch_dir, options, dict( zip( tfile_paths, sql_outs or [] ) ),
+                dict( zip( tfile_paths, compile_outs or [] ) ), report_out )
+    return 1 if failed else 0
 
-if __name__ != '__main__':
-    print( os.path.basename(__file__) +
-        " must be executed from the command line and not imported."
-    )
-    exit(1)
 
-# For now we will process a single file only, make sure one is specified
-if len( argv ) != 2:
-    print( "Usage: mitext miuml_text_file" )
-    exit(1)
+def watch( args, launch_dir, options, sql_out, compile_out, report_out ):
+    """
+    Scans each text script again whenever its modification time or that of a
+    fragment it includes changes, and any new one found in a directory being
+    watched, until interrupted.  Files are polled, which costs next to nothing
+    between saves.
 
-# Verify that the file exists before connecting to the db
+    """
+    fragments = {} # text script : ( its modification time, paths of its fragments )
 
-tfile_abs_path = os.path.join( launch_dir, argv[1] )
-if not os.path.isfile( tfile_abs_path ):
-    print( "Could not open: " + tfile_abs_path )
-    # We'll test again for an open error when we start processing it
-    exit(1)
+    def mtime( p ):
+        try:
+            return os.stat( p ).st_mtime_ns
+        except OSError:
+            return None # Missing, or being replaced by an editor's save
 
+    def modified( paths ):
+        times = {}
+        for p in paths:
+            t = mtime( p )
+            if t is None:
+                continue
+            if p.endswith( COMPILED_EXT ):
+                fragments[p] = ( t, [] )
+            elif p not in fragments or fragments[p][0] != t: # Only read again once saved
+                try:
+                    fragments[p] = ( t, mi_Fragment.included_paths( p ) )
+                except ( mi_Error, UnicodeDecodeError ):
+                    fragments[p] = ( t, [] ) # The scan reports it
+            times[p] = ( t, ) + tuple( mtime( f ) for f in fragments[p][1] )
+        return times
 
-# Load the metamodel constructor API
-API_Parser()
+    paths = [ os.path.join( launch_dir, p ) for p in args.paths ]
+    seen = modified( find_text_scripts( paths )[0] )
+    print( "Watching {} text scripts".format( len( seen ) ), file=report_out )
+    try:
+        while True:
+            time.sleep( WATCH_INTERVAL )
+            now = modified( find_text_scripts( paths )[0] )
+            changed = [ p for p, t in now.items() if seen.get( p ) != t ]
+            seen = now
+            if not changed:
+                continue
+            results = extract_all( changed, args.jobs,
+                    [ sql_out.get( p ) for p in changed ] if sql_out else None, options,
+                    [ compile_out.get( p ) for p in changed ] if compile_out else None )
+            report( results, report_out, args.quiet )
+            report_out.flush()
+    except KeyboardInterrupt:
+        pass
 
-# Create singleton classes
-db_pop_script_obj = DB_Population_Script( )
 
-# Begin the extraction
-Extraction( tfile_abs_path, db_pop_script_obj )
+if __name__ == '__main__':
+    sys.exit( main( sys.argv[1:] ) )